@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+import time
+
+# Resumable upload chunks must be a multiple of 256KB
+CHUNK_ALIGNMENT = 256 * 1024
+
+
+def align_chunk_size(chunk_size):
+    """
+        Round a chunk size down to a multiple of 256KB, never below 256KB
+    """
+    return max(CHUNK_ALIGNMENT, int(chunk_size) // CHUNK_ALIGNMENT * CHUNK_ALIGNMENT)
+
+
+class AdaptiveChunkSizer:
+    """
+        Picks the size of the next chunk of a resumable upload from the measured throughput
+        and error rate. Chunks grow while they go through cleanly, aiming for each chunk to
+        take about target_seconds, and are halved after every retry so less data has to be
+        re-sent on a flaky link.
+    """
+
+    def __init__(self, initial_chunk_size, minimum_chunk_size=CHUNK_ALIGNMENT,
+                 maximum_chunk_size=256 * 1024 * 1024, target_seconds=20):
+        self.minimum_chunk_size = align_chunk_size(minimum_chunk_size)
+        self.maximum_chunk_size = align_chunk_size(maximum_chunk_size)
+        self.target_seconds = target_seconds
+        self.chunk_size = self.clamp(initial_chunk_size)
+
+    def clamp(self, chunk_size):
+        return align_chunk_size(min(self.maximum_chunk_size, max(self.minimum_chunk_size, chunk_size)))
+
+    def record_chunk(self, bytes_sent, seconds):
+        """
+            Grow the chunk size after a chunk was sent without errors.
+            The size at most doubles each step.
+        """
+        if bytes_sent <= 0 or seconds <= 0:
+            return self.chunk_size
+        target = bytes_sent / seconds * self.target_seconds
+        self.chunk_size = self.clamp(min(self.chunk_size * 2, max(self.chunk_size, target)))
+        return self.chunk_size
+
+    def record_retry(self):
+        """
+            Halve the chunk size after a failed chunk
+        """
+        self.chunk_size = self.clamp(self.chunk_size // 2)
+        return self.chunk_size
+
+
+class UploadMetrics:
+    """
+        Throughput, chunk and retry counts for the upload of a single file
+    """
+
+    def __init__(self, title):
+        self.title = title
+        self.bytes_sent = 0
+        self.chunks = 0
+        self.retries = 0
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        if self.started is None:
+            self.started = time.time()
+
+    def record_chunk(self, bytes_sent):
+        self.bytes_sent += bytes_sent
+        self.chunks += 1
+
+    def record_retry(self):
+        self.retries += 1
+
+    def finish(self):
+        self.finished = time.time()
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def bytes_per_second(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.bytes_sent / self.elapsed
+
+    def summary(self):
+        return "{0}: {1:.1f} MB in {2:.1f}s ({3:.2f} MB/s), {4} chunk(s), {5} retry(s)".format(
+            self.title, self.bytes_sent / 1048576.0, self.elapsed,
+            self.bytes_per_second / 1048576.0, self.chunks, self.retries)
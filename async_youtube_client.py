@@ -0,0 +1,390 @@
+#!/usr/bin/python3
+
+import asyncio
+import json
+import os
+import random
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from adaptive_chunking import AdaptiveChunkSizer, UploadMetrics
+from metadata_sync import MAX_IDS_PER_LIST, chunks, get_metadata_update, record_update
+from quota_scheduler import QuotaExceeded, QUOTA_EXCEEDED_REASONS
+from youtube_video_manager import UploadError
+
+# Errors of a request worth retrying besides the retriable status codes. asyncio raises a
+# plain TimeoutError, not a ClientError, when a socket timeout expires.
+RETRIABLE_EXCEPTIONS = (aiohttp.ClientError, asyncio.TimeoutError) if aiohttp is not None else ()
+
+# Seconds to wait for a connection and between reads of a response. There is no limit on
+# a whole request, a chunk takes as long as the link needs to send it.
+CONNECT_TIMEOUT = 30
+READ_TIMEOUT = 300
+
+# Root of the YouTube Data API REST endpoints
+YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3/"
+
+# Root of the YouTube Data API media upload endpoints
+YOUTUBE_UPLOAD_URL = "https://www.googleapis.com/upload/youtube/v3/"
+
+
+class AsyncYouTubeError(Exception):
+    """
+        Raised when the YouTube Data API answers a request with an error
+    """
+
+    def __init__(self, status, content):
+        super(AsyncYouTubeError, self).__init__("HTTP {0}: {1}".format(status, content))
+        self.status = status
+        self.content = content
+
+
+def describe_error(error):
+    """
+        Message of a retriable error, the TimeoutError of asyncio has none
+    """
+    return str(error) or type(error).__name__
+
+
+async def iterate_in_thread(iterable):
+    """
+        Iterate a blocking iterable, e.g. a streamed directory scan, without blocking the
+        event loop
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+class AsyncYouTubeClient:
+    """
+        asyncio client for the parts of the YouTube Data API used by --async: the REST calls
+        looking up and updating videos and the resumable upload protocol. Requests share a
+        pool of keep-alive connections so lookups, updates and uploads can all be in flight
+        at once from a single event loop. The channel is listed by YouTubeVideoManager.
+        Point api_url and upload_url at a local server to run against a fake backend.
+    """
+
+    # Status codes worth retrying
+    RETRIABLE_STATUS_CODES = [500, 502, 503, 504]
+
+    # Maximum number of times to retry a request before giving up
+    MAX_RETRIES = 10
+
+    # Status codes returned for a resumable session that no longer exists on the server
+    EXPIRED_SESSION_STATUS_CODES = [404, 410]
+
+    def __init__(self, get_access_token, api_url=YOUTUBE_API_URL, upload_url=YOUTUBE_UPLOAD_URL,
+                 connections=10, quota=None, chunk_size=32 * 1024 * 1024, telemetry=None, catalog=None,
+                 journal=None, adaptive_chunks=False):
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for the async client: pip install --upgrade aiohttp")
+        # Callable returning an OAuth 2.0 access token, called in a worker thread
+        self.get_access_token = get_access_token
+        self.api_url = api_url
+        self.upload_url = upload_url
+        self.connections = connections
+        self.quota = quota
+        self.chunk_size = chunk_size
+        self.telemetry = telemetry
+        # ChannelCatalog kept in step with the metadata updates
+        self.catalog = catalog
+        # UploadJournal of the resumable sessions, shared with the threaded uploads
+        self.journal = journal
+        self.adaptive_chunks = adaptive_chunks
+        self.session = None
+        self.api_calls = 0
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.connections, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def get_headers(self):
+        loop = asyncio.get_running_loop()
+        token = await loop.run_in_executor(None, self.get_access_token)
+        return {"Authorization": "Bearer {0}".format(token)}
+
+    async def reserve(self, method, count=1):
+        """
+            Charge the quota of a call, the token bucket may sleep so it runs off the loop
+        """
+        if self.quota is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.quota.reserve, method, count)
+
+    def check_quota_exceeded(self, status, content):
+        if status == 403 and any(reason in content for reason in QUOTA_EXCEEDED_REASONS):
+            if self.quota is not None:
+                self.quota.exhausted()
+            raise QuotaExceeded("YouTube reports the daily quota is used up")
+
+    async def request(self, http_method, method, params=None, body=None):
+        """
+            Call a REST method e.g. request("GET", "videos.list", {"id": ..., "part": ...}).
+            Retries server errors with exponential backoff and returns the decoded response.
+        """
+        await self.reserve(method)
+        url = self.api_url + method.split(".")[0]
+        retry = 0
+        while True:
+            self.api_calls += 1
+            try:
+                async with self.session.request(http_method, url, params=params, json=body,
+                                                headers=await self.get_headers()) as response:
+                    content = await response.text()
+                    if response.status < 300:
+                        return json.loads(content) if content else {}
+                    self.check_quota_exceeded(response.status, content)
+                    error = AsyncYouTubeError(response.status, content)
+                    if response.status not in self.RETRIABLE_STATUS_CODES:
+                        raise error
+            except RETRIABLE_EXCEPTIONS as e:
+                error = e
+            retry += 1
+            if retry > self.MAX_RETRIES:
+                raise error
+            await asyncio.sleep(random.random() * 2 ** retry)
+
+    async def list_videos(self, video_ids, part="snippet,status"):
+        """
+            Fetch video resources 50 ids per call, with the calls running concurrently
+        """
+        responses = await asyncio.gather(*[
+            self.request("GET", "videos.list", {"id": ",".join(batch), "part": part})
+            for batch in chunks(list(video_ids), MAX_IDS_PER_LIST)
+        ])
+        return [video for response in responses for video in response["items"]]
+
+    async def update_videos_metadata(self, desired_metadata):
+        """
+            Async counterpart of YouTubeVideoManager.update_videos_metadata. Returns the list
+            of the ids of updated videos or False if any video was not found or failed to update.
+        """
+        updates = []
+        videos = await self.list_videos(desired_metadata)
+        missing = set(desired_metadata) - set(video["id"] for video in videos)
+        for video_id in sorted(missing):
+            print("Unable to update the metadata of {0}, the video was not found".format(video_id))
+        for video in videos:
+            update = get_metadata_update(video, desired_metadata[video["id"]])
+            if update is not None:
+                updates.append(update)
+        responses = await asyncio.gather(*[
+            self.request("PUT", "videos.update", {"part": part}, body)
+            for video_id, part, body in updates
+        ], return_exceptions=True)
+        updated = []
+        failed = False
+        for (video_id, part, body), response in zip(updates, responses):
+            if isinstance(response, QuotaExceeded):
+                raise response
+            if isinstance(response, Exception):
+                print("Failed to update the metadata of {0}: {1}".format(video_id, response))
+                failed = True
+                continue
+            updated.append(video_id)
+            if self.catalog is not None:
+                record_update(self.catalog, video_id, response)
+        if failed or missing:
+            return False
+        return updated
+
+    async def upload_video(self, options, progress_callback=None, metrics=None):
+        """
+            Upload a video with the resumable upload protocol, see
+            YouTubeVideoManager.upload_video for the options. Returns the id of the video.
+            Like the threaded uploads, the session is journaled after each chunk so an
+            interrupted upload resumes on the next run, and with adaptive_chunks the chunk
+            size follows the measured throughput.
+        """
+        if metrics is None:
+            metrics = UploadMetrics(options["title"])
+        tags = options["keywords"].split(",") if options.get("keywords") else None
+        body = {
+            "snippet": {
+                "title": options["title"],
+                "description": options["description"],
+                "tags": tags,
+                "categoryId": options.get("category", "28")
+            },
+            "status": {"privacyStatus": options["privacyStatus"]}
+        }
+        media_file = options.get("media_file", options["file"])
+        size = os.path.getsize(media_file)
+
+        loop = asyncio.get_running_loop()
+        sizer = AdaptiveChunkSizer(self.chunk_size) if self.adaptive_chunks else None
+        session_uri = None
+        session_charged = False
+        offset = 0
+        retry = 0
+        video_id = None
+        # Carry on from an interrupted upload of the same file if there is one
+        entry = await loop.run_in_executor(None, self.journal.get, media_file) if self.journal is not None else None
+        if entry is not None:
+            print("Resuming upload of {0} from byte {1}".format(media_file, entry["offset"]))
+            session_uri = entry["session_uri"]
+            offset, video_id = await self.query_upload_offset(session_uri, size, entry["offset"])
+            if offset is None:
+                print("The upload session for {0} has expired, restarting the upload".format(options["title"]))
+                session_uri = None
+        metrics.start()
+        with open(media_file, "rb") as video_file:
+            while video_id is None:
+                try:
+                    # Starting a new upload session costs the quota of a videos.insert
+                    if session_uri is None:
+                        if not session_charged:
+                            await self.reserve("videos.insert")
+                            session_charged = True
+                        session_uri = await self.start_upload_session(body, size)
+                        offset = 0
+                        await self.update_journal(media_file, session_uri, offset)
+                    video_file.seek(offset)
+                    chunk_size = sizer.chunk_size if sizer is not None else self.chunk_size
+                    data = await loop.run_in_executor(None, video_file.read, chunk_size)
+                    headers = await self.get_headers()
+                    headers["Content-Range"] = "bytes {0}-{1}/{2}".format(offset, offset + len(data) - 1, size) \
+                        if data else "bytes */{0}".format(size)
+                    self.api_calls += 1
+                    chunk_started = loop.time()
+                    async with self.session.put(session_uri, data=data, headers=headers) as response:
+                        content = await response.text()
+                        if response.status in (200, 201):
+                            video_id = json.loads(content)["id"]
+                            continue
+                        if response.status == 308:
+                            acknowledged = self.get_acknowledged_offset(response)
+                            metrics.record_chunk(acknowledged - offset)
+                            if sizer is not None:
+                                sizer.record_chunk(acknowledged - offset, loop.time() - chunk_started)
+                            offset = acknowledged
+                            # Only give up after MAX_RETRIES failures in a row, not over the whole file
+                            retry = 0
+                            await self.update_journal(media_file, session_uri, offset)
+                            if progress_callback is not None:
+                                progress_callback(offset, size)
+                            continue
+                        self.check_quota_exceeded(response.status, content)
+                        if response.status in self.EXPIRED_SESSION_STATUS_CODES:
+                            error = "The upload session for {0} has expired, restarting the upload".format(
+                                options["title"])
+                            session_uri = None
+                            await self.update_journal(media_file)
+                        elif response.status not in self.RETRIABLE_STATUS_CODES:
+                            raise UploadError("The upload failed with HTTP {0}: {1}".format(response.status, content))
+                        else:
+                            error = "A retriable HTTP error {0} occurred".format(response.status)
+                except RETRIABLE_EXCEPTIONS as e:
+                    error = "A retriable error occurred: {0}".format(describe_error(e))
+
+                retry += 1
+                metrics.record_retry()
+                if sizer is not None:
+                    sizer.record_retry()
+                if self.telemetry is not None:
+                    self.telemetry.record_retry("YouTube", media_file, error)
+                if retry > self.MAX_RETRIES:
+                    raise UploadError("No longer attempting to retry: {0}".format(error))
+                await asyncio.sleep(random.random() * 2 ** retry)
+                if session_uri is not None:
+                    offset, video_id = await self.query_upload_offset(session_uri, size, offset)
+                    if offset is None:
+                        session_uri = None
+                        await self.update_journal(media_file)
+
+        metrics.record_chunk(size - offset)
+        metrics.finish()
+        await self.update_journal(media_file)
+        if progress_callback is not None:
+            progress_callback(size, size)
+        print("Video id '{0}' was successfully uploaded.".format(video_id))
+        return video_id
+
+    async def update_journal(self, media_file, session_uri=None, offset=0):
+        """
+            Journal the session and acknowledged offset of an upload, or forget the upload
+            when session_uri is None. The journal is fsynced so it is written from a worker
+            thread.
+        """
+        if self.journal is None:
+            return
+        loop = asyncio.get_running_loop()
+        if session_uri is None:
+            await loop.run_in_executor(None, self.journal.remove, media_file)
+        else:
+            await loop.run_in_executor(None, self.journal.record, media_file, session_uri, offset)
+
+    async def start_upload_session(self, body, size):
+        """
+            Open a resumable upload session and return its URI. Retries server errors with
+            exponential backoff like request().
+        """
+        params = {"uploadType": "resumable", "part": ",".join(body.keys())}
+        retry = 0
+        while True:
+            headers = await self.get_headers()
+            headers["X-Upload-Content-Type"] = "video/*"
+            headers["X-Upload-Content-Length"] = str(size)
+            self.api_calls += 1
+            try:
+                async with self.session.post(self.upload_url + "videos", params=params, json=body,
+                                             headers=headers) as response:
+                    content = await response.text()
+                    if response.status == 200 and "Location" in response.headers:
+                        return response.headers["Location"]
+                    self.check_quota_exceeded(response.status, content)
+                    error = UploadError("Unable to start the upload: HTTP {0}: {1}".format(response.status, content))
+                    if response.status not in self.RETRIABLE_STATUS_CODES:
+                        raise error
+            except RETRIABLE_EXCEPTIONS as e:
+                error = UploadError("Unable to start the upload: {0}".format(describe_error(e)))
+            retry += 1
+            if retry > self.MAX_RETRIES:
+                raise error
+            await asyncio.sleep(random.random() * 2 ** retry)
+
+    async def query_upload_offset(self, session_uri, size, offset):
+        """
+            Ask the server how much of an interrupted upload it holds. Returns the offset to
+            resume from, offset when the server could not tell or None when the session no
+            longer exists, and the id of the video when the upload turns out to be complete,
+            else None.
+        """
+        headers = await self.get_headers()
+        headers["Content-Range"] = "bytes */{0}".format(size)
+        try:
+            self.api_calls += 1
+            async with self.session.put(session_uri, headers=headers) as response:
+                content = await response.text()
+                if response.status in (200, 201):
+                    return offset, json.loads(content)["id"]
+                if response.status == 308:
+                    return self.get_acknowledged_offset(response), None
+                if response.status in self.EXPIRED_SESSION_STATUS_CODES:
+                    return None, None
+        except RETRIABLE_EXCEPTIONS:
+            pass
+        return offset, None
+
+    def get_acknowledged_offset(self, response):
+        """
+            The offset after the last byte the server acknowledged, from the Range header
+        """
+        byte_range = response.headers.get("Range")
+        if not byte_range:
+            return 0
+        return int(byte_range.split("-")[-1]) + 1
@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+
+import csv
+import json
+
+# Fields every event of a batch manifest needs, the other fields are options of its sync
+REQUIRED_FIELDS = ("video_directory", "connect_code")
+
+
+def load_batch_manifest(path):
+    """
+        Load the events of a batch manifest. A manifest is a JSON list of objects or a CSV
+        file with a header row, e.g.
+        [
+            {"video_directory": "/videos/SFO17", "connect_code": "SFO17", "playlist": "Linaro Connect SFO17"},
+            {"video_directory": "/videos/YVR18", "connect_code": "YVR18", "playlist_id": "PL...", "s3_prefix": "private/yvr18"}
+        ]
+        Fields other than video_directory and connect_code are named after the sync options,
+        e.g. playlist, playlist_id, s3_prefix or export. Empty fields are left out. Values are
+        returned as they were read, CSV values as strings.
+        Returns the list of event dictionaries.
+    """
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as manifest_file:
+            events = json.load(manifest_file)
+        if not isinstance(events, list):
+            raise ValueError("{0} should hold a list of events".format(path))
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as manifest_file:
+            events = [dict((key.strip(), value.strip()) for key, value in row.items() if key and value)
+                      for row in csv.DictReader(manifest_file)]
+
+    connect_codes = set()
+    for number, event in enumerate(events, 1):
+        event = dict((key, value) for key, value in event.items() if value not in (None, ""))
+        missing = [field for field in REQUIRED_FIELDS if field not in event]
+        if missing:
+            raise ValueError("Event {0} of {1} has no {2}".format(number, path, ", ".join(missing)))
+        connect_code = event["connect_code"].lower()
+        if connect_code in connect_codes:
+            raise ValueError("{0} lists {1} more than once".format(path, event["connect_code"]))
+        connect_codes.add(connect_code)
+        events[number - 1] = event
+    return events
@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from fake_backend import FakeBackend, create_video_directory
+from main import ConnectVideoManager, SyncConfig
+
+# Bucket the benchmarks sync to on the fake backend
+BENCHMARK_BUCKET = "connect-benchmark"
+
+# Sync modes that can be benchmarked and the extra arguments they run with
+MODES = {
+    "threads": [],
+    "pipeline": ["--pipeline"],
+    "async": ["--async"],
+}
+
+
+class Benchmark:
+    """
+        Runs full syncs against a local fake YouTube and S3 backend and reports the wall time,
+        API calls and bytes moved of each, so changes to scheduling, caching and parallelism
+        can be compared run to run without touching the real channel.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.results = []
+        # Scenarios whose syncs did not leave every video on YouTube and S3
+        self.failures = []
+
+    def run(self):
+        for mode in self.args.modes.split(","):
+            for jobs in [int(jobs) for jobs in self.args.jobs.split(",")]:
+                self.run_scenario(mode, jobs)
+        return self.results
+
+    def run_scenario(self, mode, jobs):
+        """
+            Run the sync repeat times in a fresh working directory against a fresh backend.
+            The first run is cold, later runs show the cost of a sync with nothing to do.
+        """
+        working_directory = tempfile.mkdtemp(prefix="connect-benchmark-")
+        backend = FakeBackend(latency=self.args.latency / 1000.0,
+                              bandwidth=int(self.args.bandwidth * 1024 * 1024) if self.args.bandwidth else None,
+                              error_rate=self.args.error_rate, seed=self.args.seed)
+        try:
+            with backend:
+                video_directory = os.path.join(working_directory, "videos")
+                create_video_directory(video_directory, self.args.videos, int(self.args.size * 1024 * 1024),
+                                       self.args.connect_code)
+                # Videos of other Connects plus the part of this Connect already uploaded
+                backend.youtube.populate(self.args.channel_videos, connect_code="other")
+                backend.youtube.populate(self.args.already_uploaded, connect_code=self.args.connect_code)
+                backend.s3.create_bucket(BENCHMARK_BUCKET)
+
+                for run in range(1, self.args.repeat + 1):
+                    backend.reset_counters()
+                    try:
+                        result = self.run_sync(backend, working_directory, video_directory, mode, jobs)
+                    except Exception as e:
+                        self.record_failure(mode, jobs, "run {0} raised {1}: {2}".format(run, type(e).__name__, e))
+                        continue
+                    result.update({"mode": mode, "jobs": jobs, "run": run})
+                    self.results.append(result)
+                    print(self.format_result(result))
+                self.check_outcome(backend, mode, jobs)
+        finally:
+            shutil.rmtree(working_directory, ignore_errors=True)
+
+    def run_sync(self, backend, working_directory, video_directory, mode, jobs):
+        argv = [
+            video_directory, self.args.connect_code,
+            "--jobs", str(jobs),
+            "--chunk-size", str(self.args.chunk_size),
+            "--daily-quota", str(10 ** 9),
+            "--s3-bucket", BENCHMARK_BUCKET,
+            "--s3-profile", "",
+            "--s3-endpoint-url", backend.url,
+        ] + MODES[mode] + self.args.extra
+
+        current_directory = os.getcwd()
+        # The caches and ledgers of the sync live in the working directory of the scenario
+        os.chdir(working_directory)
+        try:
+            with contextlib.ExitStack() if self.args.verbose else contextlib.redirect_stdout(io.StringIO()):
+                connect_video_manager = ConnectVideoManager(SyncConfig.from_argv(argv), service=backend.get_youtube_service())
+                started = time.time()
+                connect_video_manager.main()
+                wall_time = time.time() - started
+        finally:
+            os.chdir(current_directory)
+
+        return {
+            "wall_time": round(wall_time, 3),
+            "requests": backend.requests,
+            "youtube_api_calls": sum(count for method, count in backend.api_calls.items() if not method.startswith("s3.")),
+            "s3_api_calls": sum(count for method, count in backend.api_calls.items() if method.startswith("s3.")),
+            "api_calls": dict(backend.api_calls),
+            "youtube_bytes": backend.youtube.bytes_received,
+            "s3_bytes": backend.s3.bytes_received,
+            "errors_injected": backend.errors_injected,
+            "uploaded": len(backend.youtube.uploaded),
+            "stages": dict((stage, round(seconds, 3)) for stage, seconds in connect_video_manager.telemetry.stages.items()),
+        }
+
+    def check_outcome(self, backend, mode, jobs):
+        """
+            Check the syncs of a scenario uploaded every video to YouTube and S3 exactly once
+        """
+        expected_uploads = self.args.videos - min(self.args.already_uploaded, self.args.videos)
+        uploaded = len(backend.youtube.uploaded)
+        objects = len(backend.s3.buckets[BENCHMARK_BUCKET])
+        problems = []
+        if uploaded != expected_uploads:
+            problems.append("{0} YouTube upload(s) instead of {1}".format(uploaded, expected_uploads))
+        if "--skip-s3" not in self.args.extra and objects != self.args.videos:
+            problems.append("{0} S3 object(s) instead of {1}".format(objects, self.args.videos))
+        for problem in problems:
+            self.record_failure(mode, jobs, problem)
+
+    def record_failure(self, mode, jobs, problem):
+        print("{0:<9} jobs={1:<3} FAILED: {2}".format(mode, jobs, problem))
+        self.failures.append({"mode": mode, "jobs": jobs, "problem": problem})
+
+    def format_result(self, result):
+        return ("{mode:<9} jobs={jobs:<3} run={run} wall={wall_time:8.2f}s requests={requests:<6} "
+                "youtube_calls={youtube_api_calls:<6} s3_calls={s3_api_calls:<6} "
+                "youtube={youtube_mb:9.1f}MB s3={s3_mb:9.1f}MB errors={errors_injected}").format(
+                    youtube_mb=result["youtube_bytes"] / 1048576.0, s3_mb=result["s3_bytes"] / 1048576.0, **result)
+
+    def compare(self, baseline_path):
+        """
+            Print the change in wall time and API calls of each scenario from a saved run
+        """
+        with open(baseline_path) as baseline_file:
+            baseline = dict(((result["mode"], result["jobs"], result["run"]), result)
+                            for result in json.load(baseline_file)["results"])
+        print("Compared with {0}:".format(baseline_path))
+        for result in self.results:
+            previous = baseline.get((result["mode"], result["jobs"], result["run"]))
+            if previous is None:
+                continue
+            print("{0:<9} jobs={1:<3} run={2} wall {3:+.1%} requests {4:+d} youtube_calls {5:+d}".format(
+                result["mode"], result["jobs"], result["run"],
+                (result["wall_time"] - previous["wall_time"]) / previous["wall_time"] if previous["wall_time"] else 0.0,
+                result["requests"] - previous["requests"],
+                result["youtube_api_calls"] - previous["youtube_api_calls"]))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark full syncs against a local fake YouTube and S3 backend",
+        epilog="Arguments after -- are passed to every sync e.g. -- --adaptive-chunks --skip-s3")
+    parser.add_argument("--videos", type=int, default=20, metavar="N",
+                        help="Number of local videos (default: 20)")
+    parser.add_argument("--size", type=float, default=64, metavar="MB",
+                        help="Size of each local video, the files are sparse (default: 64)")
+    parser.add_argument("--already-uploaded", type=int, default=0, metavar="N",
+                        help="Number of the local videos already on the channel (default: 0)")
+    parser.add_argument("--channel-videos", type=int, default=1000, metavar="N",
+                        help="Number of videos of other Connects on the channel (default: 1000)")
+    parser.add_argument("--connect-code", default="yvr18", metavar="CODE",
+                        help="Connect code of the local videos (default: yvr18)")
+    parser.add_argument("--modes", default="threads", metavar="MODE[,MODE...]",
+                        help="Sync modes to benchmark from {0} (default: threads)".format(", ".join(MODES)))
+    parser.add_argument("--jobs", default="1,4", metavar="N[,N...]",
+                        help="Values of --jobs to benchmark (default: 1,4)")
+    parser.add_argument("--chunk-size", type=float, default=8, metavar="MB",
+                        help="Chunk size of the YouTube uploads (default: 8)")
+    parser.add_argument("--repeat", type=int, default=2, metavar="N",
+                        help="Number of syncs per scenario, the first is cold (default: 2)")
+    parser.add_argument("--latency", type=float, default=0, metavar="MS",
+                        help="Latency added to every request (default: 0)")
+    parser.add_argument("--bandwidth", type=float, default=0, metavar="MB",
+                        help="Upload bandwidth of the backend in MB/s shared by every connection, 0 for no cap (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0, metavar="P",
+                        help="Probability of a request failing with a retriable 503 (default: 0)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the injected errors (default: 0)")
+    parser.add_argument("--output", metavar="PATH",
+                        help="Save the results as JSON to compare later runs with")
+    parser.add_argument("--baseline", metavar="PATH",
+                        help="Results saved by an earlier run to compare with")
+    parser.add_argument("-V", "--verbose", action="store_true",
+                        help="Show the output of the syncs")
+    parser.add_argument("extra", nargs="*", help=argparse.SUPPRESS)
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    # The fake backend accepts any credentials
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+
+    benchmark = Benchmark(args)
+    results = benchmark.run()
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"arguments": vars(args), "results": results, "failures": benchmark.failures}, output_file, indent=2)
+    if args.baseline:
+        benchmark.compare(args.baseline)
+    if benchmark.failures:
+        sys.exit(1)
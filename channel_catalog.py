@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+import sqlite3
+import threading
+
+from reconciliation_index import normalize_session_id
+
+# Adds a video or replaces its details, keeping the processing status recorded for it
+UPSERT_VIDEO = (
+    "INSERT INTO videos (video_id, session_id, title, description, etag, published_at, privacy_status) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(video_id) DO UPDATE SET session_id = excluded.session_id, "
+    "title = excluded.title, description = excluded.description, etag = excluded.etag, "
+    "published_at = excluded.published_at, privacy_status = excluded.privacy_status")
+
+
+def get_row(video):
+    """
+        The row of the videos table of a ChannelVideo, without its processing status
+    """
+    return (video.video_id, normalize_session_id(video.title), video.title, video.description, video.etag,
+            video.published_at, video.privacy_status)
+
+
+class ChannelCatalog:
+    """
+        Local SQLite catalog of the videos uploaded to the YouTube channel.
+        Keeps the video id, title, description, privacy status, processing status and etag of every upload so a run only has
+        to fetch the uploads added since the last run instead of paging through the whole
+        uploads playlist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # The catalog is updated from the upload worker threads as well as the main thread
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.create_tables()
+
+    def create_tables(self):
+        with self._lock, self.connection:
+            self.create_videos_table("videos")
+            # Catalogs created before the privacy and processing statuses were kept
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(videos)")]
+            for column in ("privacy_status", "processing_status"):
+                if column not in columns:
+                    self.connection.execute("ALTER TABLE videos ADD COLUMN {0} TEXT".format(column))
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS videos_session_id ON videos (session_id)")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )""")
+
+    def create_videos_table(self, name):
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS {0} (
+                video_id TEXT PRIMARY KEY,
+                session_id TEXT,
+                title TEXT,
+                description TEXT,
+                etag TEXT,
+                published_at TEXT,
+                privacy_status TEXT,
+                processing_status TEXT
+            )""".format(name))
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def knows(self, video_id, etag):
+        """
+            True if the catalog already holds this version of the video
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM videos WHERE video_id = ? AND etag = ?", (video_id, etag)).fetchone()
+        return row is not None
+
+    def is_complete(self):
+        """
+            True once a full listing of the channel has been stored, only then can an
+            incremental refresh stop at the first video the catalog already holds
+        """
+        return self.get_meta("complete") == "1"
+
+    def upsert(self, video_id, title, description, etag=None, published_at=None, privacy_status=None):
+        """
+            Add a video to the catalog or replace the details held for it, keeping its
+            processing status
+        """
+        with self._lock, self.connection:
+            self.connection.execute(UPSERT_VIDEO, (video_id, normalize_session_id(title), title, description, etag,
+                                                   published_at, privacy_status))
+
+    def upsert_videos(self, videos):
+        """
+            Add or replace the ChannelVideos of a listing in a single transaction
+        """
+        with self._lock, self.connection:
+            self.connection.executemany(UPSERT_VIDEO, [get_row(video) for video in videos])
+
+    def rebuild(self, videos):
+        """
+            Replace the videos of the catalog with the ChannelVideos of a full listing of the
+            channel and mark the catalog complete. Nothing is written until videos is
+            exhausted, so a listing that fails halfway leaves the catalog as it was. The
+            processing statuses of the videos still on the channel are kept.
+        """
+        rows = [get_row(video) for video in videos]
+        with self._lock, self.connection:
+            processing_statuses = dict(self.connection.execute(
+                "SELECT video_id, processing_status FROM videos WHERE processing_status IS NOT NULL").fetchall())
+            self.connection.execute("DELETE FROM videos")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO videos (video_id, session_id, title, description, etag, published_at, "
+                "privacy_status, processing_status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [row + (processing_statuses.get(row[0]),) for row in rows])
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('complete', '1')")
+        return len(rows)
+
+    def update_metadata(self, video_id, title, description, privacy_status=None):
+        """
+            Update the title, description and privacy status held for a video after it was edited
+        """
+        with self._lock, self.connection:
+            self.connection.execute(
+                "UPDATE videos SET session_id = ?, title = ?, description = ?, "
+                "privacy_status = COALESCE(?, privacy_status) WHERE video_id = ?",
+                (normalize_session_id(title), title, description, privacy_status, video_id))
+
+    def update_privacy_status(self, video_id, privacy_status):
+        with self._lock, self.connection:
+            self.connection.execute(
+                "UPDATE videos SET privacy_status = ? WHERE video_id = ?", (privacy_status, video_id))
+
+    def update_processing_status(self, video_id, processing_status):
+        """
+            Record how far YouTube got processing a video uploaded by a run
+        """
+        with self._lock, self.connection:
+            self.connection.execute(
+                "UPDATE videos SET processing_status = ? WHERE video_id = ?", (processing_status, video_id))
+
+    def get_video_ids_by_processing_status(self, processing_status):
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT video_id FROM videos WHERE processing_status = ?", (processing_status,)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_video(self, video_id):
+        """
+            Returns a dictionary of the details held for a video or None
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT video_id, title, description, etag, published_at, privacy_status, processing_status "
+                "FROM videos WHERE video_id = ?",
+                (video_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(["video_id", "title", "description", "etag", "published_at", "privacy_status",
+                         "processing_status"], row))
+
+    def search(self, string):
+        """
+            Returns a list of [title, video_id] for the videos with string in the title or
+            description, ignoring case
+        """
+        pattern = "%{0}%".format(string.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_"))
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT title, video_id FROM videos WHERE title LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\' "
+                "ORDER BY published_at DESC",
+                (pattern, pattern)).fetchall()
+        return [list(row) for row in rows]
+
+    def get_video_ids(self, session_id):
+        """
+            Returns the ids of the videos whose title starts with the session id
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT video_id FROM videos WHERE session_id = ?",
+                (normalize_session_id(session_id),)).fetchall()
+        return [row[0] for row in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,36 @@
+#!/usr/bin/python3
+
+import re
+from collections import namedtuple
+
+# An upload of the channel as listed from the uploads playlist
+ChannelVideo = namedtuple("ChannelVideo", ["video_id", "title", "description", "published_at", "privacy_status", "etag"])
+
+# Parts and fields of the uploads playlist items read when listing the channel. YouTube only
+# sends the fields of a ChannelVideo, not the thumbnails, channel and position of every item.
+CHANNEL_LISTING_PART = "snippet,status"
+CHANNEL_LISTING_FIELDS = "nextPageToken,items(etag,snippet(title,description,publishedAt,resourceId/videoId),status/privacyStatus)"
+
+
+def get_channel_video(playlist_item):
+    """
+        The ChannelVideo of an item of the uploads playlist
+    """
+    snippet = playlist_item["snippet"]
+    return ChannelVideo(snippet["resourceId"]["videoId"], snippet["title"], snippet.get("description", ""),
+                        snippet.get("publishedAt"), playlist_item.get("status", {}).get("privacyStatus"),
+                        playlist_item.get("etag"))
+
+
+def compile_video_matcher(strings):
+    """
+        Returns a function telling whether a ChannelVideo has any of strings in its title or
+        description, ignoring case. The strings are compiled into a single pattern once.
+    """
+    if not strings:
+        return lambda video: False
+    pattern = re.compile("|".join(re.escape(string) for string in strings), re.IGNORECASE)
+
+    def matches(video):
+        return pattern.search(video.title) is not None or pattern.search(video.description) is not None
+    return matches
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+
+import json
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Extensions of the video files picked up when none are configured
+DEFAULT_VIDEO_EXTENSIONS = (".mp4",)
+
+# A video file found by the DirectoryScanner
+ScannedFile = namedtuple("ScannedFile", ["path", "size", "mtime", "inode"])
+
+
+class DirectoryScanner:
+    """
+        Walks a directory tree for video files, listing sub directories in parallel so a slow
+        network mount is not walked one directory at a time. Files are yielded as soon as they
+        are found. A manifest of the (path, size, mtime, inode) of every file synced lets later
+        runs only surface new or changed files. Files only enter the manifest once the caller
+        has synced them to every destination, see record_synced.
+    """
+
+    def __init__(self, extensions=DEFAULT_VIDEO_EXTENSIONS, manifest_path=None, workers=8):
+        self.extensions = tuple(extension.lower() for extension in extensions)
+        self.manifest_path = manifest_path
+        self.workers = workers
+        self._lock = threading.Lock()
+        self.manifest = {}
+        # Path -> [size, mtime, inode] of the files scanned during this run, recorded in the
+        # manifest once they are synced
+        self.scanned = {}
+        # Files dropped from the manifest during this run, kept out of it when a scan finishes
+        self.forgotten = set()
+        if manifest_path and os.path.exists(manifest_path):
+            with open(manifest_path) as manifest_file:
+                try:
+                    self.manifest = json.load(manifest_file)
+                except ValueError:
+                    print("Ignoring unreadable scan manifest {0}".format(manifest_path))
+
+    def scan(self, directory, changed_only=False, record=True):
+        """
+            Yields a ScannedFile for every video file under directory.
+            With changed_only, files whose size, mtime and inode match the manifest are skipped.
+            Unless record is False, e.g. for a dry run, the files are kept for record_synced and
+            once the whole directory has been scanned the files that no longer exist are
+            dropped from the manifest.
+        """
+        seen = {}
+        completed = False
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                pending = set([executor.submit(self.scan_directory, directory)])
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        files, subdirectories = future.result()
+                        for subdirectory in subdirectories:
+                            pending.add(executor.submit(self.scan_directory, subdirectory))
+                        for scanned_file in files:
+                            seen[scanned_file.path] = [scanned_file.size, scanned_file.mtime, scanned_file.inode]
+                            if record:
+                                with self._lock:
+                                    self.scanned[scanned_file.path] = seen[scanned_file.path]
+                            if changed_only and self.is_unchanged(scanned_file):
+                                continue
+                            yield scanned_file
+            completed = True
+        finally:
+            if record and completed:
+                self.prune_manifest(directory, seen)
+
+    def scan_directory(self, directory):
+        """
+            List a single directory. Returns the matching files and the sub directories to scan.
+        """
+        files = []
+        subdirectories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif entry.name.lower().endswith(self.extensions) and entry.is_file():
+                        stat = entry.stat()
+                        files.append(ScannedFile(entry.path, stat.st_size, stat.st_mtime, stat.st_ino))
+        except OSError as e:
+            print("Unable to scan {0}: {1}".format(directory, e))
+        return files, subdirectories
+
+    def is_unchanged(self, scanned_file):
+        with self._lock:
+            entry = self.manifest.get(scanned_file.path)
+        return entry == [scanned_file.size, scanned_file.mtime, scanned_file.inode]
+
+    def forget(self, path):
+        """
+            Drop a file from the manifest so the next changed_only scan surfaces it again,
+            e.g. after its upload failed
+        """
+        with self._lock:
+            self.forgotten.add(path)
+            if self.manifest.pop(path, None) is not None:
+                self.save_manifest()
+
+    def prune_manifest(self, directory, seen):
+        """
+            Remove the entries for files under directory that a complete scan did not see
+        """
+        with self._lock:
+            prefix = os.path.join(directory, "")
+            gone = [path for path in self.manifest if path.startswith(prefix) and path not in seen]
+            for path in gone:
+                del self.manifest[path]
+            if gone:
+                self.save_manifest()
+
+    def record_synced(self, paths):
+        """
+            Record scanned files in the manifest once they have reached every destination,
+            so the next changed_only scan skips them
+        """
+        with self._lock:
+            entries = [(path, self.scanned[path]) for path in paths
+                       if path in self.scanned and path not in self.forgotten]
+            if not entries:
+                return
+            self.manifest.update(entries)
+            self.save_manifest()
+
+    def save_manifest(self):
+        """
+            Write the manifest to disk. Callers must hold the lock.
+        """
+        if not self.manifest_path:
+            return
+        temporary_path = self.manifest_path + ".tmp"
+        with open(temporary_path, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file)
+        os.replace(temporary_path, self.manifest_path)
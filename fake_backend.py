@@ -0,0 +1,668 @@
+#!/usr/bin/python3
+
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import escape
+
+from quota_scheduler import TokenBucket
+
+# Bytes read from a request body at a time, and the burst allowed by the bandwidth cap
+READ_SIZE = 1024 * 1024
+
+# Number of items returned by a listing page when the client does not ask for a size
+DEFAULT_PAGE_SIZE = 5
+
+# Most objects returned by a single ListObjectsV2 call
+MAX_KEYS = 1000
+
+
+def get_etag(*values):
+    return hashlib.md5(":".join(str(value) for value in values).encode()).hexdigest()
+
+
+def create_video_directory(directory, count, size=64 * 1024 * 1024, connect_code="yvr18", start=0):
+    """
+        Create count sparse mp4 files of size bytes named <connect_code>-<n>.mp4. Only the
+        first and last bytes of each file are written so they take no space on disk but still
+        have distinct content fingerprints. Returns the list of paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for number in range(start, start + count):
+        path = os.path.join(directory, "{0}-{1}.mp4".format(connect_code, number))
+        marker = "{0}-{1}".format(connect_code, number).encode()
+        with open(path, "wb") as video_file:
+            video_file.truncate(size)
+            video_file.write(marker[:size])
+            if size >= 2 * len(marker):
+                video_file.seek(size - len(marker))
+                video_file.write(marker)
+        paths.append(path)
+    return paths
+
+
+class FakeBackendHandler(BaseHTTPRequestHandler):
+    """
+        Routes requests to the YouTube Data API or the S3 emulation of the server's backend
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def backend(self):
+        return self.server.backend
+
+    def read_body(self, digest=None):
+        """
+            Read the request body through the bandwidth cap, hashing it into digest when given.
+            Returns the number of bytes read, and the body itself for small requests.
+        """
+        length = int(self.headers.get("Content-Length", 0))
+        remaining = length
+        small_body = [] if length <= READ_SIZE else None
+        while remaining > 0:
+            block = self.rfile.read(min(READ_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            self.backend.throttle(len(block))
+            if digest is not None:
+                digest.update(block)
+            if small_body is not None:
+                small_body.append(block)
+        return length - remaining, b"".join(small_body) if small_body is not None else None
+
+    def reply(self, status, body=b"", headers=None, content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        elif isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body or self.command == "HEAD":
+            self.send_header("Content-Type", content_type)
+        if "Content-Length" not in (headers or {}):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        query = dict((name, values[0]) for name, values in parse_qs(url.query).items())
+        youtube = self.backend.youtube
+        s3 = self.backend.s3
+
+        if url.path.startswith("/session/"):
+            route = youtube.handle_upload_chunk
+        elif url.path.endswith("/upload/youtube/v3/videos"):
+            route = youtube.handle_upload_start
+        elif url.path.startswith("/youtube/v3/"):
+            route = youtube.handle_api
+        elif url.path.startswith("/batch"):
+            route = youtube.handle_batch
+        else:
+            route = s3.handle
+
+        self.backend.count_request()
+        if self.backend.latency:
+            time.sleep(self.backend.latency)
+        # Errors are injected after the body is read so the connection stays usable
+        route(self, method, url.path, query)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_HEAD(self):
+        self.handle_request("HEAD")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+
+class FakeYouTube:
+    """
+        In memory YouTube channel served over the Data API REST endpoints used by the video
+        manager: channels.list, playlists.list and insert, playlistItems.list and insert,
+        videos.list, videos.update, the HTTP batch endpoint and the resumable upload protocol.
+    """
+
+    CHANNEL_ID = "UCfakechannel"
+    UPLOADS_PLAYLIST_ID = "UUfakechannel"
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        # Videos of the channel, newest first like the uploads playlist
+        self.videos = []
+        self.videos_by_id = {}
+        # Playlist id -> {"id", "title", "privacyStatus", "videos"} of the playlists of the channel
+        self.playlists = {}
+        # Upload session id -> {"offset", "total", "body"}
+        self.sessions = {}
+        self.uploaded = []
+        self.bytes_received = 0
+        # Seconds an uploaded video stays processing before it is processed
+        self.processing_seconds = 0.0
+
+    def add_video(self, title, description="", tags=None, privacy_status="private", video_id=None):
+        with self._lock:
+            video_id = video_id or "v{0:010d}".format(len(self.videos_by_id))
+            video = {
+                "id": video_id,
+                "title": title,
+                "description": description,
+                "tags": list(tags or []),
+                "categoryId": "28",
+                "privacyStatus": privacy_status,
+                "publishedAt": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "version": 0,
+                # Time the processing of the video finishes, None when it is already processed
+                "processedAt": None,
+                "rejectionReason": None,
+            }
+            self.videos.insert(0, video)
+            self.videos_by_id[video_id] = video
+            return video_id
+
+    def add_playlist(self, title, privacy_status="private", video_ids=None):
+        with self._lock:
+            playlist_id = "PL{0:08d}".format(len(self.playlists))
+            self.playlists[playlist_id] = {"id": playlist_id, "title": title, "privacyStatus": privacy_status,
+                                           "videos": list(video_ids or [])}
+            return playlist_id
+
+    def reject(self, video_id, reason="duplicate"):
+        """
+            Make the processing of a video end with its rejection
+        """
+        with self._lock:
+            self.videos_by_id[video_id]["rejectionReason"] = reason
+
+    def get_playlist_resource(self, playlist):
+        return {
+            "kind": "youtube#playlist",
+            "id": playlist["id"],
+            "etag": get_etag("playlist", playlist["id"], playlist["title"]),
+            "snippet": {"channelId": self.CHANNEL_ID, "title": playlist["title"]},
+            "status": {"privacyStatus": playlist["privacyStatus"]},
+        }
+
+    def populate(self, count, connect_code="yvr18", start=0):
+        """
+            Add count videos titled "<CONNECT CODE>-<n>: Session <n>" to the channel
+        """
+        for number in range(start, start + count):
+            session_id = "{0}-{1}".format(connect_code.upper(), number)
+            self.add_video("{0}: Session {1}".format(session_id, number), "Description of " + session_id, [session_id])
+
+    def get_video_resource(self, video, parts):
+        resource = {"kind": "youtube#video", "id": video["id"], "etag": get_etag(video["id"], video["version"])}
+        if "snippet" in parts:
+            resource["snippet"] = {
+                "publishedAt": video["publishedAt"],
+                "channelId": self.CHANNEL_ID,
+                "title": video["title"],
+                "description": video["description"],
+                "tags": video["tags"],
+                "categoryId": video["categoryId"],
+            }
+        processing = video["processedAt"] is not None and time.time() < video["processedAt"]
+        if "status" in parts:
+            resource["status"] = {"uploadStatus": "uploaded" if processing else "processed",
+                                  "privacyStatus": video["privacyStatus"]}
+            if not processing and video["rejectionReason"]:
+                resource["status"].update(uploadStatus="rejected", rejectionReason=video["rejectionReason"])
+        if "processingDetails" in parts:
+            resource["processingDetails"] = {"processingStatus": "processing" if processing else "succeeded"}
+        return resource
+
+    def get_playlist_item(self, video, playlist_id=None):
+        playlist_id = playlist_id or self.UPLOADS_PLAYLIST_ID
+        return {
+            "kind": "youtube#playlistItem",
+            "id": "PLI" + playlist_id + video["id"],
+            "etag": get_etag("item", video["id"], video["version"]),
+            "snippet": {
+                "publishedAt": video["publishedAt"],
+                "channelId": self.CHANNEL_ID,
+                "title": video["title"],
+                "description": video["description"],
+                "playlistId": playlist_id,
+                "resourceId": {"kind": "youtube#video", "videoId": video["id"]},
+            },
+            "contentDetails": {"videoId": video["id"]},
+            "status": {"privacyStatus": video["privacyStatus"]},
+        }
+
+    def get_error(self, status, reason, message):
+        return {"error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]}}
+
+    def handle_api(self, handler, method, path, query):
+        body = None
+        if method in ("POST", "PUT"):
+            _, body = handler.read_body()
+        resource = path[len("/youtube/v3/"):]
+        self.backend.count_api_call("{0}.{1}".format(resource, {"GET": "list", "PUT": "update", "POST": "insert"}.get(method, method)))
+        if self.backend.inject_error():
+            return handler.reply(503, self.get_error(503, "backendError", "Injected error"))
+        status, response = self.call(method, resource, query, json.loads(body) if body else None)
+        handler.reply(status, response)
+
+    def call(self, method, resource, query, body):
+        """
+            Run a single REST call, returns the (status, response)
+        """
+        parts = set(query.get("part", "").split(","))
+        if method == "GET" and resource == "channels":
+            return 200, {"items": [{
+                "kind": "youtube#channel",
+                "id": self.CHANNEL_ID,
+                "contentDetails": {"relatedPlaylists": {"uploads": self.UPLOADS_PLAYLIST_ID}}
+            }]}
+        if method == "GET" and resource == "playlistItems":
+            playlist_id = query.get("playlistId")
+            with self._lock:
+                if playlist_id == self.UPLOADS_PLAYLIST_ID:
+                    videos = list(self.videos)
+                elif playlist_id in self.playlists:
+                    videos = [self.videos_by_id[video_id] for video_id in self.playlists[playlist_id]["videos"]]
+                else:
+                    return 404, self.get_error(404, "playlistNotFound", "Playlist not found")
+            return 200, self.get_page(query, "youtube#playlistItemListResponse", videos,
+                                      lambda video: self.get_playlist_item(video, playlist_id))
+        if method == "POST" and resource == "playlistItems":
+            snippet = body.get("snippet", {})
+            video_id = snippet.get("resourceId", {}).get("videoId")
+            with self._lock:
+                playlist = self.playlists.get(snippet.get("playlistId"))
+                if playlist is None:
+                    return 404, self.get_error(404, "playlistNotFound", "Playlist not found")
+                video = self.videos_by_id.get(video_id)
+                if video is None:
+                    return 404, self.get_error(404, "videoNotFound", "Video not found")
+                playlist["videos"].append(video_id)
+                return 200, self.get_playlist_item(video, playlist["id"])
+        if method == "GET" and resource == "playlists":
+            with self._lock:
+                playlists = list(self.playlists.values())
+            return 200, self.get_page(query, "youtube#playlistListResponse", playlists, self.get_playlist_resource)
+        if method == "POST" and resource == "playlists":
+            snippet = body.get("snippet", {})
+            if not snippet.get("title"):
+                return 400, self.get_error(400, "playlistTitleRequired", "Missing title")
+            playlist_id = self.add_playlist(snippet["title"], body.get("status", {}).get("privacyStatus", "public"))
+            with self._lock:
+                return 200, self.get_playlist_resource(self.playlists[playlist_id])
+        if method == "GET" and resource == "videos":
+            video_ids = [video_id for video_id in query.get("id", "").split(",") if video_id]
+            if len(video_ids) > 50:
+                return 400, self.get_error(400, "invalidFilters", "Too many ids")
+            with self._lock:
+                videos = [self.videos_by_id[video_id] for video_id in video_ids if video_id in self.videos_by_id]
+                items = [self.get_video_resource(video, parts) for video in videos]
+            return 200, {"kind": "youtube#videoListResponse", "items": items}
+        if method == "PUT" and resource == "videos":
+            return self.update_video(body, parts)
+        return 404, self.get_error(404, "notFound", "Unknown method")
+
+    def get_page(self, query, kind, items, get_resource):
+        """
+            The page of a listing asked for by the maxResults and pageToken of query, with
+            get_resource turning each item on the page into its resource
+        """
+        page_size = min(50, int(query.get("maxResults", DEFAULT_PAGE_SIZE)))
+        start = int(query.get("pageToken") or 0)
+        response = {
+            "kind": kind,
+            "items": [get_resource(item) for item in items[start:start + page_size]],
+            "pageInfo": {"totalResults": len(items), "resultsPerPage": page_size},
+        }
+        if start + page_size < len(items):
+            response["nextPageToken"] = str(start + page_size)
+        return response
+
+    def update_video(self, body, parts):
+        with self._lock:
+            video = self.videos_by_id.get(body.get("id"))
+            if video is None:
+                return 404, self.get_error(404, "videoNotFound", "Video not found")
+            if "snippet" in body:
+                snippet = body["snippet"]
+                if not snippet.get("title"):
+                    return 400, self.get_error(400, "invalidTitle", "Missing title")
+                video["title"] = snippet["title"]
+                video["description"] = snippet.get("description", "")
+                video["tags"] = snippet.get("tags") or []
+                video["categoryId"] = str(snippet.get("categoryId", video["categoryId"]))
+            if "status" in body:
+                video["privacyStatus"] = body["status"]["privacyStatus"]
+            video["version"] += 1
+            return 200, self.get_video_resource(video, parts)
+
+    def handle_batch(self, handler, method, path, query):
+        """
+            Answer a multipart/mixed batch request by running each of its requests
+        """
+        _, raw = handler.read_body()
+        raw = raw.decode("utf-8")
+        boundary = re.search(r'boundary="?([^";]+)"?', handler.headers["Content-Type"]).group(1)
+        responses = []
+        for part in raw.split("--" + boundary):
+            if not part.strip() or part.strip() == "--":
+                continue
+            part_headers, inner = re.split(r"\r?\n\r?\n", part.lstrip("\r\n"), maxsplit=1)
+            content_id = re.search(r"(?im)^content-id:\s*(.+?)\s*$", part_headers).group(1)
+            request_line, rest = inner.split("\n", 1)
+            request_method, request_path = request_line.split()[:2]
+            request_body = re.split(r"\r?\n\r?\n", rest, maxsplit=1)[1].strip() if re.search(r"\r?\n\r?\n", rest) else ""
+            request_url = urlparse(request_path)
+            resource = request_url.path.split("/youtube/v3/", 1)[1]
+            request_query = dict((name, values[0]) for name, values in parse_qs(request_url.query).items())
+            self.backend.count_api_call("{0}.{1}".format(resource, {"GET": "list", "PUT": "update", "POST": "insert"}.get(request_method, request_method)))
+            if self.backend.inject_error():
+                status, response = 503, self.get_error(503, "backendError", "Injected error")
+            else:
+                status, response = self.call(request_method, resource, request_query,
+                                             json.loads(request_body) if request_body else None)
+            responses.append(
+                "--batch_fake\r\nContent-Type: application/http\r\nContent-ID: {0}\r\n\r\n"
+                "HTTP/1.1 {1} {2}\r\nContent-Type: application/json\r\n\r\n{3}\r\n".format(
+                    content_id.replace("<", "<response-", 1), status, "OK" if status < 300 else "Error",
+                    json.dumps(response)))
+        handler.reply(200, "".join(responses) + "--batch_fake--\r\n",
+                      content_type="multipart/mixed; boundary=batch_fake")
+
+    def handle_upload_start(self, handler, method, path, query):
+        _, body = handler.read_body()
+        self.backend.count_api_call("videos.insert")
+        if self.backend.inject_error():
+            return handler.reply(503, self.get_error(503, "backendError", "Injected error"))
+        with self._lock:
+            session_id = "s{0}".format(len(self.sessions))
+            self.sessions[session_id] = {
+                "offset": 0,
+                "total": int(handler.headers.get("X-Upload-Content-Length", 0)) or None,
+                "body": json.loads(body) if body else {},
+            }
+        handler.reply(200, headers={"Location": "{0}session/{1}".format(self.backend.url, session_id)})
+
+    def handle_upload_chunk(self, handler, method, path, query):
+        session_id = path.rsplit("/", 1)[1]
+        received, _ = handler.read_body()
+        with self._lock:
+            session = self.sessions.get(session_id)
+        if session is None:
+            return handler.reply(404, self.get_error(404, "notFound", "Unknown upload session"))
+
+        content_range = handler.headers.get("Content-Range", "")
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+|\*)", content_range)
+        failed = self.backend.inject_error()
+        with self._lock:
+            if match and not failed:
+                start = int(match.group(1))
+                if start <= session["offset"]:
+                    new_bytes = max(0, start + received - session["offset"])
+                    session["offset"] = start + received
+                    self.bytes_received += new_bytes
+                if match.group(3) != "*":
+                    session["total"] = int(match.group(3))
+            else:
+                total = re.match(r"bytes \*/(\d+)", content_range)
+                if total:
+                    session["total"] = int(total.group(1))
+            offset, total = session["offset"], session["total"]
+
+        if failed:
+            return handler.reply(503, self.get_error(503, "backendError", "Injected error"))
+        if total is not None and offset >= total:
+            with self._lock:
+                video_id = session.get("video_id")
+            if video_id is None:
+                snippet = session["body"].get("snippet", {})
+                video_id = self.add_video(snippet.get("title", ""), snippet.get("description", ""),
+                                          snippet.get("tags"), session["body"].get("status", {}).get("privacyStatus", "private"))
+                with self._lock:
+                    session["video_id"] = video_id
+                    self.uploaded.append(video_id)
+                    self.videos_by_id[video_id]["processedAt"] = time.time() + self.processing_seconds
+            with self._lock:
+                resource = self.get_video_resource(self.videos_by_id[video_id], set(["snippet", "status"]))
+            return handler.reply(200, resource)
+        handler.reply(308, headers={"Range": "bytes=0-{0}".format(offset - 1)} if offset else {})
+
+
+class FakeS3:
+    """
+        In memory S3 served with path style addressing. Supports the calls S3Sync makes:
+        ListObjectsV2, HeadObject, PutObject and the multipart upload calls. Objects keep
+        their size and ETag but not their content.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        # Bucket -> key -> {"size", "etag", "last_modified"}
+        self.buckets = {}
+        # Upload id -> {"bucket", "key", "parts": {number: (size, md5 digest)}}
+        self.multipart_uploads = {}
+        self.bytes_received = 0
+
+    def create_bucket(self, bucket):
+        with self._lock:
+            self.buckets.setdefault(bucket, {})
+
+    def error(self, handler, status, code, message=""):
+        body = "<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>{0}</Code><Message>{1}</Message></Error>".format(
+            code, escape(message))
+        handler.reply(status, body if handler.command != "HEAD" else b"", content_type="application/xml")
+
+    def handle(self, handler, method, path, query):
+        bucket, _, key = path.lstrip("/").partition("/")
+        key = unquote(key)
+        digest = hashlib.md5()
+        received, body = handler.read_body(digest) if method in ("PUT", "POST") else (0, None)
+
+        operation = {
+            ("GET", False): "ListObjectsV2",
+            ("GET", True): "GetObject",
+            ("HEAD", True): "HeadObject",
+            ("PUT", True): "UploadPart" if "partNumber" in query else "PutObject",
+            ("POST", True): "CompleteMultipartUpload" if "uploadId" in query else "CreateMultipartUpload",
+            ("DELETE", True): "AbortMultipartUpload" if "uploadId" in query else "DeleteObject",
+        }.get((method, bool(key)), "Unknown")
+        self.backend.count_api_call("s3." + operation)
+
+        if self.backend.inject_error():
+            return self.error(handler, 503, "SlowDown", "Injected error")
+        with self._lock:
+            if bucket not in self.buckets:
+                return self.error(handler, 404, "NoSuchBucket", bucket)
+            objects = self.buckets[bucket]
+
+        if operation == "ListObjectsV2":
+            return self.list_objects(handler, bucket, objects, query)
+        if operation in ("HeadObject", "GetObject"):
+            with self._lock:
+                s3_object = objects.get(key)
+            if s3_object is None:
+                return self.error(handler, 404, "NoSuchKey", key)
+            if operation == "GetObject":
+                return self.error(handler, 501, "NotImplemented", "Objects keep no content")
+            return handler.reply(200, headers={
+                "ETag": s3_object["etag"],
+                "Last-Modified": time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(s3_object["last_modified"])),
+                "Content-Length": str(s3_object["size"]),
+            }, content_type="binary/octet-stream")
+        if operation == "PutObject":
+            with self._lock:
+                self.bytes_received += received
+                objects[key] = {"size": received, "etag": '"{0}"'.format(digest.hexdigest()), "last_modified": time.time()}
+            return handler.reply(200, headers={"ETag": objects[key]["etag"]})
+        if operation == "CreateMultipartUpload":
+            with self._lock:
+                upload_id = "u{0}".format(len(self.multipart_uploads))
+                self.multipart_uploads[upload_id] = {"bucket": bucket, "key": key, "parts": {}}
+            return handler.reply(200, (
+                "<?xml version=\"1.0\" encoding=\"UTF-8\"?><InitiateMultipartUploadResult>"
+                "<Bucket>{0}</Bucket><Key>{1}</Key><UploadId>{2}</UploadId></InitiateMultipartUploadResult>").format(
+                    escape(bucket), escape(key), upload_id), content_type="application/xml")
+        if operation == "UploadPart":
+            with self._lock:
+                upload = self.multipart_uploads.get(query["uploadId"])
+                if upload is None:
+                    return self.error(handler, 404, "NoSuchUpload", query["uploadId"])
+                upload["parts"][int(query["partNumber"])] = (received, digest.digest())
+                self.bytes_received += received
+            return handler.reply(200, headers={"ETag": '"{0}"'.format(digest.hexdigest())})
+        if operation == "CompleteMultipartUpload":
+            with self._lock:
+                upload = self.multipart_uploads.pop(query["uploadId"], None)
+                if upload is None:
+                    return self.error(handler, 404, "NoSuchUpload", query["uploadId"])
+                parts = [upload["parts"][number] for number in sorted(upload["parts"])]
+                etag = '"{0}-{1}"'.format(hashlib.md5(b"".join(part[1] for part in parts)).hexdigest(), len(parts))
+                objects[key] = {"size": sum(part[0] for part in parts), "etag": etag, "last_modified": time.time()}
+            return handler.reply(200, (
+                "<?xml version=\"1.0\" encoding=\"UTF-8\"?><CompleteMultipartUploadResult>"
+                "<Bucket>{0}</Bucket><Key>{1}</Key><ETag>{2}</ETag></CompleteMultipartUploadResult>").format(
+                    escape(bucket), escape(key), escape(etag)), content_type="application/xml")
+        if operation == "AbortMultipartUpload":
+            with self._lock:
+                self.multipart_uploads.pop(query["uploadId"], None)
+            return handler.reply(204)
+        if operation == "DeleteObject":
+            with self._lock:
+                objects.pop(key, None)
+            return handler.reply(204)
+        return self.error(handler, 400, "NotImplemented", operation)
+
+    def list_objects(self, handler, bucket, objects, query):
+        prefix = query.get("prefix", "")
+        max_keys = min(MAX_KEYS, int(query.get("max-keys", MAX_KEYS)))
+        start_after = query.get("continuation-token") or query.get("start-after") or ""
+        with self._lock:
+            keys = sorted(key for key in objects if key.startswith(prefix) and key > start_after)
+            page = [(key, dict(objects[key])) for key in keys[:max_keys]]
+        truncated = len(keys) > max_keys
+        contents = "".join(
+            "<Contents><Key>{0}</Key><LastModified>{1}</LastModified><ETag>{2}</ETag><Size>{3}</Size>"
+            "<StorageClass>STANDARD</StorageClass></Contents>".format(
+                escape(key),
+                datetime.datetime.utcfromtimestamp(s3_object["last_modified"]).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                escape(s3_object["etag"]), s3_object["size"])
+            for key, s3_object in page)
+        body = (
+            "<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
+            "<ListBucketResult xmlns=\"http://s3.amazonaws.com/doc/2006-03-01/\">"
+            "<Name>{0}</Name><Prefix>{1}</Prefix><KeyCount>{2}</KeyCount><MaxKeys>{3}</MaxKeys>"
+            "<IsTruncated>{4}</IsTruncated>{5}{6}</ListBucketResult>").format(
+                escape(bucket), escape(prefix), len(page), max_keys, "true" if truncated else "false",
+                "<NextContinuationToken>{0}</NextContinuationToken>".format(escape(page[-1][0])) if truncated else "",
+                contents)
+        handler.reply(200, body, content_type="application/xml")
+
+
+class FakeBackend:
+    """
+        Local HTTP server standing in for the YouTube Data API and S3 so syncs can be
+        benchmarked and tested offline. latency (seconds) is added to every request,
+        bandwidth (bytes per second) caps the upload rate shared by every connection and
+        error_rate is the probability of a request failing with a retriable 503.
+        Use as a context manager, the backend is reachable at url.
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.bucket = TokenBucket(bandwidth, capacity=READ_SIZE) if bandwidth else None
+        self._lock = threading.Lock()
+        self.youtube = FakeYouTube(self)
+        self.s3 = FakeS3(self)
+        self.requests = 0
+        self.errors_injected = 0
+        self.api_calls = {}
+        self.server = None
+        self.url = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBackendHandler)
+        self.server.daemon_threads = True
+        self.server.backend = self
+        self.url = "http://127.0.0.1:{0}/".format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def throttle(self, size):
+        if self.bucket is not None:
+            self.bucket.acquire(size)
+
+    def inject_error(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors_injected += 1
+        return failed
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_api_call(self, method):
+        with self._lock:
+            self.api_calls[method] = self.api_calls.get(method, 0) + 1
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.errors_injected = 0
+            self.api_calls = {}
+            self.youtube.bytes_received = 0
+            self.s3.bytes_received = 0
+
+    def get_youtube_service(self):
+        """
+            A googleapiclient YouTube service talking to this backend, built from the discovery
+            document shipped with the library so no network access is needed
+        """
+        from apiclient.discovery import build_from_document
+        from apiclient.http import build_http
+        from googleapiclient.discovery_cache import get_static_doc
+        discovery_document = json.loads(get_static_doc("youtube", "v3"))
+        # Media uploads are sent to the rootUrl of the document, not the API endpoint
+        discovery_document["rootUrl"] = discovery_document["baseUrl"] = self.url
+        return build_from_document(discovery_document, http=build_http())
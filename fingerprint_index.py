@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+
+# Bytes read from the start and from the end of a file for the partial fingerprint
+PARTIAL_BLOCK_SIZE = 1024 * 1024
+
+# Bytes hashed at a time when computing the full fingerprint
+FULL_HASH_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def get_partial_fingerprint(path, size):
+    """
+        Fast fingerprint of a file made from its size and its first and last megabyte
+    """
+    digest = hashlib.blake2b(str(size).encode(), digest_size=20)
+    with open(path, "rb") as video_file:
+        digest.update(video_file.read(PARTIAL_BLOCK_SIZE))
+        if size > PARTIAL_BLOCK_SIZE:
+            video_file.seek(max(PARTIAL_BLOCK_SIZE, size - PARTIAL_BLOCK_SIZE))
+            digest.update(video_file.read(PARTIAL_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def get_full_fingerprint(path, size):
+    """
+        SHA-256 of the whole file, read through mmap so the data is hashed straight from
+        the page cache
+    """
+    digest = hashlib.sha256()
+    if size == 0:
+        return digest.hexdigest()
+    with open(path, "rb") as video_file:
+        try:
+            with mmap.mmap(video_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                if hasattr(mapped_file, "madvise"):
+                    mapped_file.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mapped_file)
+                try:
+                    for offset in range(0, size, FULL_HASH_BUFFER_SIZE):
+                        digest.update(view[offset:offset + FULL_HASH_BUFFER_SIZE])
+                finally:
+                    view.release()
+        except (ValueError, OSError):
+            # Not every file system supports mmap, fall back to large buffered reads
+            video_file.seek(0)
+            for block in iter(lambda: video_file.read(FULL_HASH_BUFFER_SIZE), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class FingerprintIndex:
+    """
+        Maps the content fingerprints of local videos to the YouTube videos they were uploaded
+        as, so a renamed or re-exported copy of a recording is not uploaded again.
+        Fingerprints are cached per file by size and mtime. The partial fingerprint is always
+        used and, with full_hash, a match is confirmed with a hash of the whole file.
+    """
+
+    def __init__(self, path, full_hash=False):
+        self.path = path
+        self.full_hash = full_hash
+        self._lock = threading.Lock()
+        # Uploads are recorded from the upload worker threads
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.create_tables()
+
+    def create_tables(self):
+        with self._lock, self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime REAL,
+                    partial TEXT,
+                    full TEXT
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS videos (
+                    partial TEXT,
+                    full TEXT,
+                    video_id TEXT,
+                    PRIMARY KEY (partial, video_id)
+                )""")
+
+    def get_fingerprints(self, path, full=False):
+        """
+            Returns the (partial, full) fingerprints of a file, full is None unless asked for.
+            Fingerprints cached for the same size and mtime are reused.
+        """
+        stat = os.stat(path)
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT size, mtime, partial, full FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            partial, full_fingerprint = row[2], row[3]
+        else:
+            partial, full_fingerprint = get_partial_fingerprint(path, stat.st_size), None
+
+        if full and full_fingerprint is None:
+            full_fingerprint = get_full_fingerprint(path, stat.st_size)
+
+        if row != (stat.st_size, stat.st_mtime, partial, full_fingerprint):
+            with self._lock, self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO files (path, size, mtime, partial, full) VALUES (?, ?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime, partial, full_fingerprint))
+        return partial, full_fingerprint
+
+    def get_cached_fingerprints(self, path):
+        """
+            Returns the (partial, full) fingerprints cached for the current size and mtime of
+            a file, (None, None) when there are none. The file is not read.
+        """
+        stat = os.stat(path)
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT size, mtime, partial, full FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime:
+            return None, None
+        return row[2], row[3]
+
+    def find_video_id(self, path, cached_only=False, exists=None):
+        """
+            Returns the id of a YouTube video with the same content as the file or None.
+            The full fingerprint is only computed when the partial one matches. With
+            cached_only nothing is read or written, only cached fingerprints are compared
+            and a partial match stands in for a full fingerprint that was never computed.
+            exists is an optional callable telling whether a video id is still on the
+            channel, the videos it rejects are not matched.
+        """
+        if cached_only:
+            partial, full = self.get_cached_fingerprints(path)
+            if partial is None:
+                return None
+            rows = self.get_videos(partial, exists)
+            for row_full, video_id in rows:
+                if not self.full_hash or row_full is None or full is None or row_full == full:
+                    return video_id
+            return None
+
+        partial, _ = self.get_fingerprints(path)
+        rows = self.get_videos(partial, exists)
+        if not rows:
+            return None
+        if not self.full_hash:
+            return rows[0][1]
+
+        _, full = self.get_fingerprints(path, full=True)
+        for row_full, video_id in rows:
+            # Videos recorded without a full fingerprint can only be matched on the partial one
+            if row_full is None or row_full == full:
+                return video_id
+        return None
+
+    def get_videos(self, partial, exists=None):
+        """
+            Returns the (full fingerprint, video id) of the videos with a partial fingerprint
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT full, video_id FROM videos WHERE partial = ?", (partial,)).fetchall()
+        return [row for row in rows if exists is None or exists(row[1])]
+
+    def forget_video(self, video_id):
+        """
+            Drop a video that is no longer on the channel, e.g. deleted to be uploaded again
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM videos WHERE video_id = ?", (video_id,))
+
+    def record_video(self, path, video_id):
+        """
+            Record that the file is on YouTube as video_id
+        """
+        partial, full = self.get_fingerprints(path)
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT full FROM videos WHERE partial = ? AND video_id = ?", (partial, video_id)).fetchone()
+        # Videos already known are not hashed again on every run
+        if row is not None and (row[0] is not None or not self.full_hash):
+            return
+        if self.full_hash:
+            _, full = self.get_fingerprints(path, full=True)
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO videos (partial, full, video_id) VALUES (?, ?, ?)",
+                (partial, full, video_id))
+
+    def close(self):
+        self.connection.close()
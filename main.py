@@ -1,20 +1,27 @@
-import xml.etree.ElementTree
-from urllib import request
-import json
-import frontmatter
-import sys
 import os
-import shutil
-from io import BytesIO
-import glob
-import csv
-from PyPDF2 import PdfFileReader
-import re 
 import argparse
-from urllib.parse import urlparse
-import subprocess
+import asyncio
+import datetime
 
-from youtube_video_manager import YouTubeVideoManager
+from youtube_video_manager import YouTubeVideoManager, YouTubeConfig
+from reconciliation_index import ReconciliationIndex, get_session_id_from_video
+from upload_scheduler import UploadScheduler, UploadResult
+from upload_journal import UploadJournal
+from channel_catalog import ChannelCatalog
+from fingerprint_index import FingerprintIndex
+from directory_scanner import DirectoryScanner, DEFAULT_VIDEO_EXTENSIONS
+from s3_sync import S3Sync
+from sync_pipeline import SyncPipeline
+from quota_scheduler import QuotaScheduler, QuotaLedger, QuotaExceeded, DEFAULT_DAILY_QUOTA
+from async_youtube_client import AsyncYouTubeClient, iterate_in_thread
+from session_metadata import SessionMetadataStore
+from telemetry import Telemetry, ThroughputHistory
+from sync_plan import SyncPlan, SyncResults, PlannedVideo
+from media_preprocessor import MediaPreprocessor, REMUX_EXTENSIONS
+from playlist_sync import PlaylistSync
+from batch_manifest import load_batch_manifest
+from metadata_sync import MetadataSync
+from processing_monitor import ProcessingMonitor, UNAVAILABLE_STATUSES, get_video_processing_state
 
 class TermColours:
     """
@@ -32,162 +39,1338 @@ class TermColours:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
+def get_parser():
+    """
+        The command line options of a sync, SyncConfig takes its defaults from them
+    """
+    parser = argparse.ArgumentParser(description="Connect Video Manager")
+
+    # Required Positional Arguments
+    required_arguments_group = parser.add_argument_group('Required Arguments')
+    required_arguments_group.add_argument(
+        "video_directory", nargs="?", help="The path to the directory the Connect videos are stored in.")
+    required_arguments_group.add_argument(
+        "connect_code", nargs="?", help="The short code for the current connect e.g. YVR18")
+
+    # Flags
+    flag_arguments_group = parser.add_argument_group('Flags')
+    flag_arguments_group.add_argument(
+        "-V", "--verbose", action="store_true", help="Verbose output of the script")
+
+    # Options
+    option_arguments_group = parser.add_argument_group('Options')
+    option_arguments_group.add_argument(
+        "-j", "--jobs", type=int, default=1, metavar="N",
+        help="Number of videos to upload to YouTube at the same time (default: 1)")
+    option_arguments_group.add_argument(
+        "--journal", default=".upload_journal.json", metavar="PATH",
+        help="File used to resume interrupted uploads, pass '' to disable (default: .upload_journal.json)")
+    option_arguments_group.add_argument(
+        "--chunk-size", type=float, default=32, metavar="MB",
+        help="Size of each chunk sent when uploading to YouTube, 0 sends the whole file at once (default: 32)")
+    option_arguments_group.add_argument(
+        "--adaptive-chunks", action="store_true",
+        help="Grow the chunk size while uploads go cleanly and shrink it after retries")
+    option_arguments_group.add_argument(
+        "--catalog", default=".channel_catalog.sqlite3", metavar="PATH",
+        help="Local cache of the videos on the channel, pass '' to disable (default: .channel_catalog.sqlite3)")
+    option_arguments_group.add_argument(
+        "--rebuild-catalog", action="store_true",
+        help="Rebuild the channel catalog from every page of the uploads playlist")
+    option_arguments_group.add_argument(
+        "--extensions", default=",".join(DEFAULT_VIDEO_EXTENSIONS), metavar="EXT[,EXT...]",
+        help="Comma separated extensions of the video files to look for (default: .mp4)")
+    option_arguments_group.add_argument(
+        "--manifest", default=".scan_manifest.json", metavar="PATH",
+        help="Record of the videos seen by earlier runs, pass '' to disable (default: .scan_manifest.json)")
+    option_arguments_group.add_argument(
+        "--changed-only", action="store_true",
+        help="Only look at videos that are new or changed since the last run")
+    option_arguments_group.add_argument(
+        "--fingerprints", default=".fingerprints.sqlite3", metavar="PATH",
+        help="Content fingerprints of uploaded videos used to skip duplicates, pass '' to disable (default: .fingerprints.sqlite3)")
+    option_arguments_group.add_argument(
+        "--full-hash", action="store_true",
+        help="Confirm duplicate videos with a hash of the whole file")
+    option_arguments_group.add_argument(
+        "--pipeline", action="store_true",
+        help="Sync each video with YouTube and S3 at the same time, reading it from disk once")
+    option_arguments_group.add_argument(
+        "--async", dest="async_mode", action="store_true",
+        help="Run the YouTube uploads and metadata updates from a single event loop with the asyncio YouTube client")
+    option_arguments_group.add_argument(
+        "--connections", type=int, default=10, metavar="N",
+        help="Size of the pool of keep-alive connections used by --async (default: 10)")
+    option_arguments_group.add_argument(
+        "--skip-s3", action="store_true",
+        help="Do not sync the videos with S3")
+    option_arguments_group.add_argument(
+        "--s3-bucket", default="connect.linaro.org", metavar="BUCKET",
+        help="Bucket the videos are synced to (default: connect.linaro.org)")
+    option_arguments_group.add_argument(
+        "--s3-profile", default="ConnectAutomation", metavar="PROFILE",
+        help="AWS profile used to sync with S3 (default: ConnectAutomation)")
+    option_arguments_group.add_argument(
+        "--s3-endpoint-url", metavar="URL",
+        help="Endpoint of an S3 compatible service to use instead of AWS, e.g. MinIO")
+    option_arguments_group.add_argument(
+        "--s3-part-size", type=float, default=64, metavar="MB",
+        help="Size of each part of a multipart upload to S3 (default: 64)")
+    option_arguments_group.add_argument(
+        "--s3-concurrency", type=int, default=8, metavar="N",
+        help="Number of parts of a video uploaded to S3 at the same time (default: 8)")
+    option_arguments_group.add_argument(
+        "--s3-listing-cache", default=".s3_listing.json", metavar="PATH",
+        help="Cached listing of the S3 prefix, pass '' to disable (default: .s3_listing.json)")
+    option_arguments_group.add_argument(
+        "--refresh-s3-listing", action="store_true",
+        help="List the S3 prefix again instead of using the cached listing")
+    option_arguments_group.add_argument(
+        "--daily-quota", type=int, default=DEFAULT_DAILY_QUOTA, metavar="UNITS",
+        help="Daily YouTube Data API quota of the project (default: {0})".format(DEFAULT_DAILY_QUOTA))
+    option_arguments_group.add_argument(
+        "--quota-ledger", default=".quota_ledger.json", metavar="PATH",
+        help="Record of the quota used each day (default: .quota_ledger.json)")
+    option_arguments_group.add_argument(
+        "--pending-uploads", default=".pending_uploads.json", metavar="PATH",
+        help="Videos left to upload when the quota ran out (default: .pending_uploads.json)")
+    option_arguments_group.add_argument(
+        "--export", action="append", default=[], metavar="PATH",
+        help="Pathable schedule export (.csv or .json) or directory of the site's markdown session pages to take titles, descriptions and tags from, may be repeated")
+    option_arguments_group.add_argument(
+        "--slides", metavar="DIR",
+        help="Directory holding the slide PDFs of the sessions, used for sessions without a description")
+    option_arguments_group.add_argument(
+        "--update-metadata", action="store_true",
+        help="Update the titles, descriptions and tags of the videos already on YouTube from --export")
+    option_arguments_group.add_argument(
+        "--events", metavar="PATH",
+        help="Append a JSON lines stream of the stage, file, retry and API call events of the run to PATH")
+    option_arguments_group.add_argument(
+        "--prometheus", metavar="PATH",
+        help="Write the totals of the run to PATH in the Prometheus text format")
+    option_arguments_group.add_argument(
+        "--set-privacy", choices=YouTubeVideoManager.VALID_PRIVACY_STATUSES,
+        help="Set the privacy status of every video of the Connect on YouTube")
+    option_arguments_group.add_argument(
+        "--no-batch", action="store_true",
+        help="Send metadata updates one request at a time instead of through the HTTP batch endpoint")
+    option_arguments_group.add_argument(
+        "--client-secrets", metavar="PATH",
+        help="OAuth 2.0 client secrets file of the YouTube Data API project (default: the only client_secret*.json in the working directory)")
+    option_arguments_group.add_argument(
+        "--credentials", default="youtube_video_manager-oauth2.json", metavar="PATH",
+        help="File the OAuth 2.0 credentials are stored in (default: youtube_video_manager-oauth2.json)")
+    option_arguments_group.add_argument(
+        "--discovery-cache", default=".youtube_discovery.json", metavar="PATH",
+        help="Cached discovery document of the YouTube Data API, pass '' to disable (default: .youtube_discovery.json)")
+    option_arguments_group.add_argument(
+        "--playlist-id", metavar="ID",
+        help="Id of the YouTube playlist the videos of the Connect are added to")
+    option_arguments_group.add_argument(
+        "--playlist", metavar="TITLE",
+        help="Title of the YouTube playlist the videos of the Connect are added to, created when the channel has none")
+    option_arguments_group.add_argument(
+        "--s3-prefix", metavar="PREFIX",
+        help="Prefix of the bucket the videos are synced to (default: private/<connect code>/)")
+    option_arguments_group.add_argument(
+        "--batch", metavar="PATH",
+        help="Sync every Connect of a JSON or CSV manifest of video directories, connect codes, playlists and S3 prefixes instead of a single Connect")
+    option_arguments_group.add_argument(
+        "--dry-run", action="store_true",
+        help="Only print the plan of the sync, built from the channel catalog, S3 listing cache and a local scan")
+    option_arguments_group.add_argument(
+        "--save-plan", metavar="PATH",
+        help="Save the plan of the sync to PATH so a later run can execute it with --plan")
+    option_arguments_group.add_argument(
+        "--plan", metavar="PATH",
+        help="Execute the plan saved to PATH by --save-plan instead of planning again")
+    option_arguments_group.add_argument(
+        "--throughput-history", default=".throughput_history.json", metavar="PATH",
+        help="Throughput measured by past runs, used to estimate how long a plan takes, pass '' to disable (default: .throughput_history.json)")
+    option_arguments_group.add_argument(
+        "--preprocess", action="store_true",
+        help="Remux .mov and .mkv recordings to faststart mp4 with ffmpeg before uploading them to YouTube")
+    option_arguments_group.add_argument(
+        "--transcode-bitrate", type=float, metavar="MBIT",
+        help="Also transcode videos above this video bitrate in Mbit/s to H.264, implies --preprocess")
+    option_arguments_group.add_argument(
+        "--preprocess-cache", default=".preprocessed", metavar="DIR",
+        help="Directory the remuxed and transcoded videos are cached in (default: .preprocessed)")
+    option_arguments_group.add_argument(
+        "--preprocess-workers", type=int, default=0, metavar="N",
+        help="Number of ffmpeg processes run at the same time, 0 for one per CPU (default: 0)")
+    option_arguments_group.add_argument(
+        "--monitor-processing", action="store_true",
+        help="Wait until YouTube has processed the uploaded videos and report the videos that failed or were rejected")
+    option_arguments_group.add_argument(
+        "--publish-when-processed", choices=YouTubeVideoManager.VALID_PRIVACY_STATUSES, metavar="STATUS",
+        help="Switch each uploaded video to this privacy status once YouTube has processed it, implies --monitor-processing")
+    option_arguments_group.add_argument(
+        "--processing-timeout", type=float, default=60, metavar="MINUTES",
+        help="How long to wait for YouTube to process the uploaded videos (default: 60)")
+    option_arguments_group.add_argument(
+        "--processing-poll", type=float, default=30, metavar="SECONDS",
+        help="Seconds between checks of the processing of the uploaded videos, doubled while nothing finishes (default: 30)")
+    return parser
+
+# Spellings of true and false accepted for the flags of a batch manifest
+TRUE_VALUES = ("1", "true", "yes", "y", "on")
+FALSE_VALUES = ("0", "false", "no", "n", "off")
+
+
+class SyncConfig:
+    """
+        Options of a sync. The attributes are named after the command line options, e.g.
+        SyncConfig("/videos", "yvr18", jobs=4, skip_s3=True), and the options not passed
+        take their command line defaults.
+    """
+
+    def __init__(self, video_directory, connect_code, **options):
+        defaults = vars(get_parser().parse_args([]))
+        unknown = set(options) - set(defaults)
+        if unknown:
+            raise TypeError("Unknown sync option(s): {0}".format(", ".join(sorted(unknown))))
+        self.__dict__.update(defaults)
+        self.__dict__.update(options)
+        self.video_directory = video_directory
+        self.connect_code = connect_code
+
+    @classmethod
+    def from_argv(cls, argv=None):
+        """
+            Parse the command line arguments, argv defaults to sys.argv. The video directory
+            and connect code are left as None with --batch.
+        """
+        parser = get_parser()
+        options = vars(parser.parse_args(argv))
+        if options["batch"] and (options["video_directory"] or options["connect_code"]):
+            parser.error("pass either a video directory and connect code or --batch")
+        if not options["batch"] and not options["connect_code"]:
+            parser.error("the video_directory and connect_code arguments are required unless --batch is passed")
+        return cls(options.pop("video_directory"), options.pop("connect_code"), **options)
+
+    @staticmethod
+    def parse_options(options):
+        """
+            Convert option values given as text, e.g. by a CSV batch manifest, to what the
+            command line parser would make of them: numbers for the typed options, booleans
+            for the flags and lists for the options that may be repeated. Raises ValueError
+            for unknown options and invalid values.
+        """
+        actions = dict((action.dest, action) for action in get_parser()._actions)
+        parsed = {}
+        for name, value in options.items():
+            action = actions.get(name)
+            if action is None or name in ("help", "video_directory", "connect_code"):
+                raise ValueError("Unknown sync option {0}".format(name))
+            if isinstance(action, argparse._AppendAction):
+                if isinstance(value, str):
+                    value = [value]
+            elif isinstance(action, argparse._StoreTrueAction):
+                if isinstance(value, str):
+                    if value.lower() not in TRUE_VALUES + FALSE_VALUES:
+                        raise ValueError("{0} should be true or false, not {1!r}".format(name, value))
+                    value = value.lower() in TRUE_VALUES
+            elif action.type is not None and isinstance(value, str):
+                try:
+                    value = action.type(value)
+                except ValueError:
+                    raise ValueError("{0} should be a number, not {1!r}".format(name, value))
+            if action.choices is not None and value not in action.choices:
+                raise ValueError("{0} should be one of {1}, not {2!r}".format(name, ", ".join(action.choices), value))
+            parsed[name] = value
+        return parsed
+
+    def for_event(self, video_directory, connect_code, **options):
+        """
+            A copy of the config for another Connect, e.g. an event of a batch manifest,
+            with options overriding those of this config
+        """
+        settings = dict(vars(self), batch=None)
+        del settings["video_directory"], settings["connect_code"]
+        settings.update(options)
+        return SyncConfig(video_directory, connect_code, **settings)
+
+    def get_youtube_config(self):
+        return YouTubeConfig(
+            client_secrets_file=self.client_secrets or None,
+            credentials_file=self.credentials,
+            discovery_cache_file=self.discovery_cache or None,
+            playlist_id=self.playlist_id)
+
 class ConnectVideoManager:
     """
-        This class handles the syncing of Connect videos with YouTube (LinaroOrg) and AWS S3 Static resources bucket
+        This class handles the syncing of Connect videos with YouTube (LinaroOrg) and AWS S3 Static resources bucket.
+        A sync runs in three steps that can be called separately: plan() works out what each
+        video needs, execute(plan) uploads the videos and report(results) outputs the outcome.
+        Nothing talks to YouTube or S3 until plan() is called.
     """
 
-    def __init__(self):
+    def __init__(self, config, service=None, shared=None):
+        """
+            Set up the sync from a SyncConfig. service replaces the authenticated YouTube
+            service e.g. with one talking to the fake backend of the benchmarks. shared is
+            another ConnectVideoManager whose YouTube session, quota, telemetry and local
+            caches are used instead of opening new ones, e.g. by a BatchSync.
+        """
+
+        self.config = config
 
-        # Instantiate a new ArgumentParser Object
-        self.parser = argparse.ArgumentParser(description="Connect Video Manager")
-        # Setup the argument parser
-        self.setup_parser()
-        # Get the args
-        self.args = self.parser.parse_args()
-        
         # Check to see if script is executing as verbose
-        if self.args.verbose:
+        if self.config.verbose:
             self._verbose = True
         else:
             self._verbose = False
         
         # Get passed in params
-        self.connect_code = self.args.connect_code.lower()
-        self.video_directory = self.args.video_directory
+        self.connect_code = self.config.connect_code.lower()
+        self.video_directory = self.config.video_directory
+        self.jobs = self.config.jobs
 
         if self._verbose:
             print(self.output_ok_cyan("ConnectVideoManager is now executing..."))
 
-        # Instantiate a new video manager object
-        self.video_manager = YouTubeVideoManager()
+        # Titles, descriptions and tags of the sessions from the pathable export and the site
+        self.session_metadata = self.load_session_metadata()
 
-        # Get current videos contain YVR18 from YouTube
-        self.main()
+        # S3Sync of the run, created by get_s3_sync
+        self._s3_sync = None
 
+        if shared is not None:
+            self.share(shared)
+            return
 
+        # Timings, bytes, retries and API calls of every stage of the run
+        self.telemetry = Telemetry(
+            events_path=self.config.events or None,
+            prometheus_path=self.config.prometheus or None,
+            history=ThroughputHistory(self.config.throughput_history) if self.config.throughput_history else None)
 
-    def setup_parser(self):
-        """
-            Method which sets up the argument parser
-        """
+        # Journal of interrupted uploads so they can be resumed by a later run
+        self.upload_journal = UploadJournal(self.config.journal) if self.config.journal else None
+
+        # Remuxes and transcodes recordings ahead of their upload to YouTube
+        self.preprocessor = None
+        if self.config.preprocess or self.config.transcode_bitrate:
+            self.preprocessor = MediaPreprocessor(
+                self.config.preprocess_cache,
+                bitrate=int(self.config.transcode_bitrate * 1000000) if self.config.transcode_bitrate else None,
+                workers=self.config.preprocess_workers or None,
+                verbose=self._verbose,
+                telemetry=self.telemetry)
+
+        # Scanner streaming the videos found in the video directory, including the containers
+        # remuxed when preprocessing
+        extensions = [extension.strip() for extension in self.config.extensions.split(",")]
+        if self.preprocessor is not None:
+            extensions += [extension for extension in REMUX_EXTENSIONS if extension not in extensions]
+        self.directory_scanner = DirectoryScanner(
+            extensions=extensions,
+            manifest_path=self.config.manifest or None)
+
+        # Content fingerprints of the videos on YouTube so renamed copies are not uploaded again
+        self.fingerprint_index = None
+        if self.config.fingerprints:
+            self.fingerprint_index = FingerprintIndex(self.config.fingerprints, full_hash=self.config.full_hash)
+
+        # Local catalog of the videos on the channel so each run only fetches new uploads
+        self.channel_catalog = ChannelCatalog(self.config.catalog) if self.config.catalog else None
 
-        # Required Positional Arguments
-        required_arguments_group = self.parser.add_argument_group('Required Arguments')
-        required_arguments_group.add_argument(
-            "video_directory", help="The path to the directory the Connect videos are stored in.")
-        required_arguments_group.add_argument(
-            "connect_code", help="The short code for the current connect e.g. YVR18")
+        # Scheduler keeping every API request within the daily quota
+        self.quota = QuotaScheduler(
+            QuotaLedger(self.config.quota_ledger or None),
+            daily_quota=self.config.daily_quota,
+            pending_path=self.config.pending_uploads or None,
+            telemetry=self.telemetry)
 
-        # Flags
-        flag_arguments_group = self.parser.add_argument_group('Flags')
-        flag_arguments_group.add_argument(
-            "-V", "--verbose", action="store_true", help="Verbose output of the script")
+        # Instantiate a new video manager object, it only authenticates once the API is used
+        self.video_manager = YouTubeVideoManager(
+            quota=self.quota,
+            journal=self.upload_journal,
+            catalog=self.channel_catalog,
+            chunk_size=int(self.config.chunk_size * 1024 * 1024) or -1,
+            adaptive_chunks=self.config.adaptive_chunks,
+            telemetry=self.telemetry,
+            config=self.config.get_youtube_config(),
+            service=service)
+
+        # Playlists of the Connects, looked up and filled through batched inserts
+        self.playlist_sync = PlaylistSync(self.video_manager, use_batch_requests=not self.config.no_batch,
+                                          verbose=self._verbose)
+
+        # Follows the uploaded videos until YouTube has processed them
+        self.processing_monitor = None
+        if self.config.monitor_processing or self.config.publish_when_processed:
+            self.processing_monitor = ProcessingMonitor(
+                self.video_manager,
+                publish_privacy=self.config.publish_when_processed,
+                interval=self.config.processing_poll,
+                max_interval=max(300, self.config.processing_poll),
+                verbose=self._verbose,
+                telemetry=self.telemetry)
+
+    def share(self, shared):
+        """
+            Use the YouTube session, quota, telemetry and local caches of another sync
+        """
+        self.telemetry = shared.telemetry
+        self.upload_journal = shared.upload_journal
+        self.preprocessor = shared.preprocessor
+        self.directory_scanner = shared.directory_scanner
+        self.fingerprint_index = shared.fingerprint_index
+        self.channel_catalog = shared.channel_catalog
+        self.quota = shared.quota
+        self.video_manager = shared.video_manager
+        self.playlist_sync = shared.playlist_sync
+        self.processing_monitor = shared.processing_monitor
 
     def main(self):
         """
             Main method for syncing videos with S3 and YouTube
         """
+        if self._verbose:
+            print(self.status("{0} unit(s) of YouTube quota left today, enough for {1} upload(s)".format(
+                self.quota.remaining, self.quota.get_upload_budget())))
+        try:
+            with self.telemetry.stage("run"):
+                if self.config.dry_run:
+                    self.dry_run()
+                else:
+                    self.run()
+        except QuotaExceeded as e:
+            print(self.failed("Stopping, the YouTube quota is used up for today: {0}".format(e)))
+        finally:
+            self.telemetry.close()
+            print(self.output_lg("\n".join(self.telemetry.get_summary())))
+
+    def run(self):
+        """
+            Plan, execute and report a sync, or execute the plan saved to --plan.
+            Returns the SyncResults.
+        """
+        plan = self.load_plan(self.config.plan) if self.config.plan else self.plan()
+        if self.config.save_plan and not self.config.plan:
+            self.save_plan(plan)
+        results = self.execute(plan)
+        self.report(results)
+        return results
+
+    def dry_run(self):
+        """
+            Plan the sync from the cached channel catalog and S3 listing and a local scan,
+            without talking to YouTube or S3, and print the plan. Returns the SyncPlan.
+        """
+        plan = self.load_plan(self.config.plan, offline=True) if self.config.plan else self.plan(offline=True)
+        if self.config.save_plan and not self.config.plan:
+            self.save_plan(plan)
+        else:
+            self.complete_plan(plan)
+        self.report_plan(plan)
+        return plan
+
+    def plan(self, offline=False, youtube_videos=None):
+        """
+            Returns the SyncPlan of the videos in the video directory. The YouTube and S3
+            listings are loaded here, the videos themselves are planned as the plan is iterated.
+            An offline plan only reads the channel catalog and the S3 listing cache and
+            leaves the scan manifest and the fingerprints alone. youtube_videos is the list of
+            [title, video_id] of the videos of the Connect when the channel was already listed,
+            e.g. by a BatchSync.
+        """
+        with self.telemetry.stage("youtube_listing"):
+            if youtube_videos is not None:
+                current_videos_on_youtube = youtube_videos
+            elif offline:
+                current_videos_on_youtube = self.get_cached_youtube_videos()
+            else:
+                # Rebuild the channel catalog from scratch when asked to
+                if self.config.rebuild_catalog and self.channel_catalog is not None:
+                    self.video_manager.refresh_catalog(full=True)
 
-        # Get Current videos on youtube
-        current_videos_on_youtube = self.video_manager.get_current_youtube_videos_based_on_string(self.connect_code)
+                # Get Current videos on youtube
+                current_videos_on_youtube = self.video_manager.get_current_youtube_videos_based_on_string(self.connect_code)
+
+        index = self.get_reconciliation_index(current_videos_on_youtube)
+        s3_sync = self.get_s3_sync(cached_only=offline)
 
         if self._verbose:
             print(self.output_ok_cyan("Looking for videos in {0}".format(self.video_directory)))
 
-        # Get videos in directory
-        videos_in_directory = self.get_videos_from_directory(self.video_directory)
-    
-        print(videos_in_directory)
+        # Stream the videos in the directory into the plan, starting with the videos left
+        # over when an earlier run ran out of quota
+        videos_in_directory = self.get_pending_first(
+            self.get_videos_from_directory(self.video_directory, record=not offline))
+        plan = SyncPlan(self.iter_plan(index, s3_sync, videos_in_directory, offline=offline),
+                        connect_code=self.connect_code, video_directory=self.video_directory)
+        plan.upload_privacy = self.config.set_privacy
+        return plan
 
-        # Sync vidoes with YouTube
-        synced_with_youtube = self.sync_with_youtube(current_videos_on_youtube, videos_in_directory)
+    def iter_plan(self, index, s3_sync, videos_in_directory, offline=False):
+        """
+            Yields the PlannedVideo of each video as the directory scan finds it. Offline the
+            videos are not read: only cached fingerprints are looked up and videos S3 could
+            only tell apart by their ETag are planned as puts.
+        """
+        for video, video_id in index.iter_reconcile(videos_in_directory):
+            video_id = self.find_on_youtube(video, video_id, offline=offline)
+            s3_key = None
+            if s3_sync is not None:
+                key = s3_sync.get_key(self.video_directory, video)
+                if s3_sync.needs_upload(video, key, compare_etag=not offline):
+                    s3_key = key
+                else:
+                    s3_sync.skipped.append(key)
+            stat = os.stat(video)
+            yield PlannedVideo(video, self.get_session_id_from_video(video), video_id, video_id is None, s3_key,
+                               stat.st_size, stat.st_mtime)
 
-        if self._verbose:
-            print(self.output_ok_blue("{0} video(s) found.".format(len(videos_in_directory))))
+    def get_cached_youtube_videos(self):
+        """
+            The videos of the Connect in the channel catalog, without refreshing it
+        """
+        if self.channel_catalog is None or len(self.channel_catalog) == 0:
+            print(self.warning("The channel catalog is empty, every video is planned as an upload"))
+            return []
+        return self.channel_catalog.search(self.connect_code)
 
-        # Run S3 Command to sync videos to private folder
-        synced_with_s3 = self.sync_with_s3(self.video_directory)
+    def complete_plan(self, plan):
+        """
+            Plan every video, the metadata updates of the videos already on YouTube and the
+            duration of the sync
+        """
+        plan.materialize()
+        if plan.metadata_updates is None:
+            plan.metadata_updates = self.plan_metadata_updates(plan)
+        plan.estimated_seconds = self.estimate_duration(plan)
+        return plan
 
-    
-    def get_videos_from_directory(self, directory):
+    def plan_metadata_updates(self, plan):
         """
-            Takes a directory as input and returns a list of the video files found
+            Diff the metadata wanted for the videos already on YouTube against the channel
+            catalog. The catalog does not keep tags, they are set along with the title and
+            description and compared with the videos on YouTube when the plan is executed.
         """
-        types = [".mp4"]
-        
-        # Loop through and find all markdown files
+        metadata_updates = {}
+        desired_metadata = self.get_desired_metadata_of_videos(
+            dict((video_id, video) for video, video_id in plan.get_already_on_youtube().items()))
+        for video_id, metadata in desired_metadata.items():
+            cached = self.channel_catalog.get_video(video_id) if self.channel_catalog is not None else None
+            current = {}
+            if cached is not None:
+                current = {"title": cached["title"], "description": cached["description"],
+                           "privacyStatus": cached["privacy_status"]}
+            changes = dict((field, {"from": current.get(field), "to": value}) for field, value in metadata.items()
+                           if field != "tags" and current.get(field) != value)
+            if "tags" in metadata and ("title" in changes or "description" in changes):
+                changes["tags"] = {"from": None, "to": metadata["tags"]}
+            if changes:
+                metadata_updates[video_id] = changes
+        return metadata_updates
+
+    def estimate_duration(self, plan):
+        """
+            Returns the estimated seconds of the uploads of a plan per destination and in total
+            from the throughput of past runs, None where there is no history to go on
+        """
+        history = self.telemetry.history
+        if history is None:
+            return None
+        youtube_uploads = [video for video in plan.videos if video.upload_to_youtube]
+        s3_uploads = [video for video in plan.videos if video.s3_key is not None]
+        estimated_seconds = {
+            "YouTube": history.estimate_seconds("YouTube", plan.get_youtube_bytes(), len(youtube_uploads), self.jobs),
+            "S3": history.estimate_seconds("S3", plan.get_s3_bytes(), len(s3_uploads), self.jobs),
+        }
+        if None in estimated_seconds.values():
+            estimated_seconds["total"] = None
+        elif self.config.pipeline or self.config.async_mode:
+            # YouTube and S3 are synced side by side
+            estimated_seconds["total"] = max(estimated_seconds.values())
+        else:
+            estimated_seconds["total"] = sum(estimated_seconds.values())
+        return estimated_seconds
+
+    def save_plan(self, plan):
+        self.complete_plan(plan)
+        plan.save(self.config.save_plan)
+        print(self.status("Plan saved to {0}".format(self.config.save_plan)))
+
+    def load_plan(self, path, offline=False):
+        """
+            Load a plan saved by --save-plan, dropping the videos changed since it was made
+            and the uploads that reached YouTube since, e.g. when the plan was executed
+            before. Offline the uploads are only checked against the channel catalog and
+            cached fingerprints.
+        """
+        plan = SyncPlan.load(path)
+        if plan.connect_code != self.connect_code or plan.video_directory != self.video_directory:
+            raise ValueError("{0} is a plan for {1} in {2}".format(path, plan.connect_code, plan.video_directory))
+
         videos = []
-        # For each type in types
-        for type in types:
-            # For each file in directory find matched files
-            for video_file in glob.iglob('{0}/**/*{1}'.format(directory,type), recursive=True):
-                videos.append(video_file)
-        return videos
+        for video in plan.videos:
+            try:
+                stat = os.stat(video.path)
+            except OSError:
+                print(self.warning("{0} is gone since the plan was made, skipping it".format(video.path)))
+                continue
+            if (stat.st_size, stat.st_mtime) != (video.size, video.mtime):
+                print(self.warning("{0} changed since the plan was made, skipping it".format(video.path)))
+                continue
+            videos.append(video)
+        plan.videos = self.drop_done_uploads(videos, offline=offline)
+        return plan
+
+    def drop_done_uploads(self, videos, offline=False):
+        """
+            Returns the PlannedVideos with the uploads of videos already on YouTube turned
+            into videos already on YouTube
+        """
+        uploads = [video.path for video in videos if video.upload_to_youtube]
+        if not uploads:
+            return videos
+        with self.telemetry.stage("youtube_listing"):
+            if offline:
+                current_videos_on_youtube = self.get_cached_youtube_videos()
+            else:
+                current_videos_on_youtube = self.video_manager.get_current_youtube_videos_based_on_string(self.connect_code)
+        index = ReconciliationIndex(current_videos_on_youtube)
+
+        done = {}
+        for path, video_id in index.iter_reconcile(uploads):
+            video_id = self.find_on_youtube(path, video_id, offline=offline)
+            if video_id is not None:
+                print(self.warning("{0} is on YouTube as {1} since the plan was made, not uploading it again".format(path, video_id)))
+                done[path] = video_id
+        return [video._replace(video_id=done[video.path], upload_to_youtube=False) if video.path in done else video
+                for video in videos]
+
+    def report_plan(self, plan):
+        """
+            Output what a plan will upload, update and sync to S3
+        """
+        youtube_uploads = [video for video in plan.videos if video.upload_to_youtube]
+        s3_uploads = [video for video in plan.videos if video.s3_key is not None]
+        privacy_changes = plan.get_privacy_changes()
+        metadata_updates = dict((video_id, fields) for video_id, fields in (plan.metadata_updates or {}).items()
+                                if set(fields) - set(["privacyStatus"]))
+
+        print(self.output_ok_blue("Plan for {0} in {1}, {2} video(s) found, {3} already on YouTube".format(
+            plan.connect_code.upper(), plan.video_directory, len(plan.videos), len(plan.get_already_on_youtube()))))
+
+        print(self.status("{0} upload(s) to YouTube, {1:.2f} GB".format(
+            len(youtube_uploads), plan.get_youtube_bytes() / 1073741824.0)))
+        for video in youtube_uploads:
+            print(self.output_lg("    {0} ({1:.1f} MB)".format(video.path, video.size / 1048576.0)))
+        if plan.upload_privacy and youtube_uploads:
+            print(self.output_lg("    made {0} once uploaded".format(plan.upload_privacy)))
+        if self.has_playlist():
+            print(self.output_lg("    added to the playlist {0} with the videos already on YouTube".format(
+                self.config.playlist_id or self.config.playlist)))
+
+        print(self.status("{0} metadata update(s)".format(len(metadata_updates))))
+        for video_id, fields in sorted(metadata_updates.items()):
+            print(self.output_lg("    {0}: {1}".format(video_id, ", ".join(sorted(set(fields) - set(["privacyStatus"]))))))
+
+        print(self.status("{0} privacy change(s)".format(len(privacy_changes))))
+        for video_id, change in sorted(privacy_changes.items()):
+            print(self.output_lg("    {0}: {1} -> {2}".format(video_id, change["from"] or "unknown", change["to"])))
+
+        print(self.status("{0} put(s) to S3, {1:.2f} GB".format(len(s3_uploads), plan.get_s3_bytes() / 1073741824.0)))
+        for video in s3_uploads:
+            print(self.output_lg("    {0} ({1:.1f} MB)".format(video.s3_key, video.size / 1048576.0)))
+
+        estimated_seconds = plan.estimated_seconds or {}
+        if estimated_seconds.get("total") is None:
+            print(self.status("Estimated duration unknown until a run has measured the throughput of each destination"))
+        else:
+            print(self.status("Estimated duration {0} (YouTube {1}, S3 {2})".format(
+                *[datetime.timedelta(seconds=round(estimated_seconds[destination]))
+                  for destination in ("total", "YouTube", "S3")])))
+
+    def execute(self, plan, wait_for_processing=True):
+        """
+            Upload the videos of a plan to YouTube and S3 and bring the metadata of the videos
+            on YouTube up to date. Returns the SyncResults. When the processing is monitored
+            and wait_for_processing is set, also waits until YouTube has processed the uploads.
+        """
+        results = SyncResults(plan)
+        if self.processing_monitor is not None:
+            # Pick up the videos an interrupted run left processing
+            self.processing_monitor.resume()
+        try:
+            if self.config.async_mode:
+                asyncio.run(self.execute_async(plan, results))
+            else:
+                self.execute_threads(plan, results)
+        finally:
+            if self.preprocessor is not None:
+                self.preprocessor.close()
+            self.record_synced_videos(results)
+
+        if self.processing_monitor is not None and wait_for_processing:
+            results.processing = self.get_processing_results(results, self.wait_for_processing())
+        return results
+
+    def execute_threads(self, plan, results):
+        """
+            Execute a plan with worker threads
+        """
+        if self.config.pipeline:
+            # Sync videos with YouTube and S3 at the same time
+            with self.telemetry.stage("pipeline"):
+                self.sync_pipeline(plan, results)
+        else:
+            # Sync vidoes with YouTube
+            with self.telemetry.stage("youtube_uploads"):
+                results.youtube = self.sync_with_youtube(plan)
+
+        # Bring the metadata and privacy status of every video of the Connect up to date
+        if self.needs_metadata_update(plan):
+            with self.telemetry.stage("youtube_metadata"):
+                try:
+                    results.metadata_updated = self.update_youtube_metadata(results)
+                except QuotaExceeded as e:
+                    results.quota_exceeded = e
+
+        # Add the videos to the playlist of the Connect
+        if self.has_playlist():
+            with self.telemetry.stage("youtube_playlist"):
+                try:
+                    results.playlist_added = self.add_to_playlist(results)
+                except QuotaExceeded as e:
+                    results.quota_exceeded = e
+
+        # Sync videos to the S3 private folder
+        if not self.config.pipeline:
+            results.s3_sync = self.sync_with_s3(plan)
+
+    async def execute_async(self, plan, results):
+        """
+            Execute a plan from a single event loop. Uploads and metadata updates share the
+            keep-alive connections of the async client while the S3 sync runs alongside in a
+            worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        s3_sync = loop.run_in_executor(None, self.sync_with_s3, plan)
+
+        async with AsyncYouTubeClient(
+                self.video_manager.get_access_token,
+                api_url=self.video_manager.get_api_url(),
+                upload_url=self.video_manager.get_upload_url(),
+                connections=self.config.connections,
+                quota=self.quota,
+                chunk_size=self.video_manager.chunk_size if self.video_manager.chunk_size > 0 else 32 * 1024 * 1024,
+                telemetry=self.telemetry,
+                catalog=self.channel_catalog,
+                journal=self.video_manager.journal,
+                adaptive_chunks=self.video_manager.adaptive_chunks) as client:
+            results.youtube = await self.sync_with_youtube_async(client, plan)
+
+            # Bring the metadata and privacy status of every video of the Connect up to date
+            if self.needs_metadata_update(plan):
+                with self.telemetry.stage("youtube_metadata"):
+                    try:
+                        results.metadata_updated = await self.update_youtube_metadata_async(client, results)
+                    except QuotaExceeded as e:
+                        results.quota_exceeded = e
+
+            if self._verbose:
+                print(self.status("{0} YouTube API call(s) made".format(client.api_calls)))
+
+        # The playlist inserts go through the batch endpoint of the googleapiclient service
+        if self.has_playlist():
+            with self.telemetry.stage("youtube_playlist"):
+                try:
+                    results.playlist_added = await loop.run_in_executor(None, self.add_to_playlist, results)
+                except QuotaExceeded as e:
+                    results.quota_exceeded = e
+
+        results.s3_sync = await s3_sync
+
+    async def sync_with_youtube_async(self, client, plan):
+        """
+            Async counterpart of sync_with_youtube, uploading up to --jobs videos at a time
+        """
+        results = []
+        slots = asyncio.Semaphore(max(1, self.jobs))
+        quota_exceeded = asyncio.Event()
+
+        async def upload(options, result):
+            try:
+                result.status = "uploading"
+                result.video_id = await client.upload_video(
+                    options, progress_callback=lambda uploaded, total: setattr(result, "bytes_uploaded", uploaded),
+                    metrics=result.metrics)
+                result.status = "uploaded"
+                # The async client has no catalog, keep it in step like YouTubeVideoManager.upload_video
+                if self.channel_catalog is not None:
+                    self.channel_catalog.upsert(result.video_id, options["title"], options["description"],
+                                                privacy_status=options.get("privacyStatus"))
+                # Fingerprinting reads the whole file with --full-hash, keep it off the event loop
+                await asyncio.get_running_loop().run_in_executor(None, self.record_uploaded, result.file,
+                                                                 result.video_id)
+            except QuotaExceeded as e:
+                quota_exceeded.set()
+                result.status = "deferred"
+                result.error = str(e)
+            except Exception as e:
+                result.status = "failed"
+                result.error = str(e)
+                print(self.failed("Failed to upload {0}: {1}".format(result.title, e)))
+            finally:
+                slots.release()
+
+        uploads = []
+        with self.telemetry.stage("youtube_uploads"):
+            # The directory scan and the fingerprint lookups block so they run in a worker thread
+            async for video, media_file in iterate_in_thread(self.iter_media_files(plan.iter_youtube_uploads())):
+                options = self.get_upload_request(video, media_file)
+                result = UploadResult(options)
+                results.append(result)
+                await slots.acquire()
+                if quota_exceeded.is_set():
+                    slots.release()
+                    result.status = "deferred"
+                    continue
+                uploads.append(asyncio.ensure_future(upload(options, result)))
+            await asyncio.gather(*uploads)
+
+        self.record_youtube_results(results)
+        return results
+
+    async def update_youtube_metadata_async(self, client, results):
+        """
+            Async counterpart of update_youtube_metadata, the lookups and updates all overlap
+        """
+        desired_metadata = self.get_desired_metadata(results)
+        if self._verbose:
+            print(self.status("Checking the metadata of {0} video(s)...".format(len(desired_metadata))))
+
+        return await client.update_videos_metadata(desired_metadata)
+
+    def get_videos_from_directory(self, directory, record=True):
+        """
+            Takes a directory as input and yields the paths of the video files as they are found.
+            With --changed-only, videos unchanged since the last run are skipped.
+            The scan stage lasts until the last video is handed over, so it overlaps the uploads.
+        """
+        count = 0
+        with self.telemetry.stage("scan", directory=directory):
+            for scanned_file in self.directory_scanner.scan(directory, changed_only=self.config.changed_only, record=record):
+                count += 1
+                yield scanned_file.path
+            self.telemetry.event("scan_results", directory=directory, files=count)
 
-    def sync_with_youtube(self, current_videos_on_youtube, videos_in_directory):
+    def get_pending_first(self, videos):
+        """
+            Yields the videos checkpointed by an earlier run first, then the rest of videos
+        """
+        pending = [video for video in self.quota.load_pending()
+                   if video.startswith(os.path.join(self.video_directory, "")) and os.path.exists(video)]
+        for video in pending:
+            yield video
+        pending = set(pending)
+        for video in videos:
+            if video not in pending:
+                yield video
+
+    def sync_with_youtube(self, plan):
         """
             Upload videos to youtube that are not currently uploaded.
         """
-        if current_videos_on_youtube != False:
-            print(current_videos_on_youtube)
-            # For each video in Directory
-            for video in videos_in_directory:
-                # Check if the video is currently on YouTube
-                video_session_id = self.get_session_id_from_video(video)
+        # Upload the missing videos through the worker pool, uploads start while the scan goes on
+        scheduler = UploadScheduler(self.video_manager, jobs=self.jobs, verbose=self._verbose,
+                                    on_uploaded=lambda result: self.record_uploaded(result.file, result.video_id))
+        results = scheduler.run(self.get_upload_requests(plan.iter_youtube_uploads()))
+        self.record_youtube_results(results)
+        return results
+
+    def sync_pipeline(self, plan, results):
+        """
+            Sync videos with YouTube and S3 at the same time. Each video is read from disk once
+            and sent to both destinations side by side.
+        """
+        s3_sync = self.get_s3_sync()
+        # Path -> Future of the file to upload to YouTube, preprocessing while S3 goes ahead
+        media_files = {}
+
+        def send_to_youtube(video, transfer):
+            media_file = video
+            if self.preprocessor is not None:
+                media_file = self.preprocessor.get_result(video, media_files.pop(video))
+            options = self.get_upload_request(video, media_file)
+            result = UploadResult(options)
+            results.youtube.append(result)
+            try:
+                result.video_id = self.video_manager.upload_video(
+                    options, http=self.video_manager.get_http(),
+                    progress_callback=transfer.set, metrics=result.metrics)
+            except QuotaExceeded as e:
+                result.status = "deferred"
+                result.error = str(e)
+                raise
+            except Exception as e:
+                result.status = "failed"
+                result.error = str(e)
+                raise
+            result.status = "uploaded"
+            self.record_uploaded(video, result.video_id)
+
+        def send_to_s3(video, transfer):
+            key = s3_sync.get_key(self.video_directory, video)
+            return s3_sync.upload(video, key, callback=transfer.add)
+
+        with SyncPipeline(jobs=self.jobs, verbose=self._verbose) as pipeline:
+            for video in plan:
+                destinations = {}
+                if video.upload_to_youtube:
+                    if self.preprocessor is not None:
+                        media_files[video.path] = self.preprocessor.submit(video.path)
+                    destinations["YouTube"] = send_to_youtube
+                if video.s3_key is not None:
+                    destinations["S3"] = send_to_s3
+                pipeline.submit(video.path, destinations)
+
+        self.record_youtube_results(results.youtube)
+        if s3_sync is not None:
+            s3_sync.save_listing()
+            self.record_s3_results(plan, s3_sync)
+        results.s3_sync = s3_sync
+
+    def get_reconciliation_index(self, current_videos_on_youtube):
+        """
+            Build the reconciliation index once from the channel listing
+        """
+        index = ReconciliationIndex(current_videos_on_youtube)
+
+        # Report titles that map to the same session id rather than silently matching one
+        for session_id, duplicates in index.duplicates.items():
+            print(self.warning("{0} video(s) on YouTube share the session id {1}:".format(len(duplicates), session_id)))
+            for title, video_id in duplicates:
+                print(self.output_lg("    {0} ({1})".format(title, video_id)))
+        return index
+
+    def find_on_youtube(self, video, video_id, offline=False):
+        """
+            Check whether a local video is already on YouTube, either under its session id
+            (video_id from the reconciliation index) or as a copy with the same content.
+            Offline only cached fingerprints are compared and nothing is recorded.
+            Returns the id of the video on YouTube or None.
+        """
+        if video_id is None:
+            video_id = self.find_duplicate_upload(video, cached_only=offline)
+            if video_id is None:
+                return None
+            print(self.warning("{0} has the same content as the YouTube video {1}, not uploading it again".format(video, video_id)))
+        elif self._verbose:
+            print(self.warning("Video for {0} already on the LinaroOrg YouTube...".format(self.get_session_id_from_video(video))))
+        if not offline:
+            self.record_fingerprint(video, video_id)
+        return video_id
+
+    def record_youtube_results(self, results):
+        """
+            Checkpoint the uploads deferred until the quota resets and record the outcome of
+            each upload to YouTube
+        """
+        # Keep the uploads other Connects left for the next quota window
+        pending = [video for video in self.quota.load_pending()
+                   if not video.startswith(os.path.join(self.video_directory, ""))]
+        self.quota.checkpoint(pending + [result.file for result in results if result.status == "deferred"])
+
+        for result in results:
+            self.telemetry.record_upload("YouTube", result.file, result.status, result.metrics,
+                                         video_id=result.video_id, error=result.error)
+            if result.status == "failed":
+                # Make sure the next --changed-only run picks the video up again
+                self.directory_scanner.forget(result.file)
+
+    def report(self, results):
+        """
+            Output the outcome of a sync from its SyncResults
+        """
+        if self._verbose:
+            print(self.output_ok_blue("{0} video(s) found.".format(len(results.youtube) + len(results.already_on_youtube))))
+
+        self.report_youtube_results(results.youtube)
+
+        if results.metadata_updated is False:
+            print(self.failed("Not every video could be updated"))
+        elif results.metadata_updated is not None:
+            print(self.success("{0} video(s) updated".format(len(results.metadata_updated))))
+
+        if results.playlist_added is False:
+            print(self.failed("Not every video could be added to the playlist"))
+        elif results.playlist_added is not None:
+            print(self.success("{0} video(s) added to the playlist".format(len(results.playlist_added))))
+
+        if results.processing is not None:
+            self.report_processing_results(results.processing)
+
+        if results.s3_sync is not None:
+            self.report_s3_results(results.s3_sync)
+
+        if results.quota_exceeded is not None:
+            print(self.failed("Stopping, the YouTube quota is used up for today: {0}".format(results.quota_exceeded)))
+
+    def report_youtube_results(self, results):
+        """
+            Output the outcome of each upload to YouTube
+        """
+        deferred = [result for result in results if result.status == "deferred"]
+        if deferred:
+            print(self.warning("{0} video(s) left to upload once the YouTube quota resets, they will be uploaded first by the next run".format(len(deferred))))
+
+        for result in results:
+            if result.status == "uploaded":
+                print(self.success("Uploaded {0} ({1})".format(result.title, result.video_id)))
                 if self._verbose:
-                    print(self.output_ok_blue("Checking if the {0} video is on YouTube...".format(video_session_id)))
-                # Check in current videos for video
-                on_youtube = False
-                for current_video in current_videos_on_youtube:
-                    if current_video[0] == video_session_id.lower():
-                        if self._verbose:
-                            print(self.warning("Video for {0} already on the LinaroOrg YouTube...".format(video_session_id)))
-                        on_youtube = True
-                if not on_youtube:
-                    if self._verbose:
-                        print(self.warning("Uploading {0} to the LinaroOrg YouTube...".format(video_session_id)))
-                    video_upload_request = {
-                        "file":video,
-                        "title": video_session_id,
-                        "description": video_session_id,
-                        "keywords": video_session_id,
-                        "category": "28",
-                        "privacyStatus": "private"
-                    }
-                    self.video_manager.upload_video(video_upload_request)
+                    print(self.output_lg("    " + result.metrics.summary()))
+            elif result.status == "failed":
+                print(self.failed("{0}: {1}".format(result.title, result.error)))
+
+    def report_processing_results(self, processing):
+        """
+            Output how far YouTube got processing the videos of the Connect
+        """
+        counts = {}
+        for state in processing.values():
+            counts[state.status] = counts.get(state.status, 0) + 1
+        if counts.get("succeeded"):
+            print(self.success("{0} video(s) processed by YouTube".format(counts["succeeded"])))
+        if counts.get("processing"):
+            print(self.warning("{0} video(s) still processing, the next run with --monitor-processing follows them".format(counts["processing"])))
+
+        for video_id, state in sorted(processing.items()):
+            if state.status not in ("succeeded", "processing"):
+                print(self.failed("Processing of {0} {1}{2}".format(
+                    video_id, state.status, ": " + state.reason if state.reason else "")))
+
+        published = [video_id for video_id, state in processing.items() if state.published]
+        if published:
+            print(self.success("{0} video(s) made {1} once processed".format(len(published), self.config.publish_when_processed)))
+
+    def find_duplicate_upload(self, video, cached_only=False):
+        """
+            Returns the id of a YouTube video with the same content as video or None. Videos
+            no longer on the channel are not matched and, unless cached_only, forgotten.
+        """
+        if self.fingerprint_index is None:
+            return None
+        gone = set()
+
+        def exists(video_id):
+            if self.is_on_channel(video_id, offline=cached_only):
+                return True
+            gone.add(video_id)
+            return False
+
+        video_id = self.fingerprint_index.find_video_id(video, cached_only=cached_only, exists=exists)
+        if not cached_only:
+            for gone_video_id in gone:
+                print(self.warning("{0} has the same content as {1}, which is no longer on the channel".format(video, gone_video_id)))
+                self.fingerprint_index.forget_video(gone_video_id)
+        return video_id
+
+    def is_on_channel(self, video_id, offline=False):
+        """
+            Whether a video was not deleted, rejected or failed to process. The channel
+            catalog, when there is one, is checked first. Unless offline the video is then
+            looked up on YouTube, since the incremental catalog refresh does not see deleted
+            videos, and its status is kept in the catalog.
+        """
+        if self.channel_catalog is not None:
+            cached = self.channel_catalog.get_video(video_id)
+            if cached is None or cached["processing_status"] in UNAVAILABLE_STATUSES:
+                return False
+        if offline:
+            return True
+        state = get_video_processing_state(self.video_manager, video_id, http=self.video_manager.get_http())
+        if self.channel_catalog is not None:
+            self.channel_catalog.update_processing_status(video_id, state.status)
+        return state.status not in UNAVAILABLE_STATUSES
+
+    def record_fingerprint(self, video, video_id):
+        """
+            Remember the content fingerprint of a video on YouTube
+        """
+        if self.fingerprint_index is not None:
+            self.fingerprint_index.record_video(video, video_id)
+
+    def record_uploaded(self, video, video_id):
+        """
+            Record a video just uploaded to YouTube and follow its processing
+        """
+        self.record_fingerprint(video, video_id)
+        if self.processing_monitor is not None:
+            self.processing_monitor.track(video_id)
+
+    def wait_for_processing(self):
+        """
+            Wait until YouTube has processed the videos followed by the processing monitor or
+            --processing-timeout has passed. Returns the dictionary of video id -> ProcessingState.
+        """
+        with self.telemetry.stage("youtube_processing"):
+            if self._verbose and self.processing_monitor.pending:
+                print(self.status("Waiting for YouTube to process {0} video(s)...".format(len(self.processing_monitor.pending))))
+            return self.processing_monitor.wait(timeout=self.config.processing_timeout * 60)
+
+    def get_processing_results(self, results, states):
+        """
+            Returns the ProcessingState of the videos uploaded or already on YouTube out of states
+        """
+        return dict((video_id, states[video_id]) for video_id in self.get_playlist_videos(results) if video_id in states)
+
+    def get_upload_requests(self, videos):
+        """
+            Yields the upload request dictionaries for the videos passed in, as soon as they
+            are preprocessed
+        """
+        for video, media_file in self.iter_media_files(videos):
+            yield self.get_upload_request(video, media_file)
+
+    def iter_media_files(self, videos):
+        """
+            Yields (video, file to upload) for each of videos
+        """
+        if self.preprocessor is None:
+            for video in videos:
+                yield video, video
         else:
-            # Upload the videos supplied
-            for video in videos_in_directory:
-                video_session_id = self.get_session_id_from_video(video)
-                if self._verbose:
-                        print(self.warning("Uploading {0} to YouTube...".format(video)))
-                # Craft the Request Dictionary
-                video_upload_request = {
-                        "file":video,
-                        "title": video_session_id,
-                        "description": video_session_id,
-                        "keywords": video_session_id,
-                        "category": "28",
-                        "privacyStatus": "private"
-                    }
-                self.video_manager.upload_video(video_upload_request)
-        
+            with self.telemetry.stage("preprocess"):
+                for video, media_file in self.preprocessor.process(videos):
+                    yield video, media_file
+
+    def get_upload_request(self, video, media_file=None):
+        """
+            Returns the upload request dictionary for a video, sending media_file instead
+            when it has been preprocessed
+        """
+        video_session_id = self.get_session_id_from_video(video)
+        if self._verbose:
+            print(self.warning("Uploading {0} to the LinaroOrg YouTube...".format(video_session_id)))
+        metadata = self.get_session_metadata(video_session_id)
+        # Craft the Request Dictionary
+        options = {
+            "file":video,
+            "title": metadata["title"],
+            "description": metadata["description"],
+            "keywords": ",".join(metadata["tags"]),
+            "category": "28",
+            "privacyStatus": "private"
+        }
+        if media_file is not None and media_file != video:
+            options["media_file"] = media_file
+        return options
+
+    def load_session_metadata(self):
+        """
+            Index the sessions of every --export once, or None when there is no export
+        """
+        if not self.config.export:
+            return None
+        session_metadata = SessionMetadataStore(slides_directory=self.config.slides)
+        for path in self.config.export:
+            count = session_metadata.load(path)
+            if self._verbose:
+                print(self.status("{0} session(s) read from {1}".format(count, path)))
+        return session_metadata
+
+    def get_session_metadata(self, session_id):
+        """
+            Returns the title, description and tags for the video of a session, the bare
+            session id when the session is not in the export
+        """
+        if self.session_metadata is not None:
+            metadata = self.session_metadata.get_video_metadata(session_id)
+            if metadata is not None:
+                return metadata
+            print(self.warning("{0} is not in the export, using the session id as its title".format(session_id)))
+        return {"title": session_id, "description": session_id, "tags": [session_id]}
+
+    def needs_metadata_update(self, plan):
+        if plan.metadata_updates is not None:
+            return bool(plan.metadata_updates) or plan.upload_privacy is not None
+        return bool(self.config.set_privacy or self.config.update_metadata)
+
+    def get_desired_metadata(self, results):
+        """
+            Returns the dictionary of video id -> fields to set for the videos uploaded or
+            already on YouTube, from --set-privacy and, with --update-metadata, the export.
+            A completed plan carries its own metadata updates.
+        """
+        plan = results.plan
+        if plan.metadata_updates is not None:
+            desired_metadata = plan.get_desired_metadata()
+            if plan.upload_privacy:
+                desired_metadata.update((result.video_id, {"privacyStatus": plan.upload_privacy})
+                                        for result in results.youtube if result.video_id)
+            return desired_metadata
+
+        videos = dict((video_id, video) for video, video_id in results.already_on_youtube.items())
+        videos.update((result.video_id, result.file) for result in results.youtube if result.video_id)
+        return self.get_desired_metadata_of_videos(videos)
+
+    def get_desired_metadata_of_videos(self, videos):
+        """
+            Returns the dictionary of video id -> fields to set from a dictionary of video
+            id -> path
+        """
+        desired_metadata = {}
+        for video_id, video in videos.items():
+            metadata = {}
+            if self.config.update_metadata and self.session_metadata is not None:
+                metadata.update(self.session_metadata.get_video_metadata(self.get_session_id_from_video(video)) or {})
+            if self.config.set_privacy:
+                metadata["privacyStatus"] = self.config.set_privacy
+            if metadata:
+                desired_metadata[video_id] = metadata
+        return desired_metadata
+
+    def update_youtube_metadata(self, results):
+        """
+            Bring the metadata and privacy status of the videos uploaded or already on YouTube
+            up to date in a single batched metadata sync. Only videos that differ are updated.
+            Returns the ids of the videos updated or False when some updates failed.
+        """
+        desired_metadata = self.get_desired_metadata(results)
+        if self._verbose:
+            print(self.status("Checking the metadata of {0} video(s)...".format(len(desired_metadata))))
+
+        updated = self.video_manager.update_videos_metadata(
+            desired_metadata,
+            use_batch_requests=not self.config.no_batch,
+            verbose=self._verbose)
+        return updated
+
+    def has_playlist(self):
+        return bool(self.config.playlist_id or self.config.playlist)
+
+    def get_playlist_id(self):
+        """
+            Returns the id of the playlist of the Connect, from --playlist-id or by looking
+            up the --playlist title, creating the playlist when the channel has none
+        """
+        if self.config.playlist_id:
+            return self.config.playlist_id
+        return self.playlist_sync.resolve(self.config.playlist, privacy_status=self.config.set_privacy or "private")
+
+    def get_playlist_videos(self, results):
+        """
+            Returns the ids of the videos uploaded or already on YouTube in the order of their paths
+        """
+        uploaded = dict((result.file, result.video_id) for result in results.youtube if result.video_id)
+        video_ids = [uploaded.get(video.path) or video.video_id
+                     for video in sorted(results.plan.videos, key=lambda video: video.path)]
+        return [video_id for video_id in video_ids if video_id]
+
+    def add_to_playlist(self, results):
+        """
+            Add the videos uploaded or already on YouTube to the playlist of the Connect.
+            Only the videos missing from the playlist are added, through batched inserts.
+            Returns the ids of the videos added or False when some could not be added.
+        """
+        playlist_id = self.get_playlist_id()
+        if self._verbose:
+            print(self.status("Adding the videos of {0} to the playlist {1}".format(self.connect_code.upper(), playlist_id)))
+        added = self.playlist_sync.add_videos({playlist_id: self.get_playlist_videos(results)})
+        return self.get_playlist_results(playlist_id, added)
+
+    def get_playlist_results(self, playlist_id, added):
+        """
+            Returns the ids of the videos added to playlist_id out of the (playlist id,
+            video id) added, or False when some videos could not be added to it
+        """
+        if any(failed_playlist_id == playlist_id for failed_playlist_id, _ in self.playlist_sync.failed):
+            return False
+        return [video_id for added_playlist_id, video_id in added if added_playlist_id == playlist_id]
+
     def get_session_id_from_video(self, video):
         """
             Extract the session id from a path to a video
         """
-        video_file  = video.split("/")[-1]
-        video_session_id = video_file.rsplit(".mp4")
-        return video_session_id[0]
+        return get_session_id_from_video(video)
+
+    def sync_with_s3(self, plan):
+        """
+            Sync the videos of a plan with the S3 private folder
+        """
+        s3_sync = self.get_s3_sync()
+        if s3_sync is None:
+            return None
+
+        with self.telemetry.stage("s3"):
+            if self._verbose:
+                print(self.status("Syncing {0} with s3://{1}/{2}".format(self.video_directory, s3_sync.bucket, s3_sync.prefix)))
+
+            s3_sync.sync(self.video_directory, plan.iter_s3_uploads())
+        self.record_s3_results(plan, s3_sync)
+        return s3_sync
+
+    def record_synced_videos(self, results):
+        """
+            Record the videos that reached every destination in the scan manifest, so the next
+            --changed-only run skips them. Nothing is recorded for S3 before it was synced.
+        """
+        s3_sync = results.s3_sync
+        if s3_sync is None and not self.config.skip_s3:
+            return
+        uploaded = set(result.file for result in results.youtube if result.status == "uploaded")
+        s3_uploaded = set(s3_sync.uploaded) if s3_sync is not None else set()
+        self.directory_scanner.record_synced([
+            video.path for video in list(results.plan.videos)
+            if (not video.upload_to_youtube or video.path in uploaded)
+            and (video.s3_key is None or video.s3_key in s3_uploaded)])
+
+    def record_s3_results(self, plan, s3_sync):
+        """
+            Make sure the next --changed-only run picks up the videos that failed to upload
+        """
+        for video in plan:
+            if video.s3_key in s3_sync.failed:
+                self.directory_scanner.forget(video.path)
+
+    def get_s3_sync(self, cached_only=False):
+        """
+            Returns the S3Sync for the Connect with its remote listing loaded, or None when
+            S3 is skipped or unavailable. The S3Sync is created once per run.
+            With cached_only the listing only comes from the listing cache.
+        """
+        if self.config.skip_s3:
+            return None
+        if self._s3_sync is not None:
+            return self._s3_sync
+
+        try:
+            s3_sync = S3Sync(
+                self.config.s3_bucket,
+                self.config.s3_prefix or "private/{0}/".format(self.connect_code),
+                profile=self.config.s3_profile or None,
+                endpoint_url=self.config.s3_endpoint_url,
+                part_size=int(self.config.s3_part_size * 1024 * 1024),
+                concurrency=self.config.s3_concurrency,
+                jobs=self.jobs,
+                listing_cache_path=self.config.s3_listing_cache or None,
+                verbose=self._verbose,
+                telemetry=self.telemetry)
+            with self.telemetry.stage("s3_listing"):
+                s3_sync.load_listing(refresh=self.config.refresh_s3_listing and not cached_only,
+                                     cached_only=cached_only)
+        except Exception as e:
+            print(self.failed("Unable to sync with S3: {0}".format(e)))
+            return None
+        self._s3_sync = s3_sync
+        return s3_sync
 
-    def sync_with_s3(self, video_directory):
+    def report_s3_results(self, s3_sync):
         """
-            Sync videos with the S3 private folder
+            Output the outcome of the S3 sync
         """
-        # Separate commands through a \n line break
-        s3_command = "aws s3 --profile ConnectAutomation sync {0} s3://connect.linaro.org/private/yvr18/".format(video_directory)
-        print(self.output_lg(s3_command))
+        print(self.success("{0} video(s) uploaded to S3, {1} already up to date".format(
+            len(s3_sync.uploaded), len(s3_sync.skipped))))
+        for key, error in s3_sync.failed.items():
+            print(self.failed("{0}: {1}".format(key, error)))
 
     def output_lg(self, message):
         return(TermColours.LIGHT_GREY + message + TermColours.ENDC)
@@ -217,6 +1400,244 @@ class ConnectVideoManager:
         return(TermColours.OKCYAN + "STATUS: " + message + TermColours.ENDC)
 
 
+# Options used by the YouTube session, quota, telemetry, caches and stages every Connect of
+# a batch shares, only the command line sets them
+BATCH_SHARED_OPTIONS = (
+    "verbose", "journal", "chunk_size", "adaptive_chunks", "catalog", "rebuild_catalog", "extensions", "manifest",
+    "fingerprints", "full_hash", "pipeline", "async_mode", "daily_quota", "quota_ledger", "pending_uploads",
+    "events", "prometheus", "no_batch", "client_secrets", "credentials", "discovery_cache", "batch", "dry_run",
+    "save_plan", "plan", "throughput_history", "preprocess", "transcode_bitrate", "preprocess_cache",
+    "preprocess_workers", "monitor_processing", "publish_when_processed", "processing_timeout", "processing_poll")
+
+
+class BatchSync:
+    """
+        Syncs every Connect of a batch manifest (see load_batch_manifest) in one run. The
+        Connects share a single YouTube session, quota, telemetry and set of local caches.
+        The channel is listed once and split by connect code, the uploads of every Connect
+        go through one pool of --jobs workers and their metadata updates and playlist inserts
+        share the same batches. With --pipeline or --async the Connects are executed one
+        after the other.
+    """
+
+    def __init__(self, config, service=None):
+        """
+            Set up a ConnectVideoManager for each event of the --batch manifest of a SyncConfig,
+            the options of an event override those of config
+        """
+        if config.plan or config.save_plan:
+            raise ValueError("Saved plans cover a single Connect, --plan and --save-plan cannot be used with --batch")
+        self.config = config
+
+        self.managers = []
+        for event in load_batch_manifest(config.batch):
+            event = dict(event)
+            video_directory, connect_code = event.pop("video_directory"), event.pop("connect_code")
+            shared_options = sorted(set(event) & set(BATCH_SHARED_OPTIONS))
+            if shared_options:
+                raise ValueError("{0} of {1}: {2} can only be set on the command line for every Connect of a batch".format(
+                    connect_code, config.batch, ", ".join(shared_options)))
+            try:
+                options = SyncConfig.parse_options(event)
+            except ValueError as e:
+                raise ValueError("{0} of {1}: {2}".format(connect_code, config.batch, e))
+            event_config = config.for_event(video_directory, connect_code, **options)
+            self.managers.append(ConnectVideoManager(
+                event_config, service=service, shared=self.managers[0] if self.managers else None))
+        if not self.managers:
+            raise ValueError("{0} lists no Connect".format(config.batch))
+
+        # The sync whose YouTube session, quota, telemetry and caches every Connect uses
+        self.shared = self.managers[0]
+
+    def main(self):
+        """
+            Sync every Connect of the manifest
+        """
+        shared = self.shared
+        if self.config.verbose:
+            print(shared.status("{0} unit(s) of YouTube quota left today, enough for {1} upload(s)".format(
+                shared.quota.remaining, shared.quota.get_upload_budget())))
+        try:
+            with shared.telemetry.stage("run"):
+                if self.config.dry_run:
+                    self.dry_run()
+                else:
+                    self.run()
+        except QuotaExceeded as e:
+            print(shared.failed("Stopping, the YouTube quota is used up for today: {0}".format(e)))
+        finally:
+            shared.telemetry.close()
+            print(shared.output_lg("\n".join(shared.telemetry.get_summary())))
+
+    def run(self):
+        """
+            Plan, execute and report the sync of every Connect. Returns the list of SyncResults.
+        """
+        all_results = self.execute(self.plan())
+        self.report(all_results)
+        return all_results
+
+    def dry_run(self):
+        """
+            Print the offline plan of every Connect, see ConnectVideoManager.dry_run.
+            Returns the list of SyncPlans.
+        """
+        plans = []
+        for manager in self.managers:
+            plan = manager.complete_plan(manager.plan(offline=True))
+            manager.report_plan(plan)
+            plans.append(plan)
+        return plans
+
+    def plan(self):
+        """
+            List the channel once and return the SyncPlan of every Connect
+        """
+        video_manager = self.shared.video_manager
+        with self.shared.telemetry.stage("youtube_listing"):
+            if self.config.rebuild_catalog and self.shared.channel_catalog is not None:
+                video_manager.refresh_catalog(full=True)
+            youtube_videos = video_manager.get_current_youtube_videos_based_on_strings(
+                [manager.connect_code for manager in self.managers])
+        return [manager.plan(youtube_videos=youtube_videos[manager.connect_code]) for manager in self.managers]
+
+    def execute(self, plans):
+        """
+            Execute the plans of every Connect. Returns the list of SyncResults.
+        """
+        if self.config.pipeline or self.config.async_mode:
+            all_results = [manager.execute(plan, wait_for_processing=False) for manager, plan in zip(self.managers, plans)]
+            self.wait_for_processing(all_results)
+            return all_results
+
+        if self.shared.processing_monitor is not None:
+            self.shared.processing_monitor.resume()
+        all_results = [SyncResults(plan) for plan in plans]
+        try:
+            with self.shared.telemetry.stage("youtube_uploads"):
+                self.sync_with_youtube(all_results)
+        finally:
+            if self.shared.preprocessor is not None:
+                self.shared.preprocessor.close()
+
+        with self.shared.telemetry.stage("youtube_metadata"):
+            self.update_youtube_metadata(all_results)
+
+        with self.shared.telemetry.stage("youtube_playlist"):
+            self.add_to_playlists(all_results)
+
+        for manager, results in zip(self.managers, all_results):
+            results.s3_sync = manager.sync_with_s3(results.plan)
+            manager.record_synced_videos(results)
+
+        self.wait_for_processing(all_results)
+        return all_results
+
+    def sync_with_youtube(self, all_results):
+        """
+            Upload the videos of every Connect through a single pool of workers, the uploads
+            of a Connect start while the previous Connect is still uploading
+        """
+        # Path -> SyncResults of the Connect of the video
+        owners = {}
+
+        def get_upload_requests():
+            for manager, results in zip(self.managers, all_results):
+                for options in manager.get_upload_requests(results.plan.iter_youtube_uploads()):
+                    owners[options["file"]] = results
+                    yield options
+
+        scheduler = UploadScheduler(
+            self.shared.video_manager, jobs=self.config.jobs, verbose=self.config.verbose,
+            on_uploaded=lambda result: self.shared.record_uploaded(result.file, result.video_id))
+        for result in scheduler.run(get_upload_requests()):
+            owners[result.file].youtube.append(result)
+
+        for manager, results in zip(self.managers, all_results):
+            manager.record_youtube_results(results.youtube)
+
+    def wait_for_processing(self, all_results):
+        """
+            Wait once for YouTube to process the uploads of every Connect and give each
+            SyncResults the processing states of its videos
+        """
+        if self.shared.processing_monitor is None:
+            return
+        states = self.shared.wait_for_processing()
+        for manager, results in zip(self.managers, all_results):
+            results.processing = manager.get_processing_results(results, states)
+
+    def update_youtube_metadata(self, all_results):
+        """
+            Bring the metadata of the videos of every Connect up to date in a single metadata sync
+        """
+        desired_metadata = {}
+        # SyncResults -> ids of the videos of its Connect to update
+        video_ids = {}
+        for manager, results in zip(self.managers, all_results):
+            if manager.needs_metadata_update(results.plan):
+                metadata = manager.get_desired_metadata(results)
+                desired_metadata.update(metadata)
+                video_ids[results] = set(metadata)
+        if not desired_metadata:
+            return
+
+        if self.config.verbose:
+            print(self.shared.status("Checking the metadata of {0} video(s)...".format(len(desired_metadata))))
+        metadata_sync = MetadataSync(self.shared.video_manager, use_batch_requests=not self.config.no_batch,
+                                     verbose=self.config.verbose)
+        try:
+            updated = metadata_sync.sync(desired_metadata)
+        except QuotaExceeded as e:
+            for results in video_ids:
+                results.quota_exceeded = e
+            return
+
+        for results, ids in video_ids.items():
+            if ids & (set(metadata_sync.failed) | set(metadata_sync.missing)):
+                results.metadata_updated = False
+            else:
+                results.metadata_updated = [video_id for video_id in updated if video_id in ids]
+
+    def add_to_playlists(self, all_results):
+        """
+            Add the videos of every Connect to its playlist, the inserts of every playlist
+            sharing the same batches
+        """
+        playlist_videos = {}
+        # SyncResults -> (ConnectVideoManager, id of the playlist of its Connect)
+        playlists = {}
+        try:
+            for manager, results in zip(self.managers, all_results):
+                if manager.has_playlist():
+                    playlist_id = manager.get_playlist_id()
+                    playlists[results] = (manager, playlist_id)
+                    playlist_videos.setdefault(playlist_id, []).extend(manager.get_playlist_videos(results))
+            if playlist_videos:
+                added = self.shared.playlist_sync.add_videos(playlist_videos)
+        except QuotaExceeded as e:
+            for results in playlists:
+                results.quota_exceeded = e
+            return
+
+        for results, (manager, playlist_id) in playlists.items():
+            results.playlist_added = manager.get_playlist_results(playlist_id, added)
+
+    def report(self, all_results):
+        """
+            Output the outcome of the sync of every Connect
+        """
+        for manager, results in zip(self.managers, all_results):
+            print(manager.output_ok_blue("{0} in {1}".format(manager.connect_code.upper(), manager.video_directory)))
+            manager.report(results)
+
+
 # Check to see if script is being executed as opposed to being imported
 if __name__ == "__main__":
-    video_manager = ConnectVideoManager()
\ No newline at end of file
+    config = SyncConfig.from_argv()
+    if config.batch:
+        video_manager = BatchSync(config)
+    else:
+        video_manager = ConnectVideoManager(config)
+    video_manager.main()
\ No newline at end of file
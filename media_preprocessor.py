@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from fingerprint_index import get_partial_fingerprint
+
+# Containers remuxed to mp4 before they are uploaded
+REMUX_EXTENSIONS = (".mov", ".mkv")
+
+# Bitrate of the audio of transcoded videos
+AUDIO_BITRATE = "192k"
+
+# Files above the target bitrate by less than this are not worth transcoding
+BITRATE_TOLERANCE = 1.1
+
+
+class PreprocessError(Exception):
+    """
+        Raised when ffmpeg fails to remux or transcode a video
+    """
+
+
+def get_bitrate(path, ffprobe="ffprobe"):
+    """
+        Returns the overall bitrate of a video in bits per second, or None if unknown
+    """
+    output = subprocess.run(
+        [ffprobe, "-v", "error", "-show_entries", "format=bit_rate", "-of", "default=noprint_wrappers=1:nokey=1", path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, universal_newlines=True).stdout.strip()
+    try:
+        return int(output)
+    except ValueError:
+        return None
+
+
+def get_ffmpeg_command(source, destination, bitrate=None, ffmpeg="ffmpeg"):
+    """
+        The ffmpeg command writing source to destination as a faststart mp4, copying the
+        streams as they are or, given a bitrate in bits per second, transcoding them to H.264
+    """
+    command = [ffmpeg, "-nostdin", "-v", "error", "-y", "-i", source, "-map", "0:v", "-map", "0:a?"]
+    if bitrate is None:
+        command += ["-c", "copy"]
+    else:
+        command += ["-c:v", "libx264", "-preset", "medium", "-b:v", str(bitrate), "-maxrate", str(bitrate),
+                    "-bufsize", str(bitrate * 2), "-c:a", "aac", "-b:a", AUDIO_BITRATE]
+    return command + ["-movflags", "+faststart", "-f", "mp4", destination]
+
+
+def preprocess_video(source, destination, bitrate=None, ffmpeg="ffmpeg", ffprobe="ffprobe"):
+    """
+        Remux or transcode source to destination in a worker process. With a bitrate, videos
+        already at or under it are only remuxed, and mp4 files are left alone. Returns the
+        path of the file to upload.
+    """
+    if bitrate is not None:
+        current_bitrate = get_bitrate(source, ffprobe)
+        if current_bitrate is not None and current_bitrate <= bitrate * BITRATE_TOLERANCE:
+            if source.lower().endswith(".mp4"):
+                return source
+            bitrate = None
+
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    temporary_path = destination + ".part"
+    process = subprocess.run(get_ffmpeg_command(source, temporary_path, bitrate, ffmpeg),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise PreprocessError("ffmpeg failed on {0}: {1}".format(source, process.stderr.strip()[-500:]))
+    os.replace(temporary_path, destination)
+    return destination
+
+
+class MediaPreprocessor:
+    """
+        Remuxes .mov and .mkv recordings to faststart mp4 without re-encoding or, with a
+        target bitrate, transcodes oversized videos before they are uploaded. ffmpeg runs in
+        a pool of worker processes sized to the CPU count. Outputs are cached by the
+        fingerprint of their source so a recording is only processed once, and videos are
+        handed on as soon as they are ready while others are still processing.
+    """
+
+    def __init__(self, cache_directory, bitrate=None, workers=None, ffmpeg="ffmpeg", ffprobe="ffprobe",
+                 verbose=False, telemetry=None):
+        self.cache_directory = cache_directory
+        # Target video bitrate in bits per second, None to only remux
+        self.bitrate = bitrate
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+        self.verbose = verbose
+        self.telemetry = telemetry
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get_output_path(self, path):
+        """
+            Where the processed copy of a video is cached. The file keeps the name of its
+            source so the session id can still be read from it.
+        """
+        settings = "remux" if self.bitrate is None else "h264-{0}".format(self.bitrate)
+        fingerprint = get_partial_fingerprint(path, os.path.getsize(path))
+        name = os.path.splitext(os.path.basename(path))[0] + ".mp4"
+        return os.path.join(self.cache_directory, "{0}-{1}".format(fingerprint, settings), name)
+
+    def needs_processing(self, path):
+        """
+            Only the bitrate of an mp4 can make it worth processing
+        """
+        if self.bitrate is not None:
+            return True
+        return path.lower().endswith(REMUX_EXTENSIONS)
+
+    def submit(self, path):
+        """
+            Returns a Future of the path of the file to upload for the video at path
+        """
+        future = Future()
+        if not self.needs_processing(path):
+            future.set_result(path)
+            return future
+        output_path = self.get_output_path(path)
+        if os.path.exists(output_path):
+            future.set_result(output_path)
+            return future
+
+        with self._lock:
+            if self._executor is None:
+                # The workers are spawned rather than forked from a process running threads
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+        if self.verbose:
+            print("Preprocessing {0}...".format(path))
+        started = time.time()
+        future = self._executor.submit(preprocess_video, path, output_path, self.bitrate, self.ffmpeg, self.ffprobe)
+        future.add_done_callback(lambda done: self.record(path, done, time.time() - started))
+        return future
+
+    def record(self, path, future, seconds):
+        error = future.exception()
+        if error is not None:
+            print("Unable to preprocess {0}, uploading it as it is: {1}".format(path, error))
+        elif self.verbose:
+            print("Preprocessed {0} in {1:.1f}s".format(path, seconds))
+        if self.telemetry is not None:
+            self.telemetry.event("preprocessed", path=path, status="failed" if error else "done",
+                                 output=None if error else future.result(), seconds=round(seconds, 3),
+                                 error=str(error) if error else None)
+
+    def get_result(self, path, future):
+        """
+            The file to upload for a video, the original when it could not be processed
+        """
+        if future.exception() is not None:
+            return path
+        return future.result()
+
+    def process(self, videos):
+        """
+            Yields (video, file to upload) for each of videos, which may be any iterable.
+            Videos that need no processing or are already cached come straight through,
+            the rest as soon as their ffmpeg run finishes.
+        """
+        pending = {}
+        for video in videos:
+            pending[self.submit(video)] = video
+            # Hand on whatever is ready, waiting only while the pool has a full backlog
+            while pending:
+                done = [future for future in pending if future.done()]
+                if not done and len(pending) < self.workers * 2:
+                    break
+                if not done:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    video = pending.pop(future)
+                    yield video, self.get_result(video, future)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                video = pending.pop(future)
+                yield video, self.get_result(video, future)
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+
+import collections
+
+from quota_scheduler import QuotaExceeded
+
+# Fields of a video resource that can be synced and the part of the resource holding them
+SYNCED_FIELDS = {
+    "title": "snippet",
+    "description": "snippet",
+    "tags": "snippet",
+    "categoryId": "snippet",
+    "privacyStatus": "status",
+}
+
+# The YouTube Data API accepts at most 50 ids in a single videos.list call
+MAX_IDS_PER_LIST = 50
+
+# Number of updates sent in a single HTTP batch request
+MAX_REQUESTS_PER_BATCH = 50
+
+
+def chunks(items, size):
+    """
+        Yields successive lists of at most size items
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def get_metadata_update(video, metadata):
+    """
+        Returns the (video_id, part, body) of the update needed to apply metadata to a video
+        resource, or None if it already matches
+    """
+    changed_parts = set()
+    body = {"id": video["id"]}
+    for field, value in metadata.items():
+        part = SYNCED_FIELDS[field]
+        current = video[part].get(field)
+        if field == "tags":
+            current = current or []
+            value = value or []
+        if current != value:
+            changed_parts.add(part)
+    if not changed_parts:
+        return None
+
+    # An update replaces the whole part so send the current values with the changes applied
+    for part in changed_parts:
+        body[part] = dict(video[part])
+        for field, value in metadata.items():
+            if SYNCED_FIELDS[field] == part:
+                body[part][field] = value
+    return video["id"], ",".join(sorted(changed_parts)), body
+
+
+def record_update(catalog, video_id, response):
+    """
+        Keep the channel catalog in step with the video resource returned by an update
+    """
+    if "snippet" in response:
+        catalog.update_metadata(video_id, response["snippet"]["title"], response["snippet"].get("description", ""),
+                                privacy_status=response.get("status", {}).get("privacyStatus"))
+    elif "status" in response:
+        catalog.update_privacy_status(video_id, response["status"]["privacyStatus"])
+
+
+class MetadataSync:
+    """
+        Brings the titles, descriptions, tags and privacy status of videos on YouTube in line
+        with the desired metadata. Current resources are fetched 50 ids per videos.list call
+        and only videos whose fields actually differ are updated, optionally through the
+        HTTP batch endpoint. Nothing here waits for user input.
+    """
+
+    def __init__(self, video_manager, use_batch_requests=True, verbose=False, http=None):
+        self.video_manager = video_manager
+        self.use_batch_requests = use_batch_requests
+        self.verbose = verbose
+        # Transport of the calling thread when it is not the one of the service
+        self.http = http
+        self.updated = []
+        self.failed = {}
+        self.missing = []
+
+    def sync(self, desired_metadata):
+        """
+            Takes a dictionary of video_id -> dictionary of the fields to set e.g
+            {
+                "cDgI_ov_w5Q": {
+                    "title": "YVR18-100k: Opening Keynote by George Grey",
+                    "privacyStatus": "public"
+                }
+            }
+            Fields left out are not changed. Returns the list of the ids of updated videos.
+        """
+        for field in [field for metadata in desired_metadata.values() for field in metadata]:
+            if field not in SYNCED_FIELDS:
+                raise ValueError("Cannot sync the {0} field of a video".format(field))
+
+        candidates = self.filter_with_catalog(desired_metadata)
+        if self.verbose:
+            print("{0} of {1} video(s) may need their metadata updating".format(
+                len(candidates), len(desired_metadata)))
+
+        updates = []
+        for video_ids in chunks(candidates, MAX_IDS_PER_LIST):
+            videos = self.list_videos(video_ids)
+            found = set(video["id"] for video in videos)
+            self.missing.extend(video_id for video_id in video_ids if video_id not in found)
+            for video in videos:
+                update = self.get_update(video, desired_metadata[video["id"]])
+                if update is not None:
+                    updates.append(update)
+
+        if self.use_batch_requests:
+            for batch in chunks(updates, MAX_REQUESTS_PER_BATCH):
+                self.execute_batch(batch)
+        else:
+            for update in updates:
+                self.execute_update(update)
+
+        return self.updated
+
+    def filter_with_catalog(self, desired_metadata):
+        """
+            Drop the videos whose title and description already match the channel catalog
+            when those are the only fields to sync. Everything else has to be checked
+            against the current resource.
+        """
+        catalog = self.video_manager.catalog
+        if catalog is None:
+            return list(desired_metadata)
+
+        candidates = []
+        for video_id, metadata in desired_metadata.items():
+            if set(metadata) - set(["title", "description"]):
+                candidates.append(video_id)
+                continue
+            cached = catalog.get_video(video_id)
+            if cached is None or any(cached[field] != value for field, value in metadata.items()):
+                candidates.append(video_id)
+        return candidates
+
+    def list_videos(self, video_ids):
+        """
+            Fetch the snippet and status of up to 50 videos in a single call
+        """
+        videos_list_response = self.video_manager.execute_request(self.video_manager.service.videos().list(
+            id=",".join(video_ids),
+            part="snippet,status"
+        ), http=self.http)
+        return videos_list_response["items"]
+
+    def get_update(self, video, metadata):
+        """
+            Returns the (video_id, part, body) of the update needed to apply metadata to the
+            video resource, or None if it already matches
+        """
+        return get_metadata_update(video, metadata)
+
+    def get_update_request(self, update):
+        video_id, part, body = update
+        return self.video_manager.service.videos().update(part=part, body=body)
+
+    def execute_update(self, update):
+        try:
+            response = self.video_manager.execute_request(self.get_update_request(update), http=self.http)
+        except Exception as e:
+            self.record_failure(update[0], e)
+        else:
+            self.record_success(update[0], response)
+
+    def execute_batch(self, updates):
+        """
+            Send the updates in a single request to the HTTP batch endpoint
+        """
+        def callback(request_id, response, exception):
+            if exception is not None:
+                self.record_failure(request_id, exception)
+            else:
+                self.record_success(request_id, response)
+
+        # Every request in a batch is charged the quota of a separate call
+        if self.video_manager.quota is not None:
+            try:
+                self.video_manager.quota.reserve("videos.update", count=len(updates))
+            except QuotaExceeded as e:
+                for update in updates:
+                    self.record_failure(update[0], e)
+                return
+
+        requests = collections.OrderedDict((update[0], self.get_update_request(update)) for update in updates)
+        self.video_manager.execute_batch(requests, callback, http=self.http)
+
+    def record_success(self, video_id, response):
+        self.updated.append(video_id)
+        if self.verbose:
+            print("Updated the metadata of {0}".format(video_id))
+        if self.video_manager.catalog is not None:
+            record_update(self.video_manager.catalog, video_id, response)
+
+    def record_failure(self, video_id, exception):
+        self.failed[video_id] = str(exception)
+        print("Failed to update the metadata of {0}: {1}".format(video_id, exception))
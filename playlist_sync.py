@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+
+import collections
+
+from metadata_sync import chunks, MAX_REQUESTS_PER_BATCH
+from quota_scheduler import QuotaExceeded
+
+
+class PlaylistSync:
+    """
+        Keeps the playlists of the Connects on the channel. The playlists of the channel are
+        listed once and looked up by title, missing playlists are created, and the videos
+        missing from a playlist are added through the HTTP batch endpoint, the inserts of
+        several playlists sharing the same batches.
+    """
+
+    def __init__(self, video_manager, use_batch_requests=True, verbose=False):
+        self.video_manager = video_manager
+        self.use_batch_requests = use_batch_requests
+        self.verbose = verbose
+        # Title -> id of the playlists of the channel, listed the first time one is resolved
+        self._playlists = None
+        # Playlist id -> set of the ids of the videos it holds
+        self._playlist_videos = {}
+        # (playlist id, video id) -> error of the videos that could not be added
+        self.failed = {}
+
+    def get_playlists(self):
+        """
+            Returns the dictionary of title -> id of the playlists of the channel
+        """
+        if self._playlists is not None:
+            return self._playlists
+
+        playlists = {}
+        playlists_list_request = self.video_manager.service.playlists().list(
+            mine=True,
+            part="snippet",
+            maxResults=50
+        )
+        while playlists_list_request:
+            playlists_list_response = self.video_manager.execute_request(playlists_list_request)
+            for playlist in playlists_list_response["items"]:
+                playlists.setdefault(playlist["snippet"]["title"], playlist["id"])
+            playlists_list_request = self.video_manager.service.playlists().list_next(
+                playlists_list_request, playlists_list_response)
+
+        self._playlists = playlists
+        return playlists
+
+    def resolve(self, title, privacy_status="private"):
+        """
+            Returns the id of the playlist called title, creating it when the channel has none
+        """
+        playlists = self.get_playlists()
+        if title in playlists:
+            return playlists[title]
+
+        playlist = self.video_manager.execute_request(self.video_manager.service.playlists().insert(
+            part="snippet,status",
+            body=dict(
+                snippet=dict(title=title),
+                status=dict(privacyStatus=privacy_status)
+            )
+        ))
+        print("Created the {0} playlist {1} ({2})".format(privacy_status, title, playlist["id"]))
+        playlists[title] = playlist["id"]
+        # A new playlist is known to be empty
+        self._playlist_videos[playlist["id"]] = set()
+        return playlist["id"]
+
+    def get_video_ids(self, playlist_id):
+        """
+            Returns the set of the ids of the videos in a playlist
+        """
+        if playlist_id in self._playlist_videos:
+            return self._playlist_videos[playlist_id]
+
+        video_ids = set()
+        playlistitems_list_request = self.video_manager.service.playlistItems().list(
+            playlistId=playlist_id,
+            part="contentDetails",
+            maxResults=50
+        )
+        while playlistitems_list_request:
+            playlistitems_list_response = self.video_manager.execute_request(playlistitems_list_request)
+            for playlist_item in playlistitems_list_response["items"]:
+                video_ids.add(playlist_item["contentDetails"]["videoId"])
+            playlistitems_list_request = self.video_manager.service.playlistItems().list_next(
+                playlistitems_list_request, playlistitems_list_response)
+
+        self._playlist_videos[playlist_id] = video_ids
+        return video_ids
+
+    def add_videos(self, playlist_videos):
+        """
+            Takes a dictionary of playlist id -> list of video ids and adds the videos missing
+            from each playlist, in the order given. Returns the list of the (playlist id,
+            video id) added, the failures are kept in failed.
+        """
+        inserts = []
+        for playlist_id, video_ids in playlist_videos.items():
+            current_video_ids = self.get_video_ids(playlist_id)
+            for video_id in video_ids:
+                if video_id not in current_video_ids and (playlist_id, video_id) not in inserts:
+                    inserts.append((playlist_id, video_id))
+        if self.verbose:
+            print("{0} video(s) to add to {1} playlist(s)".format(len(inserts), len(playlist_videos)))
+
+        added = []
+        if self.use_batch_requests:
+            for batch in chunks(inserts, MAX_REQUESTS_PER_BATCH):
+                added.extend(self.execute_batch(batch))
+        else:
+            for insert in inserts:
+                try:
+                    self.video_manager.execute_request(self.get_insert_request(insert))
+                except Exception as e:
+                    self.record_failure(insert, e)
+                else:
+                    added.append(self.record_success(insert))
+        return added
+
+    def get_insert_request(self, insert):
+        playlist_id, video_id = insert
+        return self.video_manager.service.playlistItems().insert(
+            part="snippet",
+            body=dict(
+                snippet=dict(
+                    playlistId=playlist_id,
+                    resourceId=dict(kind="youtube#video", videoId=video_id)
+                )
+            )
+        )
+
+    def execute_batch(self, inserts):
+        """
+            Send the inserts in a single request to the HTTP batch endpoint. Returns the
+            inserts that went through.
+        """
+        added = []
+
+        def callback(request_id, response, exception):
+            insert = inserts[int(request_id)]
+            if exception is not None:
+                self.record_failure(insert, exception)
+            else:
+                added.append(self.record_success(insert))
+
+        # Every request in a batch is charged the quota of a separate call
+        if self.video_manager.quota is not None:
+            try:
+                self.video_manager.quota.reserve("playlistItems.insert", count=len(inserts))
+            except QuotaExceeded as e:
+                for insert in inserts:
+                    self.record_failure(insert, e)
+                return added
+
+        requests = collections.OrderedDict((str(number), self.get_insert_request(insert))
+                                           for number, insert in enumerate(inserts))
+        self.video_manager.execute_batch(requests, callback)
+        return added
+
+    def record_success(self, insert):
+        playlist_id, video_id = insert
+        self._playlist_videos[playlist_id].add(video_id)
+        if self.verbose:
+            print("Added {0} to the playlist {1}".format(video_id, playlist_id))
+        return insert
+
+    def record_failure(self, insert, exception):
+        self.failed[insert] = str(exception)
+        print("Failed to add {0} to the playlist {1}: {2}".format(insert[1], insert[0], exception))
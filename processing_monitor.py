@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+
+import threading
+import time
+from collections import namedtuple
+
+from metadata_sync import chunks, MetadataSync, MAX_IDS_PER_LIST
+from quota_scheduler import QuotaExceeded
+
+# Parts and fields of the video resources read when polling, only the processing outcome is sent
+PROCESSING_PART = "processingDetails,status"
+PROCESSING_FIELDS = "items(id,processingDetails(processingStatus,processingFailureReason),status(uploadStatus,failureReason,rejectionReason))"
+
+# Processing statuses after which a video is no longer polled
+FINAL_STATUSES = ("succeeded", "failed", "rejected", "deleted", "missing")
+
+# Processing statuses of the videos that cannot be watched on the channel
+UNAVAILABLE_STATUSES = ("failed", "rejected", "deleted", "missing")
+
+# Outcome of the processing of a video. status is "processing" or one of FINAL_STATUSES, reason
+# the failure or rejection reason given by YouTube and published the privacy status the video
+# was switched to once processed, if any.
+ProcessingState = namedtuple("ProcessingState", ["status", "reason", "published"])
+
+
+def get_processing_state(video):
+    """
+        The ProcessingState of a video resource with its processingDetails and status
+    """
+    status = video.get("status", {})
+    processing_details = video.get("processingDetails", {})
+    upload_status = status.get("uploadStatus")
+    processing_status = processing_details.get("processingStatus")
+    if upload_status == "rejected":
+        return ProcessingState("rejected", status.get("rejectionReason"), None)
+    if upload_status == "failed":
+        return ProcessingState("failed", status.get("failureReason"), None)
+    if upload_status == "deleted":
+        return ProcessingState("deleted", None, None)
+    if processing_status in ("failed", "terminated"):
+        return ProcessingState("failed", processing_details.get("processingFailureReason") or processing_status, None)
+    if processing_status == "succeeded" or upload_status == "processed":
+        return ProcessingState("succeeded", None, None)
+    return ProcessingState("processing", None, None)
+
+
+def get_video_processing_state(video_manager, video_id, http=None):
+    """
+        Look up the ProcessingState of a single video, "deleted" when it is not on the channel
+    """
+    videos_list_response = video_manager.execute_request(video_manager.service.videos().list(
+        id=video_id,
+        part=PROCESSING_PART,
+        fields=PROCESSING_FIELDS
+    ), http=http)
+    if not videos_list_response["items"]:
+        return ProcessingState("deleted", None, None)
+    return get_processing_state(videos_list_response["items"][0])
+
+
+class ProcessingMonitor:
+    """
+        Follows the videos uploaded by a run until YouTube has finished processing them.
+        A single background thread polls the tracked videos 50 ids per videos.list call,
+        waiting longer between polls while nothing finishes. The outcome of each video is
+        kept in the channel catalog and, given a privacy status to publish, videos are
+        switched to it as soon as they are processed through one batched metadata update
+        per poll.
+    """
+
+    def __init__(self, video_manager, publish_privacy=None, interval=30, max_interval=300, verbose=False,
+                 telemetry=None):
+        self.video_manager = video_manager
+        # Privacy status processed videos are switched to, None to leave them alone
+        self.publish_privacy = publish_privacy
+        # Seconds between polls, doubled up to max_interval after each poll where nothing finished
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.verbose = verbose
+        self.telemetry = telemetry
+        # Video id -> ProcessingState of every tracked video
+        self.states = {}
+        # Video id -> time it was tracked from, for the videos still processing
+        self.pending = {}
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def track(self, video_id):
+        """
+            Start following the processing of a video, from any thread
+        """
+        with self._condition:
+            if video_id in self.states and self.states[video_id].status != "processing":
+                return
+            self.states[video_id] = ProcessingState("processing", None, None)
+            self.pending[video_id] = time.time()
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self.run, name="ProcessingMonitor", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+        if self.video_manager.catalog is not None:
+            self.video_manager.catalog.update_processing_status(video_id, "processing")
+
+    def resume(self):
+        """
+            Follow the videos an earlier run left processing according to the catalog
+        """
+        if self.video_manager.catalog is None:
+            return
+        for video_id in self.video_manager.catalog.get_video_ids_by_processing_status("processing"):
+            self.track(video_id)
+
+    def run(self):
+        """
+            Body of the monitor thread
+        """
+        interval = self.interval
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.pending or self._stopping)
+                # Give the videos time to process before each poll
+                self._condition.wait_for(lambda: self._stopping, timeout=interval)
+                if self._stopping:
+                    return
+            try:
+                finished = self.poll()
+            except QuotaExceeded as e:
+                print("Stopped checking the processing of the uploaded videos: {0}".format(e))
+                with self._condition:
+                    self._stopping = True
+                    self._condition.notify_all()
+                return
+            except Exception as e:
+                print("Unable to check the processing of the uploaded videos, trying again: {0}".format(e))
+                finished = 0
+            interval = self.interval if finished else min(interval * 2, self.max_interval)
+
+    def poll(self):
+        """
+            Check every tracked video once, 50 ids per call. Returns the number of videos
+            whose processing finished.
+        """
+        with self._condition:
+            video_ids = list(self.pending)
+        # The monitor thread must not share the transport of the main thread
+        http = self.video_manager.get_http()
+
+        processed = []
+        finished = 0
+        for batch in chunks(video_ids, MAX_IDS_PER_LIST):
+            videos_list_response = self.video_manager.execute_request(self.video_manager.service.videos().list(
+                id=",".join(batch),
+                part=PROCESSING_PART,
+                fields=PROCESSING_FIELDS
+            ), http=http)
+            found = set()
+            for video in videos_list_response["items"]:
+                found.add(video["id"])
+                state = get_processing_state(video)
+                if state.status == "processing":
+                    continue
+                self.finish(video["id"], state)
+                finished += 1
+                if state.status == "succeeded":
+                    processed.append(video["id"])
+            for video_id in batch:
+                if video_id not in found:
+                    self.finish(video_id, ProcessingState("missing", "Not found on the channel", None))
+                    finished += 1
+
+        if processed and self.publish_privacy is not None:
+            self.publish(processed, http)
+        return finished
+
+    def publish(self, video_ids, http=None):
+        """
+            Switch processed videos to the privacy status to publish
+        """
+        metadata_sync = MetadataSync(self.video_manager, http=http)
+        updated = metadata_sync.sync(dict((video_id, {"privacyStatus": self.publish_privacy}) for video_id in video_ids))
+        for video_id in updated:
+            with self._condition:
+                self.states[video_id] = self.states[video_id]._replace(published=self.publish_privacy)
+            print("Made {0} {1} now that it is processed".format(video_id, self.publish_privacy))
+
+    def finish(self, video_id, state):
+        with self._condition:
+            started = self.pending.pop(video_id, None)
+            self.states[video_id] = state
+            self._condition.notify_all()
+        if self.verbose or state.status != "succeeded":
+            print("Processing of {0} {1}{2}".format(video_id, state.status, ": " + state.reason if state.reason else ""))
+        if self.video_manager.catalog is not None:
+            self.video_manager.catalog.update_processing_status(video_id, state.status)
+        if self.telemetry is not None:
+            self.telemetry.event("processed", video_id=video_id, status=state.status, reason=state.reason,
+                                 seconds=round(time.time() - started, 3) if started else None)
+
+    def wait(self, timeout=None):
+        """
+            Wait until every tracked video is processed or timeout seconds have passed, then
+            stop the monitor. Returns the dictionary of video id -> ProcessingState of every
+            tracked video, those still processing included.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: not self.pending or self._stopping, timeout=timeout)
+            self._stopping = True
+            self._condition.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        with self._condition:
+            return dict(self.states)
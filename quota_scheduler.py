@@ -0,0 +1,254 @@
+#!/usr/bin/python3
+
+import datetime
+import json
+import os
+import threading
+import time
+
+from apiclient.errors import HttpError
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # python < 3.9
+    ZoneInfo = None
+
+# Units of daily YouTube Data API quota used by each method
+QUOTA_COSTS = {
+    "channels.list": 1,
+    "playlists.list": 1,
+    "playlistItems.list": 1,
+    "videos.list": 1,
+    "playlists.insert": 50,
+    "playlistItems.insert": 50,
+    "videos.update": 50,
+    "videos.insert": 1600,
+}
+
+# Default daily quota of a Google Cloud project
+DEFAULT_DAILY_QUOTA = 10000
+
+# Reasons given in a 403 response once the daily quota is used up
+QUOTA_EXCEEDED_REASONS = ("quotaExceeded", "dailyLimitExceeded")
+
+
+class QuotaExceeded(Exception):
+    """
+        Raised when a request does not fit in what is left of the daily quota
+    """
+
+
+def is_quota_exceeded_error(error):
+    """
+        True if an HttpError is YouTube reporting that the daily quota is used up
+    """
+    if not isinstance(error, HttpError) or error.resp.status != 403:
+        return False
+    content = error.content.decode("utf-8", "replace") if isinstance(error.content, bytes) else str(error.content)
+    return any(reason in content for reason in QUOTA_EXCEEDED_REASONS)
+
+
+def get_quota_day():
+    """
+        The day the quota is accounted against. The quota resets at midnight Pacific Time.
+    """
+    if ZoneInfo is not None:
+        try:
+            return datetime.datetime.now(ZoneInfo("America/Los_Angeles")).date().isoformat()
+        except Exception:
+            pass
+    return (datetime.datetime.utcnow() - datetime.timedelta(hours=8)).date().isoformat()
+
+
+class TokenBucket:
+    """
+        Token bucket limiting the rate requests are sent at
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+            Wait until tokens are available and take them
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_seconds = (tokens - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class QuotaLedger:
+    """
+        Persistent record of the quota units used per day, shared by every run on the machine
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.days = {}
+        if path and os.path.exists(path):
+            with open(path) as ledger_file:
+                try:
+                    self.days = json.load(ledger_file)
+                except ValueError:
+                    print("Ignoring unreadable quota ledger {0}".format(path))
+
+    def get_used(self, day=None):
+        with self._lock:
+            return self.days.get(day or get_quota_day(), {}).get("used", 0)
+
+    def is_exhausted(self, day=None):
+        with self._lock:
+            return self.days.get(day or get_quota_day(), {}).get("exhausted", False)
+
+    def try_charge(self, method, count, units, daily_quota):
+        """
+            Charge count calls of method costing units in total against today's quota if they
+            fit. Returns True if they were charged.
+        """
+        day = get_quota_day()
+        with self._lock:
+            entry = self.days.setdefault(day, {"used": 0, "calls": {}, "exhausted": False})
+            if entry["exhausted"] or entry["used"] + units > daily_quota:
+                return False
+            entry["used"] += units
+            entry["calls"][method] = entry["calls"].get(method, 0) + count
+            self.save()
+            return True
+
+    def mark_exhausted(self):
+        """
+            Record that YouTube rejected a request for lack of quota today
+        """
+        day = get_quota_day()
+        with self._lock:
+            self.days.setdefault(day, {"used": 0, "calls": {}, "exhausted": False})["exhausted"] = True
+            self.save()
+
+    def save(self):
+        """
+            Write the ledger to disk. Callers must hold the lock.
+        """
+        if not self.path:
+            return
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as ledger_file:
+            json.dump(self.days, ledger_file, indent=2)
+        os.replace(temporary_path, self.path)
+
+
+class QuotaScheduler:
+    """
+        Central gate for YouTube Data API requests. Knows the unit cost of each method,
+        charges it against the persistent daily ledger and throttles requests with a token
+        bucket. Requests that no longer fit in the daily quota raise QuotaExceeded so the work
+        can be checkpointed for the next quota window instead of crashing the run.
+    """
+
+    def __init__(self, ledger, daily_quota=DEFAULT_DAILY_QUOTA, requests_per_second=10,
+                 pending_path=None, read_reserve=100, telemetry=None):
+        self.ledger = ledger
+        self.daily_quota = daily_quota
+        # Units uploads must leave free so the cheap reads of the next steps still fit
+        self.read_reserve = read_reserve
+        self.bucket = TokenBucket(requests_per_second)
+        self.pending_path = pending_path
+        self.telemetry = telemetry
+
+    def get_method_name(self, request):
+        """
+            The method of a googleapiclient request e.g. youtube.videos.list -> videos.list
+        """
+        return request.methodId.split(".", 1)[1]
+
+    def get_cost(self, method, count=1):
+        return QUOTA_COSTS.get(method, 1) * count
+
+    @property
+    def remaining(self):
+        if self.ledger.is_exhausted():
+            return 0
+        return max(0, self.daily_quota - self.ledger.get_used())
+
+    def reserve(self, method, count=1):
+        """
+            Charge count calls of method against the quota and wait for the rate limit.
+            Raises QuotaExceeded if they do not fit in what is left of today's quota.
+        """
+        cost = self.get_cost(method, count)
+        daily_quota = self.daily_quota
+        if method == "videos.insert":
+            daily_quota -= self.read_reserve
+        if not self.ledger.try_charge(method, count, cost, daily_quota):
+            raise QuotaExceeded("{0} needs {1} unit(s) of quota, {2} left today".format(
+                method, cost, self.remaining))
+        if self.telemetry is not None:
+            self.telemetry.record_api_call(method, count)
+        self.bucket.acquire()
+
+    def execute(self, request, http=None, retry=None):
+        """
+            Execute a googleapiclient request within the quota. retry, when given, is called
+            with a function sending the request and returns its response, so transient errors
+            can be retried without charging the quota again.
+        """
+        self.reserve(self.get_method_name(request))
+        try:
+            if retry is not None:
+                return retry(lambda: request.execute(http=http))
+            return request.execute(http=http)
+        except HttpError as e:
+            if is_quota_exceeded_error(e):
+                self.exhausted()
+                raise QuotaExceeded("YouTube reports the daily quota is used up")
+            raise
+
+    def exhausted(self):
+        """
+            Record that YouTube says the quota is used up, whatever the ledger thinks
+        """
+        self.ledger.mark_exhausted()
+
+    def get_upload_budget(self):
+        """
+            Number of uploads that fit in what is left of today's quota
+        """
+        return max(0, self.remaining - self.read_reserve) // QUOTA_COSTS["videos.insert"]
+
+    def load_pending(self):
+        """
+            Returns the list of files checkpointed by an earlier run that ran out of quota
+        """
+        if not self.pending_path or not os.path.exists(self.pending_path):
+            return []
+        with open(self.pending_path) as pending_file:
+            try:
+                return json.load(pending_file)
+            except ValueError:
+                return []
+
+    def checkpoint(self, pending_files):
+        """
+            Save the files left to upload so the next run starts with them
+        """
+        if not self.pending_path:
+            return
+        if not pending_files:
+            if os.path.exists(self.pending_path):
+                os.remove(self.pending_path)
+            return
+        temporary_path = self.pending_path + ".tmp"
+        with open(temporary_path, "w") as pending_file:
+            json.dump(pending_files, pending_file, indent=2)
+        os.replace(temporary_path, self.pending_path)
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+import os
+
+
+def normalize_session_id(value):
+    """
+        Normalize a session id or a YouTube title to the key used for lookups.
+        Titles are expected to start with the session id e.g
+        "YVR18-100K: Opening Keynote" -> "yvr18-100k"
+    """
+    return value.split(":")[0].strip().lower()
+
+
+def get_session_id_from_video(video):
+    """
+        Extract the session id from a path to a video
+    """
+    return os.path.splitext(os.path.basename(video))[0]
+
+
+class ReconciliationIndex:
+    """
+        Index of the videos currently on YouTube keyed by normalized session id.
+        Built once from the channel listing so each local video can be checked
+        with a single dictionary lookup.
+    """
+
+    def __init__(self, current_videos_on_youtube):
+
+        # Normalized session id -> YouTube video id
+        self.videos = {}
+
+        # Normalized session id -> title of the first video seen for that id
+        self.titles = {}
+
+        # Normalized session id -> list of [title, video_id] sharing that id
+        self.duplicates = {}
+
+        # current_videos_on_youtube is False when nothing matched on the channel
+        if current_videos_on_youtube:
+            for title, video_id in current_videos_on_youtube:
+                self.add(title, video_id)
+
+    def add(self, title, video_id):
+        """
+            Add a single video on the channel to the index
+        """
+        key = normalize_session_id(title)
+        if key in self.videos:
+            if key not in self.duplicates:
+                self.duplicates[key] = [[self.titles[key], self.videos[key]]]
+            self.duplicates[key].append([title, video_id])
+        else:
+            self.videos[key] = video_id
+            self.titles[key] = title
+
+    def get_video_id(self, session_id):
+        """
+            Return the YouTube video id for a session id or None
+        """
+        return self.videos.get(normalize_session_id(session_id))
+
+    def __contains__(self, session_id):
+        return normalize_session_id(session_id) in self.videos
+
+    def __len__(self):
+        return len(self.videos)
+
+    def iter_reconcile(self, videos_in_directory):
+        """
+            Yields (path, video_id) for each local video as it arrives, video_id is None for
+            videos that need uploading. Lets a streamed directory scan feed the uploads.
+        """
+        for video in videos_in_directory:
+            yield video, self.get_video_id(get_session_id_from_video(video))
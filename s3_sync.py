@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+except ImportError:
+    boto3 = None
+
+
+class S3SyncError(Exception):
+    """
+        Raised when the S3 sync cannot run at all
+    """
+
+
+def get_multipart_etag(path, part_size):
+    """
+        Computes the ETag S3 gives an object uploaded from path in parts of part_size bytes
+    """
+    part_digests = []
+    with open(path, "rb") as local_file:
+        for block in iter(lambda: local_file.read(part_size), b""):
+            part_digests.append(hashlib.md5(block).digest())
+    if not part_digests:
+        return '"{0}"'.format(hashlib.md5(b"").hexdigest())
+    # Files no bigger than a part are sent in a single request and get a plain MD5
+    if len(part_digests) == 1:
+        return '"{0}"'.format(part_digests[0].hex())
+    return '"{0}-{1}"'.format(hashlib.md5(b"".join(part_digests)).hexdigest(), len(part_digests))
+
+
+class S3Sync:
+    """
+        Syncs local files to a prefix of an S3 bucket in the same process.
+        Files are compared by size and mtime against a cached listing of the remote prefix,
+        falling back to the ETag, and changed files are sent as parallel multipart uploads.
+        Pass endpoint_url to sync against an S3 compatible stand-in such as MinIO or moto.
+    """
+
+    def __init__(self, bucket, prefix, profile=None, endpoint_url=None, part_size=64 * 1024 * 1024,
+                 concurrency=8, jobs=4, listing_cache_path=None, verbose=False, telemetry=None):
+        if boto3 is None:
+            raise S3SyncError("boto3 is required to sync with S3: pip install --upgrade boto3")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.profile = profile
+        self.endpoint_url = endpoint_url
+        self.part_size = part_size
+        self.jobs = max(1, jobs)
+        self.listing_cache_path = listing_cache_path
+        self.verbose = verbose
+        self.telemetry = telemetry
+        self.transfer_config = TransferConfig(
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            max_concurrency=concurrency)
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.listing = None
+        self.uploaded = []
+        self.skipped = []
+        self.failed = {}
+
+    @property
+    def client(self):
+        """
+            The S3 client, created on first use
+        """
+        with self._client_lock:
+            if self._client is None:
+                session = boto3.session.Session(profile_name=self.profile)
+                self._client = session.client("s3", endpoint_url=self.endpoint_url)
+        return self._client
+
+    def get_key(self, directory, path):
+        """
+            The key a local file is stored under, relative to the synced directory
+        """
+        return self.prefix + os.path.relpath(path, directory).replace(os.sep, "/")
+
+    def load_listing(self, refresh=False, cached_only=False):
+        """
+            Load the listing of the remote prefix, from the cache unless refresh is set or the
+            prefix was never listed. Returns a dictionary of key -> {size, etag, mtime}.
+            With cached_only the prefix is never listed, a prefix missing from the cache
+            is taken to be empty.
+        """
+        cache = self.read_listing_cache()
+        cache_key = "{0}/{1}".format(self.bucket, self.prefix)
+        if not refresh and cache_key in cache:
+            self.listing = cache[cache_key]
+            return self.listing
+        if cached_only:
+            print("s3://{0}/{1} is not in the listing cache, planning every file as an upload".format(
+                self.bucket, self.prefix))
+            self.listing = {}
+            return self.listing
+
+        if self.verbose:
+            print("Listing s3://{0}/{1}...".format(self.bucket, self.prefix))
+        self.listing = {}
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for s3_object in page.get("Contents", []):
+                self.listing[s3_object["Key"]] = {
+                    "size": s3_object["Size"],
+                    "etag": s3_object["ETag"],
+                    "last_modified": s3_object["LastModified"].timestamp(),
+                    "mtime": None
+                }
+        self.save_listing()
+        return self.listing
+
+    def read_listing_cache(self):
+        if not self.listing_cache_path or not os.path.exists(self.listing_cache_path):
+            return {}
+        with open(self.listing_cache_path) as cache_file:
+            try:
+                return json.load(cache_file)
+            except ValueError:
+                return {}
+
+    def save_listing(self):
+        """
+            Write the listing of the remote prefix to the cache
+        """
+        if not self.listing_cache_path:
+            return
+        with self._lock:
+            cache = self.read_listing_cache()
+            cache["{0}/{1}".format(self.bucket, self.prefix)] = self.listing
+            temporary_path = self.listing_cache_path + ".tmp"
+            with open(temporary_path, "w") as cache_file:
+                json.dump(cache, cache_file)
+            os.replace(temporary_path, self.listing_cache_path)
+
+    def needs_upload(self, path, key, compare_etag=True):
+        """
+            Compare a local file with the listing of the remote prefix. Without compare_etag
+            a file that can only be told apart by the ETag of its content is not read and
+            counts as changed.
+        """
+        remote = self.listing.get(key)
+        if remote is None:
+            return True
+        stat = os.stat(path)
+        if remote["size"] != stat.st_size:
+            return True
+        # Objects uploaded by this sync remember the mtime of the file they came from
+        if remote.get("mtime") is not None:
+            return remote["mtime"] != stat.st_mtime
+        # Like aws s3 sync, an object newer than the local file is up to date
+        if remote.get("last_modified", 0) >= stat.st_mtime:
+            return False
+        if not compare_etag:
+            return True
+        return remote["etag"] != get_multipart_etag(path, self.part_size)
+
+    def sync(self, directory, files=None):
+        """
+            Upload the files under directory that are missing or changed on S3.
+            files may be any iterable of paths under directory, e.g. a streamed directory scan,
+            otherwise every file under directory is synced.
+            Returns the list of keys uploaded.
+        """
+        if self.listing is None:
+            self.load_listing()
+        if files is None:
+            files = self.walk(directory)
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            pending = set()
+            for path in files:
+                key = self.get_key(directory, path)
+                if not self.needs_upload(path, key):
+                    self.skipped.append(key)
+                    continue
+                if len(pending) >= self.jobs * 2:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                pending.add(executor.submit(self.upload, path, key))
+            wait(pending)
+
+        self.save_listing()
+        return self.uploaded
+
+    def walk(self, directory):
+        for root, directories, file_names in os.walk(directory):
+            for file_name in file_names:
+                yield os.path.join(root, file_name)
+
+    def upload(self, path, key, callback=None):
+        """
+            Send a single file as a (multipart) upload and record it in the listing.
+            callback is passed the number of bytes sent as the upload goes.
+        """
+        stat = os.stat(path)
+        started = time.time()
+        try:
+            if self.verbose:
+                print("Uploading {0} to s3://{1}/{2}".format(path, self.bucket, key))
+            self.client.upload_file(path, self.bucket, key, Config=self.transfer_config, Callback=callback)
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except Exception as e:
+            with self._lock:
+                self.failed[key] = str(e)
+            print("Failed to upload {0} to S3: {1}".format(path, e))
+            if self.telemetry is not None:
+                self.telemetry.record_file("S3", path, "failed", seconds=time.time() - started, error=str(e))
+            return False
+        if self.telemetry is not None:
+            self.telemetry.record_file("S3", path, "uploaded", stat.st_size, time.time() - started)
+        with self._lock:
+            self.listing[key] = {
+                "size": stat.st_size,
+                "etag": head["ETag"],
+                "last_modified": head["LastModified"].timestamp(),
+                "mtime": stat.st_mtime
+            }
+            self.uploaded.append(key)
+        return True
@@ -0,0 +1,264 @@
+#!/usr/bin/python3
+
+import csv
+import json
+import os
+import threading
+
+try:
+    import frontmatter
+except ImportError:
+    frontmatter = None
+
+try:
+    from PyPDF2 import PdfReader
+except ImportError:
+    try:
+        # PyPDF2 < 1.28
+        from PyPDF2 import PdfFileReader as PdfReader
+    except ImportError:
+        PdfReader = None
+
+from reconciliation_index import normalize_session_id
+
+# Column or front matter key -> field of a session, checked in order
+FIELD_ALIASES = {
+    "session_id": ("session_id", "session_code", "code", "session", "id"),
+    "title": ("title", "name", "session_title"),
+    "description": ("description", "abstract", "session_description", "summary"),
+    "speakers": ("speakers", "speaker", "speaker_names"),
+    "tags": ("tags", "keywords", "tracks", "track"),
+    "slides": ("slides", "slides_url", "slides_pdf", "presentation"),
+}
+
+# Limits YouTube puts on the metadata of a video
+MAX_TITLE_LENGTH = 100
+MAX_DESCRIPTION_LENGTH = 5000
+MAX_TAGS_LENGTH = 500
+
+# Characters of the first slide used as the abstract of sessions without a description
+MAX_ABSTRACT_LENGTH = 1000
+
+
+def normalize_key(key):
+    """
+        "Session ID" -> "session_id"
+    """
+    return key.strip().lower().replace(" ", "_").replace("-", "_")
+
+
+def get_field(record, field):
+    """
+        The value of a field of a session record exported under any of its aliases
+    """
+    for alias in FIELD_ALIASES[field]:
+        value = record.get(alias)
+        if value not in (None, "", []):
+            return value
+    return None
+
+
+def split_list(value):
+    """
+        Tags and speakers come as lists or as comma or semicolon separated strings
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.replace(";", ",").split(",")
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+def get_pdf_reader(path):
+    if PdfReader is None:
+        raise ImportError("PyPDF2 is required to read slides: pip install --upgrade PyPDF2")
+    return PdfReader(path)
+
+
+class SessionMetadataStore:
+    """
+        Index of the sessions of a Connect keyed by normalized session id, built once from the
+        pathable schedule export (CSV or JSON) and the markdown front matter of the Connect site.
+        Later sources fill in and override the fields of earlier ones. Slide PDFs are only
+        opened when a session without a description needs an abstract, and at most once.
+    """
+
+    def __init__(self, slides_directory=None):
+        # Local directory holding the slide PDFs referenced by the sessions
+        self.slides_directory = slides_directory
+        # Normalized session id -> dictionary of the fields of the session
+        self.sessions = {}
+        self._pdf_cache = {}
+        self._lock = threading.Lock()
+
+    def add(self, record, source=None):
+        """
+            Add or update a session from a record with normalized keys
+        """
+        session_id = get_field(record, "session_id")
+        if session_id is None:
+            return False
+        key = normalize_session_id(str(session_id))
+        session = self.sessions.setdefault(key, {"session_id": str(session_id).strip()})
+        for field in ("title", "description", "slides"):
+            value = get_field(record, field)
+            if value is not None:
+                session[field] = str(value).strip()
+        for field in ("speakers", "tags"):
+            value = split_list(get_field(record, field))
+            if value:
+                session[field] = value
+        if source is not None:
+            session["source"] = source
+        return True
+
+    def load(self, path):
+        """
+            Load a pathable export or a directory of markdown files based on the path.
+            Returns the number of sessions read.
+        """
+        if os.path.isdir(path):
+            return self.load_front_matter(path)
+        if path.lower().endswith(".json"):
+            return self.load_json(path)
+        return self.load_csv(path)
+
+    def load_csv(self, path):
+        """
+            Stream the rows of a CSV export into the store
+        """
+        count = 0
+        with open(path, newline="", encoding="utf-8-sig") as export_file:
+            for row in csv.DictReader(export_file):
+                record = dict((normalize_key(key), value) for key, value in row.items() if key)
+                count += self.add(record, path)
+        return count
+
+    def load_json(self, path):
+        """
+            Load a JSON export, either a list of sessions or an object holding one under
+            "sessions", "data" or "items"
+        """
+        with open(path, encoding="utf-8") as export_file:
+            export = json.load(export_file)
+        if isinstance(export, dict):
+            for key in ("sessions", "data", "items"):
+                if isinstance(export.get(key), list):
+                    export = export[key]
+                    break
+            else:
+                export = list(export.values())
+        count = 0
+        for session in export:
+            if isinstance(session, dict):
+                record = dict((normalize_key(key), value) for key, value in session.items())
+                count += self.add(record, path)
+        return count
+
+    def load_front_matter(self, directory):
+        """
+            Read the front matter of every markdown file under directory
+        """
+        if frontmatter is None:
+            raise ImportError("python-frontmatter is required to read markdown: pip install --upgrade python-frontmatter")
+        count = 0
+        for root, directories, file_names in os.walk(directory):
+            for file_name in file_names:
+                if not file_name.lower().endswith((".md", ".markdown")):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    post = frontmatter.load(path)
+                except Exception as e:
+                    print("Ignoring unreadable front matter in {0}: {1}".format(path, e))
+                    continue
+                record = dict((normalize_key(key), value) for key, value in post.metadata.items())
+                # Session pages without a description in their front matter use their body
+                if get_field(record, "description") is None and post.content.strip():
+                    record["description"] = post.content.strip()
+                count += self.add(record, path)
+        return count
+
+    def get(self, session_id):
+        return self.sessions.get(normalize_session_id(session_id))
+
+    def __contains__(self, session_id):
+        return normalize_session_id(session_id) in self.sessions
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get_slides_path(self, session):
+        """
+            The local path of the slide PDF of a session or None
+        """
+        slides = session.get("slides")
+        if not slides or not slides.lower().endswith(".pdf"):
+            return None
+        candidates = [slides]
+        if self.slides_directory:
+            candidates.append(os.path.join(self.slides_directory, os.path.basename(slides)))
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                return candidate
+        return None
+
+    def read_slides(self, session):
+        """
+            Returns the text of the first page of the slides of a session, reading each PDF
+            at most once
+        """
+        path = self.get_slides_path(session)
+        if path is None:
+            return ""
+        with self._lock:
+            if path in self._pdf_cache:
+                return self._pdf_cache[path]
+        try:
+            pages = get_pdf_reader(path).pages
+            first_page = (pages[0].extract_text() or "") if len(pages) else ""
+            text = " ".join(first_page.split())
+        except ImportError:
+            raise
+        except Exception as e:
+            print("Unable to read the slides {0}: {1}".format(path, e))
+            text = ""
+        with self._lock:
+            self._pdf_cache[path] = text
+        return text
+
+    def get_video_metadata(self, session_id):
+        """
+            Returns the title, description and tags of the video of a session or None if the
+            session is unknown. Titles always start with the session id so the video can be
+            matched to its session on later runs.
+        """
+        session = self.get(session_id)
+        if session is None:
+            return None
+
+        title = session.get("title")
+        title = "{0}: {1}".format(session["session_id"], title) if title else session["session_id"]
+
+        description = session.get("description")
+        if not description:
+            # Only open the slides when there is nothing better to describe the session with
+            description = self.read_slides(session)[:MAX_ABSTRACT_LENGTH]
+        lines = [description] if description else []
+        if session.get("speakers"):
+            lines.append("Speakers: {0}".format(", ".join(session["speakers"])))
+        if session.get("slides", "").startswith("http"):
+            lines.append("Slides: {0}".format(session["slides"]))
+
+        tags = []
+        for tag in [session["session_id"]] + session.get("tags", []):
+            if len(",".join(tags + [tag])) > MAX_TAGS_LENGTH:
+                break
+            tags.append(tag)
+
+        # YouTube rejects angle brackets in titles and descriptions
+        return {
+            "title": title.replace("<", "").replace(">", "")[:MAX_TITLE_LENGTH],
+            "description": "\n\n".join(lines).replace("<", "").replace(">", "")[:MAX_DESCRIPTION_LENGTH],
+            "tags": tags,
+        }
@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class TransferProgress:
+    """
+        Bytes sent so far of one file to one destination
+    """
+
+    def __init__(self, destination, path, total_bytes):
+        self.destination = destination
+        self.path = path
+        self.total_bytes = total_bytes
+        self.bytes_done = 0
+        self.status = "pending"
+        self.error = None
+
+    def add(self, bytes_sent):
+        """
+            Progress callback for transfers reporting the bytes sent since the last call
+        """
+        self.bytes_done += bytes_sent
+
+    def set(self, bytes_done, total_bytes=None):
+        """
+            Progress callback for transfers reporting the bytes sent so far
+        """
+        self.bytes_done = bytes_done
+
+
+class ReadAhead(threading.Thread):
+    """
+        Keeps the part of a file just ahead of its furthest destination in the page cache so
+        the destinations share a single pass over the disk. The slower destination reads what
+        the faster one already pulled in and disk reads overlap with the uploads.
+    """
+
+    def __init__(self, path, transfers, window=256 * 1024 * 1024, interval=0.5):
+        super(ReadAhead, self).__init__(daemon=True)
+        self.path = path
+        self.transfers = transfers
+        self.window = window
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        if not hasattr(os, "posix_fadvise"):
+            return
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            advised = 0
+            while not self.stopped.is_set():
+                furthest = max(transfer.bytes_done for transfer in self.transfers)
+                if furthest + self.window > advised:
+                    os.posix_fadvise(fd, advised, furthest + self.window - advised, os.POSIX_FADV_WILLNEED)
+                    advised = furthest + self.window
+                self.stopped.wait(self.interval)
+        finally:
+            os.close(fd)
+
+    def stop(self):
+        self.stopped.set()
+
+
+class SyncPipeline:
+    """
+        Sends each file to all of its destinations at the same time. A file is read once from
+        disk through a shared read-ahead and fed to every destination, files are worked on
+        jobs at a time and the progress of every destination is reported as a single view.
+    """
+
+    def __init__(self, jobs=1, verbose=False, report_interval=10):
+        self.jobs = max(1, jobs)
+        self.verbose = verbose
+        self.report_interval = report_interval
+        self.transfers = []
+        self._lock = threading.Lock()
+        self._executor = None
+        self._destination_executor = None
+        self._pending = set()
+        self._reporter = None
+        self._stopped = threading.Event()
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+        # Every file being worked on can send to all of its destinations at once
+        self._destination_executor = ThreadPoolExecutor(max_workers=self.jobs * 4)
+        self._reporter = threading.Thread(target=self.report_progress, daemon=True)
+        self._reporter.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        wait(self._pending)
+        self._executor.shutdown()
+        self._destination_executor.shutdown()
+        self._stopped.set()
+        self._reporter.join()
+        self.output(self.get_progress_line())
+
+    def submit(self, path, destinations):
+        """
+            Queue a file for its destinations, a dictionary of destination name ->
+            callable taking (path, TransferProgress). Blocks while the queue is full so a
+            streamed list of files is not drained up front.
+        """
+        if not destinations:
+            return []
+        total_bytes = os.path.getsize(path)
+        transfers = [TransferProgress(destination, path, total_bytes) for destination in destinations]
+        with self._lock:
+            self.transfers.extend(transfers)
+        if len(self._pending) >= self.jobs * 2:
+            _, self._pending = wait(self._pending, return_when=FIRST_COMPLETED)
+        self._pending.add(self._executor.submit(self.process, path, destinations, transfers))
+        return transfers
+
+    def process(self, path, destinations, transfers):
+        """
+            Run every destination of a file side by side behind a shared read-ahead
+        """
+        read_ahead = ReadAhead(path, transfers)
+        read_ahead.start()
+        try:
+            futures = [
+                self._destination_executor.submit(self.transfer, destinations[transfer.destination], transfer)
+                for transfer in transfers
+            ]
+            wait(futures)
+        finally:
+            read_ahead.stop()
+
+    def transfer(self, destination, transfer):
+        transfer.status = "sending"
+        try:
+            if destination(transfer.path, transfer) is False:
+                transfer.status = "failed"
+            else:
+                transfer.status = "done"
+                transfer.bytes_done = transfer.total_bytes
+        except Exception as e:
+            transfer.status = "failed"
+            transfer.error = str(e)
+            self.output("Failed to send {0} to {1}: {2}".format(transfer.path, transfer.destination, e))
+
+    def get_progress_line(self):
+        """
+            One line summarising the progress of every destination
+        """
+        with self._lock:
+            transfers = list(self.transfers)
+        destinations = []
+        for destination in sorted(set(transfer.destination for transfer in transfers)):
+            destination_transfers = [transfer for transfer in transfers if transfer.destination == destination]
+            destinations.append("{0}: {1}/{2} file(s), {3:.1f}/{4:.1f} GB{5}".format(
+                destination,
+                len([transfer for transfer in destination_transfers if transfer.status == "done"]),
+                len(destination_transfers),
+                sum(transfer.bytes_done for transfer in destination_transfers) / 1073741824.0,
+                sum(transfer.total_bytes for transfer in destination_transfers) / 1073741824.0,
+                ", {0} failed".format(len([t for t in destination_transfers if t.status == "failed"]))
+                if any(transfer.status == "failed" for transfer in destination_transfers) else ""))
+        return " | ".join(destinations) or "Nothing to sync"
+
+    def report_progress(self):
+        while not self._stopped.wait(self.report_interval):
+            if self.transfers:
+                self.output(self.get_progress_line())
+
+    def output(self, message):
+        with self._lock:
+            print(message)
@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+# Version of the saved plan format
+PLAN_VERSION = 1
+
+# A local video and what the sync has to do with it. video_id is the id of the video on
+# YouTube when it is already there, s3_key the key it is uploaded to when S3 needs it.
+# size and mtime are those of the file when it was planned.
+PlannedVideo = namedtuple("PlannedVideo", ["path", "session_id", "video_id", "upload_to_youtube", "s3_key", "size", "mtime"])
+
+
+class SyncPlan:
+    """
+        What a sync will do with each local video, built by ConnectVideoManager.plan().
+        The plan is filled in as it is iterated so the sync can start uploading before the
+        directory scan finishes. Iterating it again, e.g. for S3 after YouTube, replays the
+        videos already planned. Call materialize() to plan every video up front.
+        A materialized plan can be saved and loaded to execute exactly that plan later.
+    """
+
+    def __init__(self, videos, connect_code=None, video_directory=None):
+        self.connect_code = connect_code
+        self.video_directory = video_directory
+        self.created = time.time()
+        # Iterator planning the rest of the videos, None once it is used up
+        self._pending = iter(videos)
+        # Videos planned so far
+        self.videos = []
+        # Video id -> field -> {"from": current value or None when unknown, "to": desired value}
+        # for the videos already on YouTube, None until the metadata is planned
+        self.metadata_updates = None
+        # Privacy status the videos uploaded by the plan are switched to
+        self.upload_privacy = None
+        # Destination -> estimated seconds, plus the "total", None until estimated
+        self.estimated_seconds = None
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            # Several consumers may iterate the plan at once, e.g. YouTube and S3 in --async
+            with self._lock:
+                if index == len(self.videos):
+                    if self._pending is None:
+                        return
+                    try:
+                        self.videos.append(next(self._pending))
+                    except StopIteration:
+                        self._pending = None
+                        return
+                video = self.videos[index]
+            index += 1
+            yield video
+
+    def materialize(self):
+        for video in self:
+            pass
+        return self
+
+    def iter_youtube_uploads(self):
+        for video in self:
+            if video.upload_to_youtube:
+                yield video.path
+
+    def iter_s3_uploads(self):
+        for video in self:
+            if video.s3_key is not None:
+                yield video.path
+
+    def get_already_on_youtube(self):
+        """
+            Returns the dictionary of path -> YouTube video id of the videos planned so far
+            that are already on YouTube
+        """
+        return dict((video.path, video.video_id) for video in list(self.videos) if video.video_id is not None)
+
+    def get_youtube_bytes(self):
+        return sum(video.size for video in list(self.videos) if video.upload_to_youtube)
+
+    def get_s3_bytes(self):
+        return sum(video.size for video in list(self.videos) if video.s3_key is not None)
+
+    def get_privacy_changes(self):
+        """
+            Returns the dictionary of video id -> {"from", "to"} of the privacy status changes
+        """
+        return dict((video_id, fields["privacyStatus"]) for video_id, fields in (self.metadata_updates or {}).items()
+                    if "privacyStatus" in fields)
+
+    def get_desired_metadata(self):
+        """
+            Returns the dictionary of video id -> fields to set of the planned metadata updates
+        """
+        return dict((video_id, dict((field, change["to"]) for field, change in fields.items()))
+                    for video_id, fields in (self.metadata_updates or {}).items())
+
+    def to_dict(self):
+        self.materialize()
+        return {
+            "version": PLAN_VERSION,
+            "created": self.created,
+            "connect_code": self.connect_code,
+            "video_directory": self.video_directory,
+            "videos": [video._asdict() for video in self.videos],
+            "metadata_updates": self.metadata_updates,
+            "upload_privacy": self.upload_privacy,
+            "estimated_seconds": self.estimated_seconds,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError("Unsupported sync plan version {0}".format(data.get("version")))
+        plan = cls([PlannedVideo(**video) for video in data["videos"]],
+                   connect_code=data["connect_code"], video_directory=data["video_directory"])
+        plan.created = data["created"]
+        plan.metadata_updates = data["metadata_updates"]
+        plan.upload_privacy = data["upload_privacy"]
+        plan.estimated_seconds = data["estimated_seconds"]
+        return plan.materialize()
+
+    def save(self, path):
+        data = self.to_dict()
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as plan_file:
+            json.dump(data, plan_file, indent=2)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as plan_file:
+            return cls.from_dict(json.load(plan_file))
+
+
+class SyncResults:
+    """
+        Outcome of executing a SyncPlan
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+        # UploadResult of every video sent to YouTube
+        self.youtube = []
+        # S3Sync holding the keys uploaded, skipped and failed, None when S3 was skipped
+        self.s3_sync = None
+        # Ids of the videos whose metadata was updated, False when some updates failed and
+        # None when no update was asked for
+        self.metadata_updated = None
+        # Ids of the videos added to the playlist of the Connect, False when some could not
+        # be added and None when the Connect has no playlist
+        self.playlist_added = None
+        # Video id -> ProcessingState of the videos of the Connect followed until YouTube
+        # processed them, None when the processing was not monitored
+        self.processing = None
+        # QuotaExceeded that stopped part of the sync
+        self.quota_exceeded = None
+
+    @property
+    def already_on_youtube(self):
+        return self.plan.get_already_on_youtube()
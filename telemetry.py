@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Prefix of the metrics written to the Prometheus text file
+METRIC_PREFIX = "connect_video_manager"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(name, escape_label(value)) for name, value in sorted(labels.items())) + "}"
+
+
+class ThroughputHistory:
+    """
+        Upload throughput per destination measured by past runs, used to estimate how long a
+        sync plan will take. Each run is blended into the history so recent runs count the most.
+    """
+
+    def __init__(self, path, weight=0.5):
+        self.path = path
+        # Share of the history given to the latest run
+        self.weight = weight
+        # Destination -> {"bytes_per_second": throughput of a single file, "runs": ...}
+        self.destinations = {}
+        if path and os.path.exists(path):
+            with open(path) as history_file:
+                try:
+                    self.destinations = json.load(history_file)
+                except ValueError:
+                    print("Ignoring unreadable throughput history {0}".format(path))
+
+    def get_bytes_per_second(self, destination):
+        entry = self.destinations.get(destination)
+        return entry["bytes_per_second"] if entry else None
+
+    def estimate_seconds(self, destination, total_bytes, files, jobs=1):
+        """
+            Seconds to send files totalling total_bytes to destination, jobs files at a time,
+            or None when no run has measured the destination yet
+        """
+        if not files:
+            return 0.0
+        bytes_per_second = self.get_bytes_per_second(destination)
+        if not bytes_per_second:
+            return None
+        return total_bytes / (bytes_per_second * max(1, min(jobs, files)))
+
+    def update(self, destinations):
+        """
+            Blend in the destination totals of a run recorded by Telemetry
+        """
+        for destination, totals in destinations.items():
+            if totals["bytes"] <= 0 or totals["seconds"] <= 0:
+                continue
+            bytes_per_second = totals["bytes"] / totals["seconds"]
+            entry = self.destinations.get(destination)
+            if entry is None:
+                entry = self.destinations[destination] = {"bytes_per_second": bytes_per_second, "runs": 0}
+            else:
+                entry["bytes_per_second"] = (1 - self.weight) * entry["bytes_per_second"] + self.weight * bytes_per_second
+            entry["runs"] += 1
+
+    def save(self):
+        if not self.path:
+            return
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as history_file:
+            json.dump(self.destinations, history_file, indent=2)
+        os.replace(temporary_path, self.path)
+
+
+class Telemetry:
+    """
+        Records where a run spends its time: the duration of each stage, the time, bytes,
+        throughput and retries of every file sent to each destination and the API calls made.
+        Events are appended to a JSON lines file as they happen, the totals can be written
+        to a Prometheus text format file (e.g. for the node exporter textfile collector) and
+        summarised as a table at the end of the run. The throughput of the run is added to the
+        optional ThroughputHistory when it closes.
+    """
+
+    def __init__(self, events_path=None, prometheus_path=None, history=None):
+        self.events_path = events_path
+        self.prometheus_path = prometheus_path
+        self.history = history
+        self._lock = threading.Lock()
+        self._events_file = open(events_path, "a", buffering=1) if events_path else None
+        self.started = time.time()
+        # Stage name -> seconds spent in the stage
+        self.stages = {}
+        # Destination -> {"files": {status: count}, "bytes": ..., "seconds": ..., "retries": ...}
+        self.destinations = {}
+        # API method -> number of calls
+        self.api_calls = {}
+
+    def event(self, name, **fields):
+        """
+            Append an event to the JSON lines stream
+        """
+        if self._events_file is None:
+            return
+        record = {"time": round(time.time(), 3), "event": name}
+        record.update(fields)
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._events_file.write(line + "\n")
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        """
+            Time a stage of the run, e.g. with telemetry.stage("listing"): ...
+            Time spent in a stage entered more than once is added up.
+        """
+        started = time.time()
+        self.event("stage_started", stage=name, **fields)
+        status = "failed"
+        try:
+            yield
+            status = "done"
+        finally:
+            seconds = time.time() - started
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+            self.event("stage_finished", stage=name, status=status, seconds=round(seconds, 3), **fields)
+
+    def record_file(self, destination, path, status, bytes_sent=0, seconds=0.0, retries=0, **fields):
+        """
+            Record the outcome of sending a file to a destination
+        """
+        with self._lock:
+            totals = self.destinations.setdefault(
+                destination, {"files": {}, "bytes": 0, "seconds": 0.0, "retries": 0})
+            totals["files"][status] = totals["files"].get(status, 0) + 1
+            totals["bytes"] += bytes_sent
+            totals["seconds"] += seconds
+            totals["retries"] += retries
+        self.event("file", destination=destination, path=path, status=status, bytes=bytes_sent,
+                   seconds=round(seconds, 3), bytes_per_second=round(bytes_sent / seconds) if seconds > 0 else 0,
+                   retries=retries, **fields)
+
+    def record_upload(self, destination, path, status, metrics, **fields):
+        """
+            Record a file from the UploadMetrics of its upload
+        """
+        self.record_file(destination, path, status, metrics.bytes_sent, metrics.elapsed, metrics.retries,
+                         chunks=metrics.chunks, **fields)
+
+    def record_retry(self, destination, path, error):
+        self.event("retry", destination=destination, path=path, error=str(error))
+
+    def record_api_call(self, method, count=1):
+        with self._lock:
+            self.api_calls[method] = self.api_calls.get(method, 0) + count
+
+    def get_prometheus_metrics(self):
+        """
+            The totals of the run in the Prometheus text exposition format
+        """
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append("# HELP {0}_{1} {2}".format(METRIC_PREFIX, name, help_text))
+            lines.append("# TYPE {0}_{1} {2}".format(METRIC_PREFIX, name, metric_type))
+            for labels, value in samples:
+                lines.append("{0}_{1}{2} {3}".format(METRIC_PREFIX, name, format_labels(labels), value))
+
+        with self._lock:
+            metric("run_seconds", "gauge", "Duration of the run so far.",
+                   [({}, round(time.time() - self.started, 3))])
+            metric("last_run_timestamp_seconds", "gauge", "Time the run started.",
+                   [({}, round(self.started, 3))])
+            metric("stage_seconds", "gauge", "Time spent in each stage of the run.",
+                   [({"stage": stage}, round(seconds, 3)) for stage, seconds in sorted(self.stages.items())])
+            metric("files", "gauge", "Files handled per destination and outcome.",
+                   [({"destination": destination, "status": status}, count)
+                    for destination, totals in sorted(self.destinations.items())
+                    for status, count in sorted(totals["files"].items())])
+            metric("bytes", "gauge", "Bytes sent per destination.",
+                   [({"destination": destination}, totals["bytes"])
+                    for destination, totals in sorted(self.destinations.items())])
+            metric("retries", "gauge", "Retries per destination.",
+                   [({"destination": destination}, totals["retries"])
+                    for destination, totals in sorted(self.destinations.items())])
+            metric("api_calls", "gauge", "YouTube Data API calls per method.",
+                   [({"method": method}, count) for method, count in sorted(self.api_calls.items())])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        if not self.prometheus_path:
+            return
+        temporary_path = self.prometheus_path + ".tmp"
+        with open(temporary_path, "w") as prometheus_file:
+            prometheus_file.write(self.get_prometheus_metrics())
+        os.replace(temporary_path, self.prometheus_path)
+
+    def get_summary(self):
+        """
+            The totals of the run as the lines of a table
+        """
+        with self._lock:
+            lines = ["{0:<24} {1:>10}".format("Stage", "Seconds")]
+            for stage, seconds in sorted(self.stages.items(), key=lambda item: -item[1]):
+                lines.append("{0:<24} {1:>10.1f}".format(stage, seconds))
+
+            if self.destinations:
+                lines.append("")
+                lines.append("{0:<12} {1:>6} {2:>6} {3:>8} {4:>10} {5:>10} {6:>8}".format(
+                    "Destination", "Sent", "Failed", "Deferred", "GB", "MB/s/file", "Retries"))
+                for destination, totals in sorted(self.destinations.items()):
+                    files = totals["files"]
+                    lines.append("{0:<12} {1:>6} {2:>6} {3:>8} {4:>10.2f} {5:>10.2f} {6:>8}".format(
+                        destination, files.get("uploaded", 0), files.get("failed", 0), files.get("deferred", 0),
+                        totals["bytes"] / 1073741824.0,
+                        totals["bytes"] / 1048576.0 / totals["seconds"] if totals["seconds"] > 0 else 0.0,
+                        totals["retries"]))
+
+            if self.api_calls:
+                lines.append("")
+                lines.append("{0:<24} {1:>10}".format("API method", "Calls"))
+                for method, count in sorted(self.api_calls.items()):
+                    lines.append("{0:<24} {1:>10}".format(method, count))
+        return lines
+
+    def close(self):
+        """
+            Write the Prometheus file and throughput history and close the event stream
+        """
+        self.event("run_finished", seconds=round(time.time() - self.started, 3))
+        self.write_prometheus()
+        if self.history is not None:
+            with self._lock:
+                self.history.update(self.destinations)
+            self.history.save()
+        if self._events_file is not None:
+            self._events_file.close()
+            self._events_file = None
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+# The modules of the sync live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_backend import FakeBackend  # noqa: E402
+
+# Bucket the tests sync to on the fake backend
+TEST_BUCKET = "connect-test"
+
+
+@pytest.fixture
+def environment(tmp_path, monkeypatch):
+    """
+        Keeps the caches of the sync in a temporary working directory and sets the S3
+        credentials, for tests starting their own fake backend
+    """
+    monkeypatch.chdir(tmp_path)
+    # The fake backend accepts any credentials
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    return tmp_path
+
+
+@pytest.fixture
+def backend(environment):
+    """
+        A fake YouTube and S3 backend, with the caches of the sync kept in a temporary
+        working directory
+    """
+    with FakeBackend() as fake_backend:
+        yield fake_backend
@@ -0,0 +1,57 @@
+import os
+import sys
+
+from media_preprocessor import MediaPreprocessor
+
+# Stands in for ffmpeg: logs each run and writes the input with a header to the output,
+# failing like ffmpeg on inputs named "broken"
+STUB_FFMPEG = """#!{0}
+import sys
+source, destination = sys.argv[sys.argv.index("-i") + 1], sys.argv[-1]
+with open("ffmpeg.log", "a") as log_file:
+    log_file.write(source + "\\n")
+if "broken" in source:
+    sys.exit("{{0}}: Invalid data found when processing input".format(source))
+with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+    destination_file.write(b"remuxed:" + source_file.read())
+"""
+
+
+def write_file(path, content):
+    with open(path, "wb") as output_file:
+        output_file.write(content)
+    return path
+
+
+def get_ffmpeg_runs():
+    with open("ffmpeg.log") as log_file:
+        return log_file.read().split()
+
+
+def test_process_remuxes_caches_and_falls_back_to_the_original(environment):
+    ffmpeg = write_file("ffmpeg", STUB_FFMPEG.format(sys.executable).encode())
+    os.chmod(ffmpeg, 0o755)
+    os.mkdir("videos")
+    recording = write_file(os.path.join("videos", "yvr18-0.mov"), b"recording")
+    broken = write_file(os.path.join("videos", "yvr18-1-broken.mkv"), b"not a video")
+    mp4 = write_file(os.path.join("videos", "yvr18-2.mp4"), b"already an mp4")
+    videos = [recording, broken, mp4]
+
+    with MediaPreprocessor(".preprocessed", workers=2, ffmpeg=os.path.abspath(ffmpeg)) as preprocessor:
+        media_files = dict(preprocessor.process(iter(videos)))
+    assert sorted(media_files) == sorted(videos)
+    assert media_files[mp4] == mp4
+    # ffmpeg failed, the original is uploaded and nothing is left in the cache for it
+    assert media_files[broken] == broken
+    remuxed = media_files[recording]
+    assert remuxed == preprocessor.get_output_path(recording)
+    assert remuxed.startswith(".preprocessed") and os.path.basename(remuxed) == "yvr18-0.mp4"
+    with open(remuxed, "rb") as remuxed_file:
+        assert remuxed_file.read() == b"remuxed:recording"
+    assert sorted(get_ffmpeg_runs()) == sorted([recording, broken])
+    assert [name for _, _, names in os.walk(".preprocessed") for name in names] == ["yvr18-0.mp4"]
+
+    # The remuxed copy is cached, only the broken recording goes through ffmpeg again
+    with MediaPreprocessor(".preprocessed", workers=2, ffmpeg=os.path.abspath(ffmpeg)) as preprocessor:
+        assert dict(preprocessor.process(videos)) == media_files
+    assert sorted(get_ffmpeg_runs()) == sorted([recording, broken, broken])
@@ -0,0 +1,402 @@
+import json
+import os
+import sqlite3
+import time
+
+import pytest
+
+from channel_catalog import ChannelCatalog
+from conftest import TEST_BUCKET
+from fake_backend import FakeBackend, create_video_directory
+from main import BatchSync, ConnectVideoManager, SyncConfig
+
+MODES = {
+    "threads": {},
+    "pipeline": {"pipeline": True},
+    "async": {"async_mode": True},
+}
+
+
+def get_manager(backend, video_directory="videos", connect_code="yvr18", **options):
+    options.setdefault("s3_bucket", TEST_BUCKET)
+    options.setdefault("s3_profile", "")
+    options.setdefault("s3_endpoint_url", backend.url)
+    options.setdefault("daily_quota", 10 ** 9)
+    options.setdefault("chunk_size", 0.25)
+    return ConnectVideoManager(SyncConfig(video_directory, connect_code, **options),
+                               service=backend.get_youtube_service())
+
+
+def sync(backend, **options):
+    manager = get_manager(backend, **options)
+    return manager.execute(manager.plan())
+
+
+def get_s3_keys(backend):
+    return sorted(backend.s3.buckets.get(TEST_BUCKET, {}))
+
+
+@pytest.mark.parametrize("mode", sorted(MODES))
+def test_sync_uploads_each_video_once(backend, mode):
+    backend.youtube.populate(5, connect_code="other")
+    backend.youtube.populate(2, connect_code="yvr18")
+    backend.s3.create_bucket(TEST_BUCKET)
+    create_video_directory("videos", 4, 1024 * 1024, "yvr18")
+
+    results = sync(backend, **MODES[mode])
+    assert sorted(result.status for result in results.youtube) == ["uploaded", "uploaded"]
+    assert len(results.already_on_youtube) == 2
+    assert len(backend.youtube.uploaded) == 2
+    assert get_s3_keys(backend) == ["private/yvr18/yvr18-{0}.mp4".format(number) for number in range(4)]
+
+    catalog = ChannelCatalog(".channel_catalog.sqlite3")
+    assert catalog.is_complete()
+    assert sorted(title.split(":")[0].upper() for title, _ in catalog.search("yvr18")) == \
+        ["YVR18-{0}".format(number) for number in range(4)]
+
+    results = sync(backend, **MODES[mode])
+    assert results.youtube == []
+    assert len(backend.youtube.uploaded) == 2
+
+
+def interrupt_upload(backend):
+    """
+        Start the upload of videos/yvr18-0.mp4 and stop it after the first chunk
+    """
+    path = os.path.join("videos", "yvr18-0.mp4")
+    manager = get_manager(backend, skip_s3=True)
+
+    def interrupt(uploaded, total):
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        manager.video_manager.upload_video(manager.get_upload_request(path), progress_callback=interrupt)
+    assert backend.youtube.uploaded == []
+    assert 0 < backend.youtube.bytes_received < 1024 * 1024
+
+
+@pytest.mark.parametrize("mode", sorted(MODES))
+def test_interrupted_upload_resumes_from_the_journal(backend, mode):
+    create_video_directory("videos", 1, 1024 * 1024, "yvr18")
+    interrupt_upload(backend)
+
+    results = sync(backend, skip_s3=True, **MODES[mode])
+    assert [result.status for result in results.youtube] == ["uploaded"]
+    assert len(backend.youtube.sessions) == 1
+    assert backend.youtube.bytes_received == 1024 * 1024
+    with open(".upload_journal.json") as journal_file:
+        assert json.load(journal_file) == {}
+
+
+def test_async_upload_restarts_an_expired_session(backend):
+    create_video_directory("videos", 1, 1024 * 1024, "yvr18")
+    interrupt_upload(backend)
+    backend.youtube.sessions.clear()
+
+    results = sync(backend, skip_s3=True, async_mode=True, adaptive_chunks=True)
+    assert [result.status for result in results.youtube] == ["uploaded"]
+    assert len(backend.youtube.sessions) == 1
+    assert len(backend.youtube.uploaded) == 1
+
+
+def test_interrupted_catalog_build_is_not_trusted(backend):
+    backend.youtube.populate(120, connect_code="yvr18")
+    manager = get_manager(backend, skip_s3=True)
+    iter_channel_videos = manager.video_manager.iter_channel_videos
+
+    def broken_listing(matching=None):
+        for number, video in enumerate(iter_channel_videos(matching)):
+            if number == 60:
+                raise ConnectionResetError("Connection reset by peer")
+            yield video
+
+    manager.video_manager.iter_channel_videos = broken_listing
+    with pytest.raises(ConnectionResetError):
+        manager.video_manager.refresh_catalog()
+    assert not manager.channel_catalog.is_complete()
+
+    manager = get_manager(backend, skip_s3=True)
+    assert len(manager.video_manager.get_current_youtube_videos_based_on_string("yvr18")) == 120
+
+
+def test_saved_plan_executed_twice_uploads_once(backend):
+    backend.s3.create_bucket(TEST_BUCKET)
+    create_video_directory("videos", 3, 1024 * 1024, "yvr18")
+    get_manager(backend, dry_run=True, save_plan="plan.json").main()
+
+    for _ in range(2):
+        get_manager(backend, plan="plan.json").main()
+    assert len(backend.youtube.uploaded) == 3
+
+
+def test_dry_run_reads_no_video(backend):
+    create_video_directory("videos", 3, 1024 * 1024, "yvr18")
+    get_manager(backend, dry_run=True).main()
+    assert backend.requests == 0
+    assert sqlite3.connect(".fingerprints.sqlite3").execute("SELECT COUNT(*) FROM files").fetchone()[0] == 0
+    assert not os.path.exists(".scan_manifest.json")
+
+
+def test_changed_only_looks_again_at_videos_not_synced_to_s3(backend):
+    create_video_directory("videos", 2, 1024 * 1024, "yvr18")
+    # The bucket is missing so the S3 sync cannot run
+    results = sync(backend, changed_only=True)
+    assert len(backend.youtube.uploaded) == 2
+    assert results.s3_sync is None
+
+    backend.s3.create_bucket(TEST_BUCKET)
+    manager = get_manager(backend, changed_only=True, refresh_s3_listing=True)
+    plan = manager.plan().materialize()
+    assert len(plan.videos) == 2
+    manager.execute(plan)
+    assert len(get_s3_keys(backend)) == 2
+
+    plan = get_manager(backend, changed_only=True).plan().materialize()
+    assert plan.videos == []
+
+
+def test_batch_manifest_csv_fields_are_parsed(backend):
+    create_video_directory("sfo17", 1, 1024 * 1024, "sfo17")
+    create_video_directory("hkg18", 1, 1024 * 1024, "hkg18")
+    with open("sessions.csv", "w") as sessions_file:
+        sessions_file.write("Session ID,Title\n")
+    with open("batch.csv", "w") as manifest_file:
+        manifest_file.write("video_directory,connect_code,export,jobs,skip_s3,set_privacy\n"
+                            "sfo17,SFO17,sessions.csv,2,yes,public\n"
+                            "hkg18,HKG18,,,,\n")
+    batch = BatchSync(SyncConfig(None, None, batch="batch.csv", skip_s3=True, daily_quota=10 ** 9),
+                      service=backend.get_youtube_service())
+    assert [(manager.config.export, manager.config.jobs, manager.config.skip_s3, manager.config.set_privacy)
+            for manager in batch.managers] == [(["sessions.csv"], 2, True, "public"), ([], 1, True, None)]
+    batch.main()
+    assert len(backend.youtube.uploaded) == 2
+
+    with open("shared.csv", "w") as manifest_file:
+        manifest_file.write("video_directory,connect_code,catalog\nsfo17,SFO17,other.sqlite3\n")
+    with pytest.raises(ValueError):
+        BatchSync(SyncConfig(None, None, batch="shared.csv"), service=backend.get_youtube_service())
+
+
+def test_async_upload_retries_starting_the_session(backend):
+    create_video_directory("videos", 2, 1024 * 1024, "yvr18")
+    handle_upload_start = backend.youtube.handle_upload_start
+    calls = []
+
+    def flaky_upload_start(handler, method, path, query):
+        calls.append(path)
+        if len(calls) == 1:
+            handler.read_body()
+            return handler.reply(503, backend.youtube.get_error(503, "backendError", "Injected error"))
+        return handle_upload_start(handler, method, path, query)
+
+    backend.youtube.handle_upload_start = flaky_upload_start
+    results = sync(backend, skip_s3=True, async_mode=True)
+    assert [result.status for result in results.youtube] == ["uploaded", "uploaded"]
+    assert len(calls) == 3
+
+
+def test_async_metadata_updates_keep_the_catalog_and_report_failures(backend):
+    backend.youtube.populate(3, connect_code="yvr18")
+    create_video_directory("videos", 3, 1024 * 1024, "yvr18")
+    results = sync(backend, skip_s3=True, async_mode=True, set_privacy="public")
+    assert sorted(results.metadata_updated) == sorted(results.already_on_youtube.values())
+
+    catalog = ChannelCatalog(".channel_catalog.sqlite3")
+    assert [catalog.get_video(video_id)["privacy_status"] for video_id in results.already_on_youtube.values()] == \
+        ["public"] * 3
+
+    # A video deleted since the channel was listed cannot be updated
+    deleted = backend.youtube.videos_by_id.pop("v0000000001")
+    backend.youtube.videos.remove(deleted)
+    results = sync(backend, skip_s3=True, async_mode=True, set_privacy="unlisted")
+    assert results.metadata_updated is False
+
+
+def test_deleted_copy_is_uploaded_again(backend):
+    create_video_directory("videos", 1, 1024 * 1024, "yvr18")
+    sync(backend, skip_s3=True)
+    # A renamed copy of the upload is recognised by its content
+    os.rename(os.path.join("videos", "yvr18-0.mp4"), os.path.join("videos", "yvr18-9.mp4"))
+    assert sync(backend, skip_s3=True).youtube == []
+
+    video = backend.youtube.videos_by_id.pop(backend.youtube.uploaded[0])
+    backend.youtube.videos.remove(video)
+    results = sync(backend, skip_s3=True)
+    assert [result.status for result in results.youtube] == ["uploaded"]
+    assert len(backend.youtube.uploaded) == 2
+
+
+def test_processing_monitor_publishes_processed_videos(backend):
+    backend.youtube.processing_seconds = 0.5
+    create_video_directory("videos", 2, 1024 * 1024, "yvr18")
+    results = sync(backend, skip_s3=True, publish_when_processed="public", processing_poll=0.1)
+    assert sorted(state.status for state in results.processing.values()) == ["succeeded", "succeeded"]
+    assert [backend.youtube.videos_by_id[video_id]["privacyStatus"] for video_id in backend.youtube.uploaded] == \
+        ["public", "public"]
+    catalog = ChannelCatalog(".channel_catalog.sqlite3")
+    assert [catalog.get_video(video_id)["processing_status"] for video_id in backend.youtube.uploaded] == \
+        ["succeeded", "succeeded"]
+
+
+def test_async_upload_retries_timed_out_chunks(backend, monkeypatch):
+    import async_youtube_client
+    monkeypatch.setattr(async_youtube_client, "READ_TIMEOUT", 0.5)
+    create_video_directory("videos", 1, 1024 * 1024, "yvr18")
+    handle_upload_chunk = backend.youtube.handle_upload_chunk
+    calls = []
+
+    def slow_upload_chunk(handler, method, path, query):
+        calls.append(path)
+        if len(calls) == 1:
+            time.sleep(1.5)
+        return handle_upload_chunk(handler, method, path, query)
+
+    backend.youtube.handle_upload_chunk = slow_upload_chunk
+    results = sync(backend, skip_s3=True, async_mode=True)
+    assert [(result.status, result.metrics.retries) for result in results.youtube] == [("uploaded", 1)]
+    assert len(backend.youtube.uploaded) == 1
+
+
+def test_failed_api_calls_are_retried_and_charged_once(backend, monkeypatch):
+    from youtube_video_manager import YouTubeVideoManager
+    retries = []
+    monkeypatch.setattr(YouTubeVideoManager, "wait_before_retry",
+                        lambda self, retry, error, name: retries.append(name))
+    backend.youtube.populate(3, connect_code="yvr18")
+    create_video_directory("videos", 5, 1024 * 1024, "yvr18")
+    call = backend.youtube.call
+    succeeded = {}
+    failed = []
+
+    def flaky_call(method, resource, query, body):
+        # Every other call fails, the retry of a failed call goes through
+        if (sum(succeeded.values()) + len(failed)) % 2 == 0 and len(failed) < 20:
+            failed.append(resource)
+            return 503, backend.youtube.get_error(503, "backendError", "Injected error")
+        name = "{0}.{1}".format(resource, {"GET": "list", "PUT": "update", "POST": "insert"}[method])
+        succeeded[name] = succeeded.get(name, 0) + 1
+        return call(method, resource, query, body)
+
+    backend.youtube.call = flaky_call
+    results = sync(backend, skip_s3=True, set_privacy="public", playlist="YVR18")
+    assert sorted(result.status for result in results.youtube) == ["uploaded", "uploaded"]
+    assert len(results.metadata_updated) == 5
+    assert len(backend.youtube.playlists) == 1
+    assert len(list(backend.youtube.playlists.values())[0]["videos"]) == 5
+    assert "batch" in retries and "youtube.playlistItems.list" in retries
+
+    with open(".quota_ledger.json") as ledger_file:
+        ledger = json.load(ledger_file)
+    calls = list(ledger.values())[0]["calls"]
+    assert dict((method, count) for method, count in calls.items() if method != "videos.insert") == succeeded
+
+
+@pytest.mark.parametrize("mode", sorted(MODES))
+def test_sync_with_injected_errors_uploads_each_video_once(environment, mode):
+    with FakeBackend(error_rate=0.05, seed=3) as backend:
+        backend.youtube.populate(60, connect_code="other")
+        backend.youtube.populate(2, connect_code="yvr18")
+        backend.s3.create_bucket(TEST_BUCKET)
+        create_video_directory("videos", 5, 1024 * 1024, "yvr18")
+
+        results = sync(backend, set_privacy="public", **MODES[mode])
+        assert sorted(result.status for result in results.youtube) == ["uploaded"] * 3
+        assert sorted(backend.youtube.videos_by_id[video_id]["title"].split(":")[0] for video_id in
+                      backend.youtube.uploaded) == ["yvr18-{0}".format(number) for number in range(2, 5)]
+        assert get_s3_keys(backend) == ["private/yvr18/yvr18-{0}.mp4".format(number) for number in range(5)]
+
+        assert sync(backend, **MODES[mode]).youtube == []
+        assert len(backend.youtube.uploaded) == 3
+        assert backend.errors_injected > 0
+
+
+def write_pdf(path, text):
+    """
+        Write a one page PDF showing text
+    """
+    stream = "BT /F1 24 Tf 72 720 Td ({0}) Tj ET".format(text)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        "/Resources << /Font << /F1 5 0 R >> >> >>",
+        "<< /Length {0} >>\nstream\n{1}\nendstream".format(len(stream), stream),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    document = "%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(document))
+        document += "{0} 0 obj\n{1}\nendobj\n".format(number, body)
+    xref = len(document)
+    document += "xref\n0 {0}\n0000000000 65535 f \n".format(len(objects) + 1)
+    document += "".join("{0:010d} 00000 n \n".format(offset) for offset in offsets)
+    document += "trailer\n<< /Size {0} /Root 1 0 R >>\nstartxref\n{1}\n%%EOF\n".format(len(objects) + 1, xref)
+    with open(path, "w") as pdf_file:
+        pdf_file.write(document)
+
+
+def test_uploads_take_their_metadata_from_the_exports(backend):
+    create_video_directory("videos", 3, 1024 * 1024, "yvr18")
+    keywords = ";".join("keyword-{0:03d}".format(number) for number in range(60))
+    with open("schedule.csv", "w") as export_file:
+        export_file.write("Session Code,Name,Abstract,Speaker,Keywords\n")
+        export_file.write("YVR18-0,Opening <Keynote>,The state of Linaro,George Grey,{0}\n".format(keywords))
+        export_file.write("YVR18-1,Old title,Kernel work,Jane Doe; John Doe,Kernel\n")
+    with open("schedule.json", "w") as export_file:
+        json.dump({"sessions": [{"id": "yvr18-1", "session_title": "Upstream Kernel", "tracks": "Kernel, Security"}]},
+                  export_file)
+    os.mkdir("site")
+    with open(os.path.join("site", "yvr18-2.md"), "w") as page_file:
+        page_file.write("---\nsession: YVR18-2\ntitle: Toolchain\nslides: https://example.org/yvr18-2.pdf\n---\n")
+    os.mkdir("slides")
+    write_pdf(os.path.join("slides", "yvr18-2.pdf"), "Building with LLVM")
+
+    results = sync(backend, skip_s3=True, export=["schedule.csv", "schedule.json", "site"], slides="slides")
+    assert sorted(result.status for result in results.youtube) == ["uploaded"] * 3
+    videos = dict((video["title"].split(":")[0], video) for video in backend.youtube.videos)
+
+    opening = videos["YVR18-0"]
+    assert opening["title"] == "YVR18-0: Opening Keynote"
+    assert opening["description"] == "The state of Linaro\n\nSpeakers: George Grey"
+    assert opening["tags"][:2] == ["YVR18-0", "keyword-000"]
+    assert len(",".join(opening["tags"])) <= 500 < len("YVR18-0," + keywords)
+
+    # The JSON export overrides the title and tags of the CSV and keeps its description
+    kernel = videos["YVR18-1"]
+    assert kernel["title"] == "YVR18-1: Upstream Kernel"
+    assert kernel["description"] == "Kernel work\n\nSpeakers: Jane Doe, John Doe"
+    assert kernel["tags"] == ["YVR18-1", "Kernel", "Security"]
+
+    # Without a description the first slide is the abstract
+    toolchain = videos["YVR18-2"]
+    assert toolchain["title"] == "YVR18-2: Toolchain"
+    assert toolchain["description"] == "Building with LLVM\n\nSlides: https://example.org/yvr18-2.pdf"
+    assert toolchain["tags"] == ["YVR18-2"]
+
+
+def test_uploads_over_the_quota_are_deferred_to_the_next_run(backend):
+    paths = create_video_directory("videos", 5, 1024 * 1024, "yvr18")
+    # Two uploads of 1,600 units fit in 3,500 units, the listing calls take the rest
+    results = sync(backend, skip_s3=True, daily_quota=3500, jobs=1)
+    uploaded = [result.file for result in results.youtube if result.status == "uploaded"]
+    deferred = [result.file for result in results.youtube if result.status == "deferred"]
+    assert len(uploaded) == 2 and len(deferred) == 3
+    assert sorted(uploaded + deferred) == sorted(paths)
+    with open(".pending_uploads.json") as pending_file:
+        assert sorted(json.load(pending_file)) == sorted(deferred)
+
+    # The next day the deferred videos are uploaded before the videos added since
+    create_video_directory("videos", 2, 1024 * 1024, "yvr18", start=5)
+    os.remove(".quota_ledger.json")
+    results = sync(backend, skip_s3=True, daily_quota=3500, jobs=1)
+    uploaded = [result.file for result in results.youtube if result.status == "uploaded"]
+    assert len(uploaded) == 2 and set(uploaded) < set(deferred)
+    with open(".pending_uploads.json") as pending_file:
+        assert len(json.load(pending_file)) == 3
+
+    os.remove(".quota_ledger.json")
+    results = sync(backend, skip_s3=True, jobs=1)
+    assert len([result for result in results.youtube if result.status == "uploaded"]) == 3
+    assert len(backend.youtube.uploaded) == 7
+    assert not os.path.exists(".pending_uploads.json")
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+import json
+import os
+import threading
+
+
+class UploadJournal:
+    """
+        On-disk journal of in-flight resumable uploads. For every file being uploaded it keeps
+        the resumable session URI, the last acknowledged byte offset and the size and mtime of
+        the file so a later run can carry on where an interrupted one stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as journal_file:
+                try:
+                    self.entries = json.load(journal_file)
+                except ValueError:
+                    # A corrupt journal only costs us the ability to resume
+                    print("Ignoring unreadable upload journal {0}".format(self.path))
+
+    def get(self, video_file):
+        """
+            Returns the journal entry for a file or None.
+            Entries for files whose size or mtime changed since they were journaled are stale
+            and are removed so the upload restarts cleanly.
+        """
+        with self._lock:
+            entry = self.entries.get(video_file)
+            if entry is None:
+                return None
+            stat = os.stat(video_file)
+            if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+                print("{0} changed since it was last uploaded, restarting upload".format(video_file))
+                del self.entries[video_file]
+                self.save()
+                return None
+            return entry
+
+    def record(self, video_file, session_uri, offset):
+        """
+            Records the session URI and the acknowledged offset for a file
+        """
+        stat = os.stat(video_file)
+        with self._lock:
+            self.entries[video_file] = {
+                "session_uri": session_uri,
+                "offset": offset,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime
+            }
+            self.save()
+
+    def remove(self, video_file):
+        """
+            Forget a file once its upload completed or its session can no longer be used
+        """
+        with self._lock:
+            if self.entries.pop(video_file, None) is not None:
+                self.save()
+
+    def save(self):
+        """
+            Write the journal to disk. Callers must hold the lock.
+            The journal is replaced atomically so a crash never leaves a half written file.
+        """
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as journal_file:
+            json.dump(self.entries, journal_file, indent=2)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(temporary_path, self.path)
+
+    def __len__(self):
+        return len(self.entries)
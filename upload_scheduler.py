@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from adaptive_chunking import UploadMetrics
+from quota_scheduler import QuotaExceeded
+
+
+class UploadResult:
+    """
+        Holds the progress and outcome of a single file handled by the UploadScheduler
+    """
+
+    def __init__(self, options):
+        self.file = options["file"]
+        self.title = options["title"]
+        self.status = "pending"
+        self.bytes_uploaded = 0
+        self.total_bytes = None
+        self.video_id = None
+        self.error = None
+        self.metrics = UploadMetrics(self.title)
+
+    @property
+    def progress(self):
+        """
+            Fraction of the file uploaded so far
+        """
+        if not self.total_bytes:
+            return 0.0
+        return float(self.bytes_uploaded) / self.total_bytes
+
+    def __repr__(self):
+        return "UploadResult({0}, {1})".format(self.title, self.status)
+
+
+class UploadScheduler:
+    """
+        Uploads videos through a bounded pool of worker threads. Each worker runs its own
+        resumable session over its own authorized httplib2.Http so uploads can run side by side.
+        A failed upload is recorded against its file and does not stop the rest of the run.
+    """
+
+    def __init__(self, video_manager, jobs=1, verbose=False, on_uploaded=None):
+        self.video_manager = video_manager
+        self.jobs = max(1, jobs)
+        self.verbose = verbose
+        # Called from the worker thread with the UploadResult of every successful upload
+        self.on_uploaded = on_uploaded
+        self.results = []
+        self._lock = threading.Lock()
+        # Set once the daily quota is used up, later uploads are deferred to the next window
+        self.quota_exceeded = False
+
+    def run(self, upload_requests):
+        """
+            Upload each of the request dictionaries (see YouTubeVideoManager.upload_video).
+            upload_requests may be any iterable, it is consumed as workers become free.
+            Returns the list of UploadResult objects in submission order.
+        """
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            pending = set()
+            for options in upload_requests:
+                # Keep the queue bounded so a streamed iterable is not drained up front
+                if len(pending) >= self.jobs * 2:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                result = UploadResult(options)
+                self.results.append(result)
+                if self.quota_exceeded:
+                    result.status = "deferred"
+                    continue
+                pending.add(executor.submit(self.upload, options, result))
+            wait(pending)
+        return self.results
+
+    def upload(self, options, result):
+        """
+            Worker body uploading a single file and recording the outcome on result
+        """
+        result.status = "uploading"
+        try:
+            result.video_id = self.video_manager.upload_video(
+                options,
+                http=self.video_manager.get_http(),
+                progress_callback=lambda uploaded, total: self.update_progress(result, uploaded, total),
+                metrics=result.metrics)
+            result.status = "uploaded"
+            if self.on_uploaded is not None:
+                self.on_uploaded(result)
+        except QuotaExceeded as e:
+            self.quota_exceeded = True
+            result.error = str(e)
+            result.status = "deferred"
+        except Exception as e:
+            result.error = str(e)
+            result.status = "failed"
+            self.output("Failed to upload {0}: {1}".format(result.title, e))
+        return result
+
+    def update_progress(self, result, bytes_uploaded, total_bytes):
+        """
+            Progress callback passed to YouTubeVideoManager.upload_video
+        """
+        result.bytes_uploaded = bytes_uploaded
+        result.total_bytes = total_bytes
+        if self.verbose:
+            self.output("{0}: {1:.1%} uploaded".format(result.title, result.progress))
+
+    def output(self, message):
+        """
+            Print a message without interleaving output from other workers
+        """
+        with self._lock:
+            print(message)
+
+    @property
+    def uploaded(self):
+        return [result for result in self.results if result.status == "uploaded"]
+
+    @property
+    def deferred(self):
+        return [result for result in self.results if result.status == "deferred"]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if result.status == "failed"]
@@ -6,19 +6,32 @@ except ImportError:  # python3 compatibility
     from http import client
     httplib = client
 
+import glob
 import httplib2
+import json
 import os
 import random
 import sys
+import threading
 import time
 
-from apiclient.discovery import build
+from apiclient.discovery import build_from_document
+from apiclient.discovery import V2_DISCOVERY_URI
 from apiclient.errors import HttpError
+from apiclient.errors import ResumableUploadError
 from apiclient.http import MediaFileUpload
+from apiclient.http import build_http
+from googleapiclient import discovery_cache
 from oauth2client import client
 from oauth2client import file
 from oauth2client import tools
 
+from adaptive_chunking import AdaptiveChunkSizer, UploadMetrics, align_chunk_size
+from channel_listing import CHANNEL_LISTING_FIELDS, CHANNEL_LISTING_PART, compile_video_matcher, get_channel_video
+from reconciliation_index import normalize_session_id
+from quota_scheduler import QuotaExceeded, is_quota_exceeded_error
+from metadata_sync import MetadataSync
+
 class cmd_flags(object):
     """
         Used to provide command-line level authentication rather than
@@ -30,12 +43,51 @@ class cmd_flags(object):
         self.logging_level = 'ERROR'
         self.noauth_local_webserver = True
 
+class YouTubeConfig:
+    """
+        Where YouTubeVideoManager finds its OAuth 2.0 client secrets and stored credentials,
+        where it caches the discovery document of the API and the playlist of the Connect.
+        client_secrets_file defaults to the only client_secret*.json in the working directory.
+    """
+
+    def __init__(self, client_secrets_file=None, credentials_file="youtube_video_manager-oauth2.json",
+                 discovery_cache_file=".youtube_discovery.json", playlist_id=None):
+        self.client_secrets_file = client_secrets_file
+        self.credentials_file = credentials_file
+        # Discovery document of the YouTube Data API, '' or None to build it on every run
+        self.discovery_cache_file = discovery_cache_file
+        # Id of the playlist of the current Connect, if it has one
+        self.playlist_id = playlist_id
+
+    def get_client_secrets_file(self):
+        if self.client_secrets_file:
+            return self.client_secrets_file
+        candidates = sorted(glob.glob("client_secret*.json"))
+        if len(candidates) != 1:
+            raise ValueError("Pass the OAuth 2.0 client secrets file to use, {0} client_secret*.json file(s) found".format(
+                len(candidates)))
+        return candidates[0]
+
+
+class UploadError(Exception):
+    """
+        Raised when an upload fails and should not be retried any further
+    """
+
+
 class YouTubeVideoManager:
     """ 
         This class interacts with Google's YouTube Data API
     """
 
-    def __init__(self):
+    # Privacy statuses we can use to set on YouTube videos
+    VALID_PRIVACY_STATUSES = ('public', 'private', 'unlisted')
+
+    def __init__(self, config=None, journal=None, chunk_size=None, adaptive_chunks=False, catalog=None, quota=None,
+                 telemetry=None, service=None):
+
+        # Credentials, discovery cache and playlist settings
+        self.config = config if config is not None else YouTubeConfig()
 
         # Explicitly tell the underlying HTTP transport library not to retry, since
         # we are handling retry logic ourselves.
@@ -55,22 +107,26 @@ class YouTubeVideoManager:
         # Maximum number of times to retry before giving up.
         self.MAX_RETRIES = 10
 
-        # The clients secrets file to use when authenticating our requests to the YouTube Data API
-        self.CLIENT_SECRETS_FILE = 'client_secret_384596001461-09jpm4o0m6ghp4sd2v6nu9l3s1u7ll2f.apps.googleusercontent.com.json'
-       
-        # This variable defines a message to display if the CLIENT_SECRETS_FILE is
-        # missing.
+        # Status codes returned for a resumable session that no longer exists on the server
+        self.EXPIRED_SESSION_STATUS_CODES = [404, 410]
+
+        # Optional UploadJournal used to resume uploads interrupted in an earlier run
+        self.journal = journal
+
+        # Chunk size used when none is given. Must be a multiple of 256KB.
+        self.DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+
+        # Size of each chunk sent by resumable uploads, -1 sends the whole file in one request.
+        # Journaled uploads are always chunked so progress is saved as the upload goes.
+        if chunk_size is None or (chunk_size == -1 and journal is not None):
+            chunk_size = self.DEFAULT_CHUNK_SIZE
+        self.chunk_size = chunk_size if chunk_size == -1 else align_chunk_size(chunk_size)
+
+        # Adapt the chunk size to the measured throughput and retries of each upload
+        self.adaptive_chunks = adaptive_chunks and self.chunk_size != -1
+
+        # This variable defines a message to display if the client secrets file is missing.
         self.MISSING_CLIENT_SECRETS_MESSAGE = ""
-        # WARNING: Please configure OAuth 2.0
-        # To make this sample run you will need to populate the client_secrets.json file
-        # found at:
-        # %s
-        # with information from the {{ Cloud Console }}
-        # {{ https://cloud.google.com/console }}
-        # For more information about the client_secrets.json file format, please visit:
-        # https://developers.google.com/api-client-library/python/guide/aaa_client_secrets
-        # """ % os.path.abspath(os.path.join(os.path.dirname(__file__),
-        #                                 self.CLIENT_SECRETS_FILE))
 
         # This OAuth 2.0 access scope allows an application to upload files to the
         # authenticated user's YouTube channel, but doesn't allow other types of access.
@@ -82,18 +138,47 @@ class YouTubeVideoManager:
         # Version of the YouTube API
         self.YOUTUBE_API_VERSION = 'v3'
 
-        # Privacy statuses we can use to set on YouTube videos
-        self.VALID_PRIVACY_STATUSES = ('public', 'private', 'unlisted')
 
+        # The ID of the playlist for the current Connect, if there is one
+        self.playlist_id = self.config.playlist_id
+
+        # Optional ChannelCatalog caching the videos on the channel between runs
+        self.catalog = catalog
+
+        # Optional QuotaScheduler every API request goes through
+        self.quota = quota
+
+        # Optional Telemetry recording the retries of uploads
+        self.telemetry = telemetry
+
+        # Set once the catalog has been brought up to date during this run
+        self._catalog_refreshed = False
+
+        # Credentials used to authorize the HTTP transports, set by get_authenticated_service
+        self.credentials = None
+
+        # httplib2.Http is not thread-safe so each thread gets its own authorized instance
+        self._thread_local = threading.local()
 
-        # The ID of the playlist for the current Connect
-        # In the future this playlist ID should be retrieved dynamically based on the 
-        # connect code
-        self.playlist_id = "PLKZSArYQptsMGIqYAJhCfyDvcUXCBna9u"
+        # The authenticated service is only built when the API is first used, unless one is
+        # passed in e.g. a service talking to the fake backend of the benchmarks
+        self._service = service
+        self._service_lock = threading.Lock()
 
-        # Get the authenticated service to use in requests to the API
-        self.service = self.get_authenticated_service()
+    @property
+    def service(self):
+        if self._service is None:
+            self.authenticate()
+        return self._service
 
+    def authenticate(self):
+        """
+            Build the authenticated service the first time it is needed
+        """
+        with self._service_lock:
+            if self._service is None:
+                self._service = self.get_authenticated_service()
+        return self._service
 
     # Authorize the request and store authorization credentials.
     def get_authenticated_service(self):
@@ -102,115 +187,323 @@ class YouTubeVideoManager:
             YouTube Data API
         """
 
-        store = file.Storage("youtube_video_manager-oauth2.json")
+        store = file.Storage(self.config.credentials_file)
 
         creds = store.get()
 
         if creds is None or creds.invalid:
-            flow = client.flow_from_clientsecrets(self.CLIENT_SECRETS_FILE,
+            flow = client.flow_from_clientsecrets(self.config.get_client_secrets_file(),
                 scope=self.YOUTUBE_UPLOAD_SCOPE,
                 message=self.MISSING_CLIENT_SECRETS_MESSAGE)
             creds = tools.run_flow(flow, store, cmd_flags())
-            
 
-        return build(self.YOUTUBE_API_SERVICE_NAME, self.YOUTUBE_API_VERSION,
-                        http=creds.authorize(httplib2.Http()))
+        self.credentials = creds
 
+        return build_from_document(self.get_discovery_document(), http=creds.authorize(build_http()))
 
-    def get_video_id_based_on_session_id(self, session_id):
+    def get_discovery_document(self):
         """
-            Retrieve a video id of a YouTube video based on a session_id
+            Gets the discovery document of the YouTube Data API from the cache file, so the
+            service is built without a request. The document shipped with the client library
+            is used to fill the cache, it is only fetched when the library has none.
         """
-        current_videos = self.get_current_youtube_videos_based_on_string(session_id)
-        if len(current_videos) == 1:
-            return current_videos[0][1]
-        else:
-            return False
+        cache_file = self.config.discovery_cache_file
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file) as document_file:
+                    return document_file.read()
+            except IOError as e:
+                print("Ignoring the unreadable discovery cache {0}: {1}".format(cache_file, e))
+
+        document = discovery_cache.get_static_doc(self.YOUTUBE_API_SERVICE_NAME, self.YOUTUBE_API_VERSION)
+        if document is None:
+            response, document = build_http().request(V2_DISCOVERY_URI.format(
+                api=self.YOUTUBE_API_SERVICE_NAME, apiVersion=self.YOUTUBE_API_VERSION))
+            if response.status >= 400:
+                raise HttpError(response, document, uri=V2_DISCOVERY_URI)
+            document = document.decode("utf-8")
+            # Make sure a bad response is not cached
+            json.loads(document)
+
+        if cache_file:
+            temporary_file = cache_file + ".tmp"
+            with open(temporary_file, "w") as document_file:
+                document_file.write(document)
+            os.replace(temporary_file, cache_file)
+        return document
+
+    def execute_request(self, request, http=None):
+        """
+            Execute an API request, through the quota scheduler when there is one. Retriable
+            errors are retried with exponential backoff.
+        """
+        def retry(send):
+            return self.call_with_retries(send, request.methodId)
 
-    def update_video_status(self, video_id, status):
+        if self.quota is not None:
+            return self.quota.execute(request, http=http, retry=retry)
+        return retry(lambda: request.execute(http=http))
+
+    def execute_batch(self, requests, callback, http=None):
         """
-            This method updates the status of a video based on the video_id and status provided.
+            Send requests, an ordered dict of request id -> request, to the HTTP batch endpoint
+            and call callback(request_id, response, exception) once for each of them. Requests
+            failing with a retriable error are sent again in a new batch with exponential
+            backoff, up to MAX_RETRIES times.
         """
-        # Call the API's videos.list method to retrieve the video resource.
-        # Get the current video details
-        videos_list_response = self.service.videos().list(
-            id=video_id,
-            part='status'
-        ).execute()
+        retry = 0
+        while requests:
+            retriable = {}
 
-        # If the response does not contain an array of 'items' then the video was
-        # not found.
-        if not videos_list_response['items']:
-            return False
+            def batch_callback(request_id, response, exception):
+                if exception is not None and self.is_retriable_error(exception) and retry < self.MAX_RETRIES:
+                    retriable[request_id] = exception
+                else:
+                    callback(request_id, response, exception)
 
-        # Since the request specified a video ID, the response only contains one
-        # video resource. This code extracts the snippet from that resource.
-        video_list_status = videos_list_response['items'][0]['status']
-        print(video_list_status)
-        input()
+            batch = self.service.new_batch_http_request(callback=batch_callback)
+            for request_id, request in requests.items():
+                batch.add(request, request_id=request_id)
+            self.call_with_retries(lambda: batch.execute(http=http), "batch")
+            if retriable:
+                retry += 1
+                self.wait_before_retry(retry, next(iter(retriable.values())), "batch")
+            requests = dict((request_id, requests[request_id]) for request_id in retriable)
 
-        # Set the privacy status of the video
-        if status:
-            video_list_status['privacyStatus'] = status
+    def is_retriable_error(self, error):
+        """
+            True if a request that failed with error may go through when sent again
+        """
+        if isinstance(error, HttpError):
+            return error.resp.status in self.RETRIABLE_STATUS_CODES
+        return isinstance(error, self.RETRIABLE_EXCEPTIONS)
 
-        # Update the video resource by calling the videos.update() method.
-        videos_update_response = self.service.videos().update(
-            part='status',
-            body=dict(
-            status=video_list_status,
-            id=video_id
-            )).execute()
+    def call_with_retries(self, call, name):
+        """
+            Returns call(), calling it again with exponential backoff while it fails with a
+            retriable error, up to MAX_RETRIES times
+        """
+        retry = 0
+        while True:
+            try:
+                return call()
+            except (HttpError,) + self.RETRIABLE_EXCEPTIONS as e:
+                if not self.is_retriable_error(e) or retry >= self.MAX_RETRIES:
+                    raise
+                retry += 1
+                self.wait_before_retry(retry, e, name)
 
-        return True
+    def wait_before_retry(self, retry, error, name):
+        """
+            Sleep before the retry-th attempt at sending the request name again
+        """
+        print("A retriable error occurred for {0}: {1}".format(name, error))
+        if self.telemetry is not None:
+            self.telemetry.record_retry("YouTube", name, error)
+        sleep_seconds = random.random() * 2 ** retry
+        print("Sleeping %f seconds and then retrying..." % sleep_seconds)
+        time.sleep(sleep_seconds)
+
+    def get_http(self):
+        """
+            Gets an authorized httplib2.Http object for the calling thread.
+            Worker threads must not share the transport used by self.service.
+        """
+        http = getattr(self._thread_local, "http", None)
+        if http is None:
+            self.authenticate()
+            # build_http stops httplib2 treating the 308 of a resumable upload as a redirect
+            http = build_http()
+            if self.credentials is not None:
+                http = self.credentials.authorize(http)
+            self._thread_local.http = http
+        return http
+
+    def get_access_token(self):
+        """
+            Gets a current OAuth 2.0 access token, refreshed when it has expired.
+            Used by clients that do not go through httplib2 such as the async client.
+        """
+        self.authenticate()
+        if self.credentials is None:
+            return ""
+        return self.credentials.get_access_token().access_token
 
+    def get_api_url(self):
+        """
+            Root of the REST endpoints the service talks to
+        """
+        return self.service._baseUrl + "youtube/v3/"
 
-    def get_current_youtube_videos_based_on_string(self, string):
+    def get_upload_url(self):
         """
-            Gets the current videos on YouTube that contain the specified string in
-            in the title or description
+            Root of the media upload endpoints the service talks to
         """
-        channels_response = self.service.channels().list(
+        return self.service._baseUrl + "upload/youtube/v3/"
+
+    def get_video_id_based_on_session_id(self, session_id):
+        """
+            Retrieve a video id of a YouTube video based on a session_id
+        """
+        if self.catalog is not None:
+            self.ensure_catalog_refreshed()
+            current_video_ids = self.catalog.get_video_ids(session_id)
+            if len(current_video_ids) == 1:
+                return current_video_ids[0]
+            return False
+        return self.find_video_ids([session_id]).get(normalize_session_id(session_id), False)
+
+    def find_video_ids(self, session_ids):
+        """
+            Returns the dictionary of normalized session id -> id of the newest video whose
+            title starts with the session id. The channel is only listed until every one of
+            session_ids is found.
+        """
+        wanted = set(normalize_session_id(session_id) for session_id in session_ids)
+        found = {}
+        if not wanted:
+            return found
+        for video in self.iter_channel_videos():
+            key = normalize_session_id(video.title)
+            if key in wanted and key not in found:
+                found[key] = video.video_id
+                if len(found) == len(wanted):
+                    break
+        return found
+
+    def get_uploads_playlist_id(self):
+        """
+            Gets the id of the playlist holding the videos uploaded to the authenticated
+            user's channel. The id is kept in the catalog so later runs skip channels.list.
+        """
+        if self.catalog is not None:
+            playlist_id = self.catalog.get_meta("uploads_playlist_id")
+            if playlist_id:
+                return playlist_id
+
+        channels_response = self.execute_request(self.service.channels().list(
             mine=True,
             part="contentDetails"
-            ).execute()
-
+            ))
+        playlist_id = channels_response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
 
-        for channel in channels_response["items"]:
-            # From the API response, extract the playlist ID that identifies the list
-            # of videos uploaded to the authenticated user's channel.
-            playlist_id = channel["contentDetails"]["relatedPlaylists"]["uploads"]
-            # print("ID: {0}".format(playlist_id))
+        if self.catalog is not None:
+            self.catalog.set_meta("uploads_playlist_id", playlist_id)
+        return playlist_id
 
-            # print("Videos in list %s" % playlist_id)
+    def iter_channel_videos(self, matching=None):
+        """
+            Yields a ChannelVideo for each upload of the channel, newest first. With matching,
+            a list of strings, only the videos with one of them in their title or description
+            are yielded. Pages of 50 are fetched as the generator is consumed so a caller can
+            stop early, and YouTube only sends the fields of a ChannelVideo.
+        """
+        matches = compile_video_matcher(matching) if matching is not None else None
 
-            # Retrieve the list of videos uploaded to the authenticated user's channel.
-            playlistitems_list_request = self.service.playlistItems().list(
-                playlistId=playlist_id,
-                part="snippet",
-                maxResults=50
-            )
+        playlistitems_list_request = self.service.playlistItems().list(
+            playlistId=self.get_uploads_playlist_id(),
+            part=CHANNEL_LISTING_PART,
+            fields=CHANNEL_LISTING_FIELDS,
+            maxResults=50
+        )
+        while playlistitems_list_request:
+            playlistitems_list_response = self.execute_request(playlistitems_list_request)
+            for playlist_item in playlistitems_list_response["items"]:
+                video = get_channel_video(playlist_item)
+                if matches is None or matches(video):
+                    yield video
+            playlistitems_list_request = self.service.playlistItems().list_next(
+                playlistitems_list_request, playlistitems_list_response)
 
+    def refresh_catalog(self, full=False):
+        """
+            Bring the catalog up to date with the channel.
+            The uploads playlist lists the newest videos first so an incremental refresh stops
+            paginating at the first item the catalog already holds. A full refresh rebuilds
+            the catalog from every page, which also picks up edits to older videos. Until a
+            full refresh has completed every refresh is a full one. The catalog is only
+            written once the listing has finished, so an interrupted refresh changes nothing.
+            Returns the number of videos added or updated.
+        """
+        if full or not self.catalog.is_complete():
+            full = True
+            updated = self.catalog.rebuild(self.iter_channel_videos())
+        else:
             videos = []
-            while playlistitems_list_request:
-                playlistitems_list_response = playlistitems_list_request.execute()
-
-                # Print information about each video.
-                for playlist_item in playlistitems_list_response["items"]:
-                    title = playlist_item["snippet"]["title"]
-                    video_id = playlist_item["snippet"]["resourceId"]["videoId"]
-                    if string.lower() in title:
-                        print("%s (%s)" % (title, video_id))
-                        videos.append([title,video_id])
-
-                playlistitems_list_request = self.service.playlistItems().list_next(
-                playlistitems_list_request, playlistitems_list_response)
-                
-            if len(videos) > 0:
-                return videos
-            else:
-                return False
+            for video in self.iter_channel_videos():
+                if self.catalog.knows(video.video_id, video.etag):
+                    break
+                videos.append(video)
+            self.catalog.upsert_videos(videos)
+            updated = len(videos)
+
+        self._catalog_refreshed = True
+        print("Channel catalog {0}: {1} video(s) added or updated, {2} known".format(
+            "rebuilt" if full else "refreshed", updated, len(self.catalog)))
+        return updated
+
+    def ensure_catalog_refreshed(self):
+        """
+            Refresh the catalog incrementally the first time it is used in a run
+        """
+        if not self._catalog_refreshed:
+            self.refresh_catalog()
 
-    def upload_video(self, options):
+    def update_video_status(self, video_id, status):
+        """
+            This method updates the status of a video based on the video_id and status provided.
+        """
+        return self.update_videos_metadata({video_id: {"privacyStatus": status}}) is not False
+
+    def update_videos_metadata(self, desired_metadata, use_batch_requests=True, verbose=False, http=None):
+        """
+            Update the metadata of many videos at once, see MetadataSync.sync.
+            Returns the list of the ids of updated videos or False if any video was not
+            found or failed to update. Pass an http object when updating from a worker thread.
+        """
+        metadata_sync = MetadataSync(self, use_batch_requests=use_batch_requests, verbose=verbose, http=http)
+        updated = metadata_sync.sync(desired_metadata)
+        if metadata_sync.failed or metadata_sync.missing:
+            return False
+        return updated
+
+
+    def get_current_youtube_videos_based_on_string(self, string):
+        """
+            Gets the current videos on YouTube that contain the specified string in
+            in the title or description, ignoring case. Returns a list of [title, video_id]
+            or False when no video matches.
+        """
+        if self.catalog is not None:
+            self.ensure_catalog_refreshed()
+            videos = self.catalog.search(string)
+        else:
+            videos = [[video.title, video.video_id] for video in self.iter_channel_videos(matching=[string])]
+
+        if len(videos) > 0:
+            return videos
+        else:
+            return False
+
+    def get_current_youtube_videos_based_on_strings(self, strings):
+        """
+            Lists the channel once for several strings e.g. the codes of the Connects of a
+            batch. Returns the dictionary of string -> list of [title, video_id] of the videos
+            with the string in their title or description.
+        """
+        if self.catalog is not None:
+            self.ensure_catalog_refreshed()
+            return dict((string, self.catalog.search(string)) for string in strings)
+
+        matchers = [(string, compile_video_matcher([string])) for string in strings]
+        videos = dict((string, []) for string in strings)
+        for video in self.iter_channel_videos(matching=strings):
+            for string, matches in matchers:
+                if matches(video):
+                    videos[string].append([video.title, video.video_id])
+        return videos
+
+    def upload_video(self, options, http=None, progress_callback=None, metrics=None):
         """
             Takes a dictionary of all video details e.g
             {
@@ -221,10 +514,69 @@ class YouTubeVideoManager:
                 "category": "28",
                 "privacyStatus": "private"
             }
+            plus an optional "media_file" to send instead of "file", e.g. a remuxed copy.
+            Returns the id of the uploaded video.
+            Pass an http object when uploading from a worker thread and a progress_callback
+            taking (bytes_uploaded, total_bytes) to be told about progress.
+            Pass an UploadMetrics object to collect the throughput, chunk and retry counts.
         """
         request  = self.get_upload_request(options)
+        media_file = options.get("media_file", options["file"])
+        # Carry on from an interrupted upload of the same file if there is one
+        self.resume_upload_request(request, media_file)
         # Output Details while uploading
-        self.resumable_upload(request, options["title"])
+        video_id = self.resumable_upload(request, options["title"], http=http,
+                                         progress_callback=progress_callback,
+                                         video_file=media_file, metrics=metrics)
+        # Keep the catalog in step so the next run knows about the upload
+        if self.catalog is not None:
+            self.catalog.upsert(video_id, options["title"], options["description"],
+                                privacy_status=options.get("privacyStatus"))
+        return video_id
+
+    def resume_upload_request(self, request, video_file):
+        """
+            Point an upload request at the resumable session journaled for video_file.
+            Returns True if the request will resume an earlier session.
+        """
+        if self.journal is None:
+            return False
+        entry = self.journal.get(video_file)
+        if entry is None:
+            return False
+        print("Resuming upload of {0} from byte {1}".format(video_file, entry["offset"]))
+        request.resumable_uri = entry["session_uri"]
+        request.resumable_progress = entry["offset"]
+        # Flagging the request as errored makes the next chunk query the server for the
+        # offset it actually acknowledged before sending any bytes.
+        request._in_error_state = True
+        return True
+
+    def start_resumable_session(self, request, http=None):
+        """
+            Open the resumable session for an upload request without sending any of the file.
+            This lets the session URI be journaled before the first byte leaves the machine.
+        """
+        headers = dict(request.headers)
+        headers["X-Upload-Content-Type"] = request.resumable.mimetype()
+        headers["X-Upload-Content-Length"] = str(request.resumable.size())
+        headers["content-length"] = str(request.body_size)
+        resp, content = (http or request.http).request(
+            request.uri, method=request.method, body=request.body, headers=headers)
+        if resp.status == 200 and "location" in resp:
+            request.resumable_uri = resp["location"]
+        else:
+            raise ResumableUploadError(resp, content)
+
+    def restart_resumable_session(self, request, video_file=None):
+        """
+            Drop the session of an upload request so the next chunk starts a new upload
+        """
+        request.resumable_uri = None
+        request.resumable_progress = 0
+        request._in_error_state = False
+        if self.journal is not None and video_file is not None:
+            self.journal.remove(video_file)
 
     def get_upload_request(self, options):
         """
@@ -270,29 +622,83 @@ class YouTubeVideoManager:
         # practice, but if you're using Python older than 2.6 or if you're
         # running on App Engine, you should set the chunksize to something like
         # 1024 * 1024 (1 megabyte).
-        media_body=MediaFileUpload(options["file"], chunksize=-1, resumable=True)
+        #
+        # The chunk size is configured through self.chunk_size and, in adaptive
+        # mode, changed between chunks by resumable_upload.
+        media_body=MediaFileUpload(options.get("media_file", options["file"]), chunksize=self.chunk_size, resumable=True)
         )
 
         return insert_request
 
-    def resumable_upload(self, request, title):
+    def resumable_upload(self, request, title, http=None, progress_callback=None, video_file=None,
+                         metrics=None):
         """
-            Creates a resumable upload
+            Creates a resumable upload and returns the id of the uploaded video.
+            Raises UploadError once the upload can no longer be retried and QuotaExceeded
+            when there is not enough quota left to upload the video.
+            When a journal is configured and video_file is given the session and offset are
+            journaled after each chunk.
         """
+        journaled = self.journal is not None and video_file is not None
+        if metrics is None:
+            metrics = UploadMetrics(title)
+        metrics.start()
+        sizer = None
+        if self.adaptive_chunks:
+            sizer = AdaptiveChunkSizer(request.resumable.chunksize())
         response = None
-        error = None
         retry = 0
+        session_charged = False
         while response is None:
+            error = None
             try:
-                print("Uploading {0} file...".format(title))
-                status, response = request.next_chunk()
+                # Starting a new upload session costs the quota of a videos.insert
+                if request.resumable_uri is None and self.quota is not None and not session_charged:
+                    self.quota.reserve("videos.insert")
+                    session_charged = True
+                if journaled and request.resumable_uri is None:
+                    self.start_resumable_session(request, http)
+                    self.journal.record(video_file, request.resumable_uri, 0)
+                if sizer is not None:
+                    request.resumable._chunksize = sizer.chunk_size
+                offset = request.resumable_progress
+                chunk_started = time.time()
+                status, response = request.next_chunk(http=http)
+                chunk_seconds = time.time() - chunk_started
+                uploaded = request.resumable.size() if response is not None else request.resumable_progress
+                metrics.record_chunk(uploaded - offset)
+                if sizer is not None:
+                    sizer.record_chunk(uploaded - offset, chunk_seconds)
+                # Only give up after MAX_RETRIES failures in a row, not over the whole file
+                retry = 0
+                if journaled and response is None:
+                    self.journal.record(video_file, request.resumable_uri, request.resumable_progress)
+                if status is not None:
+                    print("Uploading {0} file... {1:.1%}".format(title, status.progress()))
+                    if progress_callback is not None:
+                        progress_callback(status.resumable_progress, status.total_size)
                 if response is not None:
                     if 'id' in response:
+                        metrics.finish()
                         print("Video id '%s' was successfully uploaded." % response['id'])
+                        print(metrics.summary())
+                        if journaled:
+                            self.journal.remove(video_file)
+                        if progress_callback is not None:
+                            progress_callback(request.resumable.size(), request.resumable.size())
+                        return response['id']
                     else:
-                        exit("The upload failed with an unexpected response: %s" % response)
+                        raise UploadError("The upload failed with an unexpected response: %s" % response)
             except HttpError as e:
-                if e.resp.status in self.RETRIABLE_STATUS_CODES:
+                if e.resp.status in self.EXPIRED_SESSION_STATUS_CODES and request.resumable_uri is not None:
+                    error = "The upload session for {0} has expired, restarting the upload".format(title)
+                    self.restart_resumable_session(request, video_file)
+                    session_charged = False
+                elif is_quota_exceeded_error(e):
+                    if self.quota is not None:
+                        self.quota.exhausted()
+                    raise QuotaExceeded("YouTube reports the daily quota is used up")
+                elif e.resp.status in self.RETRIABLE_STATUS_CODES:
                     error = "A retriable HTTP error %d occurred:\n%s" % (e.resp.status,
                                                                             e.content)
                 else:
@@ -302,9 +708,14 @@ class YouTubeVideoManager:
 
             if error is not None:
                 print(error)
+                metrics.record_retry()
+                if self.telemetry is not None:
+                    self.telemetry.record_retry("YouTube", video_file or title, error)
+                if sizer is not None:
+                    sizer.record_retry()
                 retry += 1
                 if retry > self.MAX_RETRIES:
-                    exit("No longer attempting to retry.")
+                    raise UploadError("No longer attempting to retry.")
 
                 max_sleep = 2 ** retry
                 sleep_seconds = random.random() * max_sleep